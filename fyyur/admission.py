@@ -0,0 +1,142 @@
+import functools
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from flask import Response, current_app, request
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+# ----------------------------------------------------------------------------#
+# Admission control for the search routes.
+#
+# Rate limiting: a token bucket per client address. Buckets live in a small
+# SQLite file in WAL mode so every worker on the host draws from the same
+# bucket; each check is one short write transaction.
+#
+# Load shedding: a search is refused with 503 while this worker already has
+# SEARCH_SHED_DB_IN_FLIGHT database connections checked out, so detail
+# pages keep the pool under a burst.
+# ----------------------------------------------------------------------------#
+
+BUCKET_TTL = 3600  # Seconds before an idle client's bucket is dropped
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+
+@event.listens_for(Pool, 'checkout')
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+
+
+@event.listens_for(Pool, 'checkin')
+def _count_checkin(dbapi_connection, connection_record):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight = max(_in_flight - 1, 0)
+
+
+def in_flight_db():
+    """Database connections this worker currently has checked out."""
+    return _in_flight
+
+
+class RateLimiter:
+    def __init__(self):
+        self.path = None
+        self.rate = 1.0
+        self.burst = 10
+        self._local = threading.local()
+
+    def init_app(self, app):
+        self.path = app.config['RATE_LIMIT_PATH']
+        self.rate = app.config['SEARCH_RATE']
+        self.burst = app.config['SEARCH_BURST']
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                         'key TEXT PRIMARY KEY, '
+                         'tokens REAL NOT NULL, '
+                         'updated REAL NOT NULL)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=1.0,
+                               isolation_level=None)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def take(self, key):
+        """Spend a token for `key`. Returns seconds to wait, 0 if allowed."""
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets '
+                               'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst,
+                             row[0] + (now - row[1]) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = math.ceil((1 - tokens) / self.rate)
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, '
+                         'updated) VALUES (?, ?, ?)', (key, tokens, now))
+            # Occasional cleanup keeps the table to recently seen clients
+            if random.random() < 0.01:
+                conn.execute('DELETE FROM buckets WHERE updated < ?',
+                             (now - BUCKET_TTL,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+
+rate_limiter = RateLimiter()
+
+
+def guarded_search(view):
+    """Rate limit and load shed a search view."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        config = current_app.config
+        try:
+            wait = rate_limiter.take(request.remote_addr or 'unknown')
+        except sqlite3.Error:
+            # Fail open: a busy limiter file must not take search down
+            current_app.logger.warning('Rate limiter unavailable',
+                                       exc_info=True)
+            wait = 0
+        if wait:
+            return Response('Too many searches, slow down.\n', 429,
+                            {'Retry-After': str(wait)},
+                            mimetype='text/plain')
+        if in_flight_db() >= config['SEARCH_SHED_DB_IN_FLIGHT']:
+            current_app.logger.warning('Shedding search with %d DB '
+                                       'connections busy', in_flight_db())
+            return Response('Search is busy, try again shortly.\n', 503,
+                            {'Retry-After':
+                             str(config['SEARCH_RETRY_AFTER'])},
+                            mimetype='text/plain')
+        return view(*args, **kwargs)
+    return wrapper
@@ -1,8 +1,8 @@
 # ----------------------------------------------------------------------------#
 # Imports
 # ----------------------------------------------------------------------------#
-import traceback
-
+import click
+import json
 import dateutil.parser
 import babel
 from flask import (
@@ -11,15 +11,47 @@ from flask import (
     request,
     flash,
     redirect,
-    url_for
+    url_for,
+    jsonify,
+    abort,
+    send_file,
+    Response
 )
 from flask_moment import Moment
-import logging
-from logging import Formatter, FileHandler
 from flask_wtf import CSRFProtect
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 from models import *
 from forms import VenueForm, ArtistForm, ShowForm
+from logging_pipeline import setup_logging
+from profiling import setup_profiling, traced
+from memory_profiling import memory_monitor
+from templating import render_page, setup_templates, stream_template
+from admission import rate_limiter, guarded_search
+from autocomplete import artist_index, venue_index
+from geo import covering_cells, haversine
+import partitions
+import rollups
+import stats_cube
+from image_cache import image_cache, image_attrs, link_version
+from recommendations import (
+    forget_artist,
+    similar_artists,
+    refresh_similarities
+)
+import matching
+import changes
+import jobs
+import live
+import projections
+import queries
+import read_model
+from database import backend, create_schema, setup_sessions, unit_of_work
+from compression import compressor
+from read_model import PAST_SHOWS_PER_PAGE
+from search_index import search_index
+from catalog import catalog
+from live import broker
 
 # ----------------------------------------------------------------------------#
 # App Config.
@@ -28,9 +60,26 @@ from forms import VenueForm, ArtistForm, ShowForm
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+if app.config['PROXY_HOPS']:
+    hops = app.config['PROXY_HOPS']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops,
+                            x_host=hops)
 csrf = CSRFProtect(app)
 db.init_app(app)
+setup_sessions(app)
 migrate = Migrate(app, db)
+if app.config['DATABASE_CREATE_SCHEMA']:
+    create_schema(app)
+setup_logging(app)
+search_index.init_app(app)
+catalog.init_app(app)
+image_cache.init_app(app)
+memory_monitor.init_app(app)
+rate_limiter.init_app(app)
+compressor.init_app(app)
+broker.init_app(app)
+artist_index.init_app(app)
+venue_index.init_app(app)
 
 
 # ----------------------------------------------------------------------------#
@@ -49,6 +98,9 @@ def format_datetime(value, format='medium'):
 
 
 app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.globals['image_attrs'] = image_attrs
+setup_profiling(app)
+setup_templates(app)
 
 
 # ----------------------------------------------------------------------------#
@@ -65,74 +117,109 @@ def index():
 
 @app.route('/venues')
 def venues():
-    body = []  # Hold final list of data
-    try:
-        all_venues = Venue.query.all()
-        locations = Venue.query.distinct(Venue.city, Venue.state).all()
-        for location in locations:
-            body.append({
-                "city": location.city,
-                "state": location.state,
-                # Set comprehension
-                "venues": [{
-                    "id": venue.id,
-                    "name": venue.name,
-                    "num_upcoming_shows":
-                        len([show for show in venue.shows
-                             if show.start_time > datetime.now()])
-                } for venue in all_venues if venue.city == location.city
-                    and venue.state == location.state]
-            })
+    def areas(upcoming):
+        try:
+            yield from projections.venue_areas(upcoming)
+        except Exception:
+            app.logger.exception('Something went wrong with loading the '
+                                 'Venue page')
 
-    except Exception as e:
-        print(f'Something went wrong with loading the Venue page: '
-              f'{traceback.format_exc(), e}')
+    upcoming = {}
+    try:
+        # Only the upcoming partitions of shows are scanned
+        upcoming = queries.upcoming_counts('venue')
+    except Exception:
+        app.logger.exception('Something went wrong with loading the '
+                             'Venue page')
 
-    return render_template('pages/venues.html', areas=body)
+    return stream_template('pages/venues.html', areas=areas(upcoming))
 
 
 @app.route('/venues/search', methods=['GET', 'POST'])
+@guarded_search
 def search_venues():
     venue_list = []
     if request.method == 'POST':
         search_term = request.form.get('search_term', '')
-        possible_venues = Venue.query.filter(
-            Venue.name.ilike(f'%{search_term}%'))
-        for venue in possible_venues:
-            venue_list.append({
-                "id": venue.id,
-                "name": venue.name,
-                "num_upcoming_shows":
-                    len([show for show in venue.shows
-                        if show.start_time > datetime.now()])
-            })
+        venue_list = search_results(search_term, 'venue')
 
     response = {
         "count": len(venue_list),
         "data": venue_list
     }
-    return render_template('pages/search_venues.html', results=response,
-                           search_term=request.form.get('search_term', ''))
+    return render_page('pages/search_venues.html',
+                       'fragments/search_venues.html', results=response,
+                       search_term=request.form.get('search_term', ''))
+
+
+# Radius is in miles. Only venues with upcoming shows are listed.
+@app.route('/venues/near')
+def venues_near():
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    radius = min(request.args.get('radius', 25, type=float), 500)
+    body = []
+    if lat is not None and lng is not None:
+        cells = covering_cells(lat, lng, radius)
+        candidates = Venue.query \
+            .with_entities(Venue.id, Venue.name, Venue.city, Venue.state,
+                           Venue.latitude, Venue.longitude) \
+            .filter(db.or_(*[Venue.geohash.startswith(cell)
+                             for cell in cells])) \
+            .all()
+        nearby = {}
+        for venue in candidates:
+            distance = haversine(lat, lng, venue.latitude, venue.longitude)
+            if distance <= radius:
+                nearby[venue.id] = (venue, distance)
+
+        upcoming = queries.upcoming_counts('venue', nearby.keys())
+
+        for venue_id, num_upcoming_shows in upcoming.items():
+            venue, distance = nearby[venue_id]
+            body.append({
+                "id": venue.id,
+                "name": venue.name,
+                "city": venue.city,
+                "state": venue.state,
+                "distance": round(distance, 1),
+                "num_upcoming_shows": num_upcoming_shows
+            })
+        body.sort(key=lambda v: v['distance'])
+
+    return render_template('pages/venues_near.html', venues=body,
+                           lat=lat, lng=lng, radius=radius)
 
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
-    venue = None
-    try:
-        venue = Venue.query.get(venue_id)
-        # Clean multi-value string data from database
-        venue.genres = venue.genres.replace('{', '') \
-            .replace('}', '') \
-            .split(',')
-        venue.past_shows = get_shows('venue', 'past', venue_id)
-        venue.past_shows_count = len(venue.past_shows)
-        venue.upcoming_shows = get_shows('venue', 'upcoming', venue_id)
-        venue.upcoming_shows_count = len(venue.upcoming_shows)
-    except Exception as e:
-        print(e)
+    page = max(request.args.get('past_page', 1, type=int), 1)
+    # One primary-key read; only later past pages query shows
+    venue = read_model.load('venue', venue_id)
+    if venue is None:
+        abort(404)
+    if page > 1:
+        venue['past_shows'] = get_shows(
+            'venue', 'past', venue_id, limit=PAST_SHOWS_PER_PAGE,
+            offset=(page - 1) * PAST_SHOWS_PER_PAGE)
+    venue['past_page'] = page
+    venue['past_pages'] = \
+        -(-venue['past_shows_count'] // PAST_SHOWS_PER_PAGE)
     return render_template('pages/show_venue.html', venue=venue)
 
 
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+    venue = Venue.query.get_or_404(venue_id)
+    page = max(request.args.get('page', 1, type=int), 1)
+    matches, total = matching.venue_matches(venue, page)
+    return render_template('pages/matches.html', entity=venue,
+                           kind='artist', matches=matches, total=total,
+                           page=page, per_page=10,
+                           endpoint='venue_matches',
+                           endpoint_args={'venue_id': venue_id})
+
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -148,39 +235,49 @@ def create_venue_submission():
 
     if form.validate():
         try:
-            venue = Venue()
-            form.populate_obj(venue)
-            db.session.add(venue)
-            db.session.commit()
+            with unit_of_work() as session:
+                venue = Venue()
+                form.populate_obj(venue)
+                venue.update_location()
+                session.add(venue)
+                session.flush()
+                read_model.rebuild('venue', venue.id)
+            venue_index.invalidate()
+            matching.update_venue(venue)
             flash(f'{request.form["name"]} was successfully listed!')
-        except ValueError as e:
-            print(e)
+        except ValueError:
+            app.logger.exception('Could not create venue')
             flash(f'Venue "{request.form["name"]}" could not be listed.',
                   'error')
-        finally:
-            db.session.close()
-
     else:
-        flash(form.errors)
-        return render_template('forms/new_venue.html', form=form)
+        flash(form.errors, 'error')
+        return render_page('forms/new_venue.html', 'fragments/flashes.html',
+                           form=form)
 
-    return render_template('pages/home.html')
+    return render_page('pages/home.html', 'fragments/flashes.html')
 
 
 @app.route('/venues/<venue_id>', methods=['POST', 'DELETE'])
 def delete_venue(venue_id):
-    venue = Venue.query.get(venue_id)
     try:
-        name = venue.name
-        db.session.delete(venue)
-        db.session.commit()
+        with unit_of_work() as session:
+            venue = Venue.query.get(venue_id)
+            name = venue.name
+            # The venue's shows go with it. Bulk deletes, because the ORM
+            # would blank the shows' key columns instead; the rollups and
+            # search docs built from them are purged in the background
+            session.expunge(venue)
+            changes.delete_where(Show, Show.venue_id == venue.id)
+            changes.delete_where(Venue, Venue.id == venue.id)
+            read_model.rebuild('venue', venue.id)
+        venue_index.invalidate()
+        matching.remove_venue(int(venue_id))
         flash(f'Venue "{name}" was successfully deleted.')
-    except Exception as e:
-        print(e)
-        db.session.rollback()
+    except Exception:
+        app.logger.exception('Could not delete venue %s', venue_id)
         flash(f'Venue could not be deleted.', 'error')
 
-    return render_template('pages/home.html')
+    return render_page('pages/home.html', 'fragments/flashes.html')
 
 #  Artists
 #  ----------------------------------------------------------------
@@ -188,66 +285,76 @@ def delete_venue(venue_id):
 
 @app.route('/artists')
 def artists():
-    all_artists = Artist.query.all()
-    return render_template('pages/artists.html', artists=all_artists)
+    return stream_template('pages/artists.html',
+                           artists=projections.artist_items())
 
 
 @app.route('/artists/search', methods=['POST'])
+@guarded_search
 def search_artists():
     artist_list = []
     if request.method == 'POST':
-        search_term = request.form.get('search_term')
-        all_artists = Artist.query.all()
-        for artist in all_artists:
-            if search_term.lower() in artist.name.lower():
-                artist_list.append({
-                    "id": artist.id,
-                    "name": artist.name,
-                    "num_upcoming_shows": 0
-                })
+        search_term = request.form.get('search_term', '')
+        artist_list = search_results(search_term, 'artist')
 
     response = {
         "count": len(artist_list),
         "data": artist_list
     }
-    return render_template('pages/search_artists.html', results=response,
-                           search_term=request.form.get('search_term', ''))
+    return render_page('pages/search_artists.html',
+                       'fragments/search_artists.html', results=response,
+                       search_term=request.form.get('search_term', ''))
 
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
-    artist = None
-    try:
-        artist = Artist.query.get(artist_id)
-        # Clean multi-value string data from database
-        artist.genres = artist.genres.replace('{', '') \
-            .replace('}', '') \
-            .split(',')
-        artist.past_shows = get_shows('artist', 'past', artist_id)
-        artist.past_shows_count = len(artist.past_shows)
-        artist.upcoming_shows = get_shows('artist', 'upcoming', artist_id)
-        artist.upcoming_shows_count = len(artist.upcoming_shows)
-    except Exception as e:
-        print(e)
-
+    page = max(request.args.get('past_page', 1, type=int), 1)
+    # One primary-key read; only later past pages query shows
+    artist = read_model.load('artist', artist_id)
+    if artist is None:
+        abort(404)
+    if page > 1:
+        artist['past_shows'] = get_shows(
+            'artist', 'past', artist_id, limit=PAST_SHOWS_PER_PAGE,
+            offset=(page - 1) * PAST_SHOWS_PER_PAGE)
+    artist['past_page'] = page
+    artist['past_pages'] = \
+        -(-artist['past_shows_count'] // PAST_SHOWS_PER_PAGE)
+    artist['similar_artists'] = similar_artists(artist_id)
     return render_template('pages/show_artist.html', artist=artist)
 
 
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+    artist = Artist.query.get_or_404(artist_id)
+    page = max(request.args.get('page', 1, type=int), 1)
+    matches, total = matching.artist_matches(artist, page)
+    return render_template('pages/matches.html', entity=artist,
+                           kind='venue', matches=matches, total=total,
+                           page=page, per_page=10,
+                           endpoint='artist_matches',
+                           endpoint_args={'artist_id': artist_id})
+
+
 @app.route('/artists/<artist_id>', methods=['POST', 'DELETE'])
 def delete_artist(artist_id):
-    artist = Artist.query.get(artist_id)
     try:
-        name = artist.name
-        db.session.delete(artist)
-        db.session.commit()
+        with unit_of_work() as session:
+            artist = Artist.query.get(artist_id)
+            name = artist.name
+            forget_artist(artist.id)
+            # Same bulk deletes as delete_venue
+            session.expunge(artist)
+            changes.delete_where(Show, Show.artist_id == artist.id)
+            changes.delete_where(Artist, Artist.id == artist.id)
+            read_model.rebuild('artist', artist.id)
+        artist_index.invalidate()
+        matching.remove_artist(int(artist_id))
         flash(f'Artist {name} was successfully deleted.')
-    except Exception as e:
-        print(e)
-        db.session.rollback()
+    except Exception:
+        app.logger.exception('Could not delete artist %s', artist_id)
         flash(f'Artist could not be deleted.', 'error')
-    finally:
-        db.session.close()
-    return render_template('pages/home.html')
+    return render_page('pages/home.html', 'fragments/flashes.html')
 
 
 #  Update
@@ -268,15 +375,18 @@ def edit_artist_submission(artist_id):
 
     if form.validate():
         try:
-            existing_artist = Artist.query.get(artist_id)
-            form.populate_obj(existing_artist)
-            db.session.commit()
+            with unit_of_work():
+                existing_artist = Artist.query.get(artist_id)
+                form.populate_obj(existing_artist)
+                # The redirect shows this page next, so it cannot wait for
+                # the change feed; the pages it appears on can
+                read_model.rebuild('artist', artist_id)
+            artist_index.invalidate()
+            matching.update_artist(existing_artist)
             flash(f'Artist was successfully updated.')
-        except ValueError as e:
-            print(e)
+        except ValueError:
+            app.logger.exception('Could not update artist %s', artist_id)
             flash(f'Artist could not be updated', 'error')
-        finally:
-            db.session.close()
     else:
         flash(form.errors)
         return render_template('forms/edit_artist.html',
@@ -300,15 +410,17 @@ def edit_venue_submission(venue_id):
 
     if form.validate():
         try:
-            existing_venue = Venue.query.get(venue_id)
-            form.populate_obj(existing_venue)
-            db.session.commit()
+            with unit_of_work():
+                existing_venue = Venue.query.get(venue_id)
+                form.populate_obj(existing_venue)
+                existing_venue.update_location()
+                read_model.rebuild('venue', venue_id)
+            venue_index.invalidate()
+            matching.update_venue(existing_venue)
             flash(f'Venue was successfully updated.')
-        except ValueError as e:
-            print(e)
+        except ValueError:
+            app.logger.exception('Could not update venue %s', venue_id)
             flash(f'Venue could not be updated', 'error')
-        finally:
-            db.session.close()
     else:
         flash(form.errors)
         return render_template('forms/edit_venue.html',
@@ -333,22 +445,25 @@ def create_artist_submission():
 
     if form.validate():
         try:
-            new_artist = Artist()
-            form.populate_obj(new_artist)
-            db.session.add(new_artist)
-            db.session.commit()
+            with unit_of_work() as session:
+                new_artist = Artist()
+                form.populate_obj(new_artist)
+                session.add(new_artist)
+                session.flush()
+                read_model.rebuild('artist', new_artist.id)
+            artist_index.invalidate()
+            matching.update_artist(new_artist)
             flash(f'{request.form["name"]} was successfully listed!')
-        except ValueError as e:
-            print(e)
+        except ValueError:
+            app.logger.exception('Could not create artist')
             flash(f'Artist {request.form["name"]} could not be listed.',
                   'error')
-        finally:
-            db.session.close()
     else:
-        flash(form.errors)
-        return render_template('forms/new_artist.html', form=form)
+        flash(form.errors, 'error')
+        return render_page('forms/new_artist.html', 'fragments/flashes.html',
+                           form=form)
 
-    return render_template('pages/home.html')
+    return render_page('pages/home.html', 'fragments/flashes.html')
 
 
 #  Shows
@@ -356,27 +471,8 @@ def create_artist_submission():
 
 @app.route('/shows')
 def shows():
-    data = []
-    shows_query_result = Show.query.all()
-    for results in shows_query_result:
-        data.append({
-            "venue_id": results.venue_id,
-            "venue_name":
-                Venue.query
-                .get(results.venue_id)
-                .name,
-            "artist_id": results.artist_id,
-            "artist_name":
-                Artist.query
-                .get(results.artist_id)
-                .name,
-            "artist_image_link":
-                Artist.query
-                .get(results.artist_id)
-                .image_link,
-            "start_time": str(results.start_time)
-        })
-    return render_template('pages/shows.html', shows=data)
+    return stream_template('pages/shows.html',
+                           shows=projections.show_tiles())
 
 
 @app.route('/shows/create')
@@ -390,23 +486,158 @@ def create_shows():
 def create_show_submission():
     form = ShowForm(request.form)
 
+    tile = None
     if form.validate():
         try:
-            new_show = Show()
-            form.populate_obj(new_show)
-            db.session.add(new_show)
-            db.session.commit()
+            with unit_of_work() as session:
+                new_show = Show()
+                form.populate_obj(new_show)
+                session.add(new_show)
+                read_model.rebuild('venue', int(new_show.venue_id))
+                read_model.rebuild('artist', int(new_show.artist_id))
             flash('Show was successfully listed!')
-        except ValueError as e:
-            flash('Show was not listed.')
-            print(f'There was an issue with inserting the show: {e}')
-        finally:
-            db.session.close()
+            tile = projections.show_tile(int(new_show.venue_id),
+                                         int(new_show.artist_id),
+                                         new_show.start_time)
+        except ValueError:
+            flash('Show was not listed.', 'error')
+            app.logger.exception('There was an issue with inserting the show')
     else:
-        flash("There was an issue with your form.")
-        render_template('forms/new_show.html', form=form)
+        flash("There was an issue with your form.", 'error')
+        return render_page('forms/new_show.html', 'fragments/new_show.html',
+                           form=form)
 
-    return render_template('pages/home.html')
+    return render_page('pages/home.html', 'fragments/new_show.html',
+                       tile=tile)
+
+
+#  Search
+#  ----------------------------------------------------------------
+
+@app.route('/search')
+@guarded_search
+def search():
+    search_term = request.args.get('q', '')
+    results = search_index.search(search_term, limit=50)
+    return render_page('pages/search.html', 'fragments/search.html',
+                       results=results, search_term=search_term)
+
+
+# Kind: artist, venue
+def search_results(search_term, kind):
+    matches = search_index.search(search_term, kinds=(kind,), limit=100)
+    upcoming = queries.upcoming_counts(kind,
+                                       [match['id'] for match in matches])
+    return [{
+        "id": match['id'],
+        "name": match['title'],
+        "num_upcoming_shows": upcoming.get(match['id'], 0)
+    } for match in matches]
+
+
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@app.route('/autocomplete/artists')
+def autocomplete_artists():
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(artist_index.search(request.args.get('q', ''), limit))
+
+
+@app.route('/autocomplete/venues')
+def autocomplete_venues():
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    return jsonify(venue_index.search(request.args.get('q', ''), limit))
+
+
+#  Images
+#  ----------------------------------------------------------------
+
+@app.route('/img/<any(artist, venue):kind>/<int:model_id>/<int:width>')
+def thumbnail(kind, model_id, width):
+    if width not in image_cache.widths:
+        abort(404)
+    image_link = queries.image_link(kind, model_id)
+    if not image_link:
+        abort(404)
+
+    image_format = image_cache.negotiate(request.headers.get('Accept', ''))
+    try:
+        path, mimetype = image_cache.variant(image_link, width, image_format)
+    except Exception as e:
+        app.logger.warning('Could not build a thumbnail of %s: %s',
+                           image_link, e)
+        return redirect(image_link)
+
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    response.vary.add('Accept')
+    # The v parameter changes with image_link, so a matching URL never
+    # needs revalidating
+    if request.args.get('v') == link_version(image_link):
+        response.headers['Cache-Control'] = \
+            'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
+
+
+#  Admin
+#  ----------------------------------------------------------------
+
+@app.route('/admin/stats')
+def admin_stats():
+    # Served entirely from the pre-aggregated cube
+    state = request.args.get('state')
+    city = request.args.get('city')
+    genre = request.args.get('genre')
+    stats = stats_cube.drill_down(state, city, genre)
+    return render_template('pages/stats.html', stats=stats, state=state,
+                           city=city, genre=genre)
+
+
+@app.route('/admin/memory')
+def admin_memory():
+    return render_template('pages/memory.html',
+                           memory=memory_monitor.report())
+
+
+@app.route('/admin/memory/metrics')
+def admin_memory_metrics():
+    return memory_monitor.metrics(), 200, \
+        {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+@app.route('/admin/changes')
+def admin_changes():
+    # Change feed for consumers outside this app; resume with ?after=<next>
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    batch = changes.read(after, limit)
+    return jsonify({
+        "changes": [changes.as_dict(change) for change in batch],
+        "next": batch[-1].id if batch else after
+    })
+
+
+@app.route('/live')
+def live_updates():
+    # Subscribe before reading the backlog so nothing falls between them;
+    # the stream skips whatever arrives twice
+    subscriber = broker.subscribe()
+    backlog, reset = [], False
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is not None:
+        batch = changes.read(after, broker.backlog + 1)
+        if len(batch) > broker.backlog:
+            reset = True
+        else:
+            backlog = live.frames(batch)
+    # Not stream_with_context: the session goes back to the pool at
+    # teardown instead of staying checked out for the whole stream
+    return Response(broker.stream(subscriber, backlog, reset),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
 
 
 @app.errorhandler(404)
@@ -419,57 +650,216 @@ def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s'
-                  '[in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
+@app.cli.command('geocode-venues')
+def geocode_venues():
+    """Fill venue coordinates from the bundled gazetteer."""
+    located = 0
+    all_venues = Venue.query.all()
+    for venue in all_venues:
+        located += venue.update_location()
+    db.session.commit()
+    print(f'Located {located} of {len(all_venues)} venues.')
+
+
+@app.cli.command('recommend-artists')
+@click.option('--full', is_flag=True,
+              help='Recompute every artist, not just stale ones.')
+def recommend_artists(full):
+    """Refresh the similar-artist table."""
+    updated = refresh_similarities(full=full)
+    print(f'Updated recommendations for {updated} artists.')
+
+
+@app.cli.command('worker')
+@click.option('--queue', 'queues', multiple=True,
+              help='Consume only this queue; repeat for several.')
+@click.option('--drain', is_flag=True,
+              help='Run due jobs in this process until none are left.')
+def worker(queues, drain):
+    """Run background jobs until interrupted."""
+    if drain:
+        print(f'Ran {jobs.drain(list(queues))} jobs.')
+    else:
+        jobs.run_pool(app, list(queues))
+
+
+@app.cli.group('changes')
+def changes_cli():
+    """Read and trim the catalog change feed."""
+
+
+@changes_cli.command('read')
+@click.option('--after', default=0, help='Offset to read from.')
+@click.option('--limit', default=100)
+def read_changes(after, limit):
+    for change in changes.read(after, limit):
+        print(json.dumps(changes.as_dict(change)))
+
+
+@changes_cli.command('prune')
+@click.option('--days', default=None, type=int,
+              help='Keep this many days (default CHANGE_FEED_RETENTION_DAYS).')
+def prune_changes(days):
+    days = days if days is not None else \
+        app.config['CHANGE_FEED_RETENTION_DAYS']
+    print(f'Deleted {changes.prune(days)} changes.')
+
+
+@app.cli.group('page-documents')
+def page_documents_cli():
+    """Maintain the venue and artist detail page documents."""
+
+
+@page_documents_cli.command('rebuild')
+def rebuild_page_documents():
+    print(f'Rebuilt {read_model.rebuild_all()} page documents.')
+
+
+@page_documents_cli.command('check')
+@click.option('--fix', is_flag=True, help='Rebuild what does not match.')
+def check_page_documents(fix):
+    """Compare stored documents with the catalog."""
+    problems = read_model.check(fix=fix)
+    for kind, entity_id, problem in problems:
+        print(f'{kind} {entity_id}: {problem}')
+    print(f'{len(problems)} problems{" fixed" if fix and problems else ""}.')
+
+
+@app.cli.command('init-db')
+def init_db():
+    """Create a SQLite database's tables from the models."""
+    if backend() != 'sqlite':
+        raise click.ClickException(
+            'Postgres schemas come from `flask db upgrade`.')
+    create_schema(app)
+    print(f'Created the schema in {app.config["SQLALCHEMY_DATABASE_URI"]}.')
+
+
+@app.cli.command('build-search-index')
+def build_search_index():
+    """Rebuild the shared search index from the database."""
+    search_index.rebuild()
+    print(f'Wrote {search_index.path}.')
+
+
+@app.cli.command('build-catalog-snapshot')
+def build_catalog_snapshot():
+    """Rebuild the shared venue and artist name snapshot."""
+    catalog.rebuild()
+    print(f'Wrote {catalog.path}.')
+
+
+@app.cli.command('bench-queries')
+@click.option('-n', default=2000, show_default=True,
+              help='Calls per query.')
+def bench_queries(n):
+    """Time the hot queries built per call against their baked forms."""
+    print(f'{"query":<18}{"compile µs":>12}{"plain µs":>12}{"baked µs":>12}')
+    for row in queries.benchmark(n):
+        print(f'{row["query"]:<18}{row["compile_us"]:>12.1f}'
+              f'{row["plain_us"]:>12.1f}{row["baked_us"]:>12.1f}')
+
+
+@app.cli.command('bench-listings')
+def bench_listings():
+    """Compare the list pages' entity reads with their projections."""
+    print(f'{"listing":<10}{"items":>8}{"entity ms":>12}{"proj. ms":>12}'
+          f'{"entity KiB":>12}{"proj. KiB":>12}')
+    for row in projections.benchmark():
+        print(f'{row["listing"]:<10}{row["items"]:>8}'
+              f'{row["entity_ms"]:>12.1f}{row["projected_ms"]:>12.1f}'
+              f'{row["entity_peak_kb"]:>12.0f}'
+              f'{row["projected_peak_kb"]:>12.0f}')
+
+
+@app.cli.command('refresh-stats-cube')
+def refresh_stats_cube():
+    """Rebuild the admin stats cube. Run this from cron."""
+    print(f'Wrote {stats_cube.refresh_cube()} cube cells.')
+
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups():
+    """Recompute the monthly venue and artist show rollups."""
+    print(f'Wrote {rollups.rebuild_all()} monthly rollups.')
+
+
+@app.cli.group('partitions')
+def partitions_cli():
+    """Manage the start_time partitions of the shows table."""
+
+
+@partitions_cli.command('list')
+def list_partitions():
+    if not partitions.is_partitioned():
+        raise click.ClickException('shows is not a partitioned table.')
+    for name in partitions.list_partitions():
+        print(name)
+
+
+@partitions_cli.command('extend')
+@click.option('--months', default=12, show_default=True,
+              help='How far ahead to create monthly partitions.')
+def extend_partitions(months):
+    """Create upcoming monthly partitions. Run this from cron."""
+    if not partitions.is_partitioned():
+        raise click.ClickException('shows is not a partitioned table.')
+    created = partitions.ensure_monthly_partitions(months_ahead=months)
+    db.session.commit()
+    print(f'Created {len(created)} partitions.')
+
+
+@partitions_cli.command('detach')
+@click.argument('before', type=click.DateTime(formats=['%Y-%m-%d']))
+def detach_old_partitions(before):
+    """Detach partitions ending on or before BEFORE for archiving."""
+    if not partitions.is_partitioned():
+        raise click.ClickException('shows is not a partitioned table.')
+    for name in partitions.detach_partitions(before.date()):
+        print(f'Detached {name}')
+    db.session.commit()
+
+
+@app.before_first_request
+def load_search_index():
+    # Maps the shared files, building them first if no worker has yet
+    search_index.current()
+    catalog.current()
 
 
 # Model type: past, upcoming
 # Show type: venue, artist
 # Model Id: From current page
-def get_shows(model_type, show_type, model_id):
+# Past shows come most recent first; limit and offset page through them
+@traced('get_shows')
+def get_shows(model_type, show_type, model_id, limit=None, offset=0):
     shows_raw = None
     body = []
     try:
-        if show_type == 'past':
-            shows_raw = Show.query \
-                .join(Artist) \
-                .join(Venue) \
-                .filter(Show.start_time < datetime.now()) \
-                .all()
-        elif show_type == 'upcoming':
-            shows_raw = Show.query \
-                .join(Artist) \
-                .join(Venue) \
-                .filter(Show.start_time > datetime.now()) \
-                .all()
+        shows_raw = queries.shows_for(model_type, show_type, model_id,
+                                      limit, offset)
+        snapshot = catalog.current()
         for show in shows_raw:
-            if model_type == 'venue' and show.venue_id == model_id:
-                artist = Artist.query.get(show.artist_id)
+            if model_type == 'venue':
+                name, image_link = \
+                    catalog.lookup('artist', show.artist_id, snapshot)
                 body.append({
-                    "artist_id": artist.id,
-                    "artist_name": artist.name,
-                    "artist_image_link": artist.image_link,
+                    "artist_id": show.artist_id,
+                    "artist_name": name,
+                    "artist_image_link": image_link,
                     "start_time": str(show.start_time)
                 })
-            elif model_type == 'artist' and show.artist_id == model_id:
-                venue = Venue.query.get(show.venue_id)
+            elif model_type == 'artist':
+                name, image_link = \
+                    catalog.lookup('venue', show.venue_id, snapshot)
                 body.append({
-                    "venue_id": venue.id,
-                    "venue_name": venue.name,
-                    "venue_image_link": venue.image_link,
+                    "venue_id": show.venue_id,
+                    "venue_name": name,
+                    "venue_image_link": image_link,
                     "start_time": str(show.start_time)
                 })
-    except Exception as e:
-        print("An issue with db.session.query() occurred.")
-        print(traceback.format_exc(), e)
+    except Exception:
+        app.logger.exception('An issue with db.session.query() occurred.')
     return body
 
 # ----------------------------------------------------------------------------#
@@ -0,0 +1,126 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+
+from models import Artist, Venue
+
+
+# ----------------------------------------------------------------------------#
+# Prefix index.
+# ----------------------------------------------------------------------------#
+
+class PrefixIndex:
+    """Sorted (key, word position, id, name) entries searched with bisect.
+
+    Answers for a prefix are cached until the next invalidate(), which
+    the create, edit and delete routes call after committing; the next
+    search rebuilds the index. Other workers' edits are picked up by a
+    rebuild on a background thread once the index is AUTOCOMPLETE_MAX_AGE
+    seconds old, while searches keep reading the old one.
+    """
+
+    def __init__(self, model, cache_size=1024):
+        self.model = model
+        self.cache_size = cache_size
+        self.app = None
+        self.max_age = 60
+        self._entries = None
+        self._keys = []
+        self._built_at = 0
+        self._generation = 0  # Bumped by invalidate()
+        self._refreshing = False
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.max_age = app.config['AUTOCOMPLETE_MAX_AGE']
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+            self._generation += 1
+            self._cache.clear()
+
+    def _load(self):
+        rows = self.model.query \
+            .with_entities(self.model.id, self.model.name) \
+            .all()
+        entries = []
+        for model_id, name in rows:
+            # Index every word so "Park" finds "The Musical Hop Park"
+            words = name.lower().split()
+            for i in range(len(words)):
+                entries.append((' '.join(words[i:]), i, model_id, name))
+        entries.sort()
+        return entries
+
+    def _install(self, entries):
+        self._entries = entries
+        self._keys = [entry[0] for entry in entries]
+        self._built_at = time.monotonic()
+        self._cache.clear()
+
+    def _refresh(self, generation):
+        entries = None
+        try:
+            with self.app.app_context():
+                entries = self._load()
+        except Exception:
+            self.app.logger.exception('Rebuilding the %s autocomplete '
+                                      'index failed', self.model.__name__)
+        with self._lock:
+            self._refreshing = False
+            # Rows read before an invalidate() may miss that edit
+            if entries is not None and generation == self._generation:
+                self._install(entries)
+
+    def _ranked(self, prefix, limit):
+        # Best match per id: the whole name, then the name's first word,
+        # then later words; ties go by name
+        best = {}
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._entries):
+            key, position, model_id, name = self._entries[i]
+            if not key.startswith(prefix):
+                break
+            rank = (position != 0 or key != prefix, position, name.lower(),
+                    model_id)
+            if model_id not in best or rank < best[model_id][0]:
+                best[model_id] = (rank, name)
+            i += 1
+        return [{"id": rank[-1], "name": name}
+                for rank, name in heapq.nsmallest(limit, best.values())]
+
+    def search(self, prefix, limit=10):
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+
+        with self._lock:
+            if self._entries is None:
+                self._install(self._load())
+            elif not self._refreshing and \
+                    time.monotonic() - self._built_at > self.max_age:
+                self._refreshing = True
+                threading.Thread(target=self._refresh,
+                                 args=(self._generation,),
+                                 name=f'autocomplete-{self.model.__name__}',
+                                 daemon=True).start()
+
+            cache_key = (prefix, limit)
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                return self._cache[cache_key]
+
+            results = self._ranked(prefix, limit)
+            self._cache[cache_key] = results
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return results
+
+
+artist_index = PrefixIndex(Artist)
+venue_index = PrefixIndex(Venue)
@@ -0,0 +1,189 @@
+import mmap
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+from database import fingerprint
+from models import db, Artist, Venue
+
+# ----------------------------------------------------------------------------#
+# Catalog snapshot: id -> (name, image_link) for every venue and artist.
+#
+# header   magic, version, slot counts, section offsets and the fingerprint
+#          of the database the snapshot was built from
+# venues   (name offset, name length, image offset, image length), one
+#          slot per id from 0 to the highest venue id
+# artists  the same for artists
+# strings  UTF-8 names and image links, each distinct string once
+#
+# An empty slot has ABSENT as its name offset. Workers mmap the file
+# read-only, so a tile lookup is two unpacks and no database round trip.
+# The refresh-catalog job writes a new file and os.replace()s it; readers
+# notice the new inode and remap. A file that is unreadable or was built
+# from another database is rebuilt before it is mapped.
+# ----------------------------------------------------------------------------#
+
+MAGIC = b'FYCS'
+VERSION = 2
+HEADER = struct.Struct('<4sIIIIII20s')
+SLOT = struct.Struct('<IIII')
+ABSENT = 0xFFFFFFFF
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buffer) < HEADER.size:
+            self.buffer.close()
+            raise ValueError(f'{path} is truncated')
+        magic, version, n_venues, n_artists, venues_at, artists_at, \
+            self.strings_at, self.source = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.buffer.close()
+            raise ValueError(f'{path} is not a version {VERSION} snapshot')
+        self.sections = {'venue': (venues_at, n_venues),
+                         'artist': (artists_at, n_artists)}
+
+    def _string(self, offset, length):
+        start = self.strings_at + offset
+        return self.buffer[start:start + length].decode('utf-8')
+
+    def get(self, kind, entity_id):
+        """(name, image_link) or None if the id was not in the catalog."""
+        at, slots = self.sections[kind]
+        if not 0 <= entity_id < slots:
+            return None
+        name_at, name_length, image_at, image_length = SLOT.unpack_from(
+            self.buffer, at + entity_id * SLOT.size)
+        if name_at == ABSENT:
+            return None
+        image_link = self._string(image_at, image_length) \
+            if image_at != ABSENT else None
+        return self._string(name_at, name_length), image_link
+
+
+def write_snapshot(path, venues, artists, source):
+    """venues and artists are (id, name, image_link) rows; source is the
+    database fingerprint."""
+    strings = bytearray()
+    offsets = {}
+
+    def intern(text):
+        if text is None:
+            return ABSENT, 0
+        if text not in offsets:
+            data = text.encode('utf-8')
+            offsets[text] = (len(strings), len(data))
+            strings.extend(data)
+        return offsets[text]
+
+    tables = []
+    for rows in (venues, artists):
+        rows = list(rows)
+        table = bytearray(SLOT.pack(ABSENT, 0, ABSENT, 0)) * \
+            (max((row[0] for row in rows), default=-1) + 1)
+        for entity_id, name, image_link in rows:
+            SLOT.pack_into(table, entity_id * SLOT.size,
+                           *intern(name or ''), *intern(image_link or None))
+        tables.append(table)
+    venue_table, artist_table = tables
+
+    venues_at = HEADER.size
+    artists_at = venues_at + len(venue_table)
+    strings_at = artists_at + len(artist_table)
+    header = HEADER.pack(MAGIC, VERSION, len(venue_table) // SLOT.size,
+                         len(artist_table) // SLOT.size, venues_at,
+                         artists_at, strings_at, source)
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        for section in (header, venue_table, artist_table, strings):
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+class Catalog:
+    def __init__(self):
+        self.path = None
+        self._snapshot = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        self.path = app.config['CATALOG_SNAPSHOT_PATH']
+
+    @contextmanager
+    def _writer(self):
+        with self._lock, open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _usable(self):
+        """The file's snapshot if it was built from this database."""
+        try:
+            snapshot = Snapshot(self.path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return snapshot if snapshot.source == fingerprint() else None
+
+    def current(self):
+        try:
+            stat = os.stat(self.path)
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            identity = None
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.identity != identity:
+            # The old map is not closed here: a streaming response may still
+            # be reading it, and it unmaps once the last reference goes
+            snapshot = self._usable()
+            if snapshot is None:
+                self.rebuild(only_if_unusable=True)
+                snapshot = Snapshot(self.path)
+            self._snapshot = snapshot
+        return snapshot
+
+    def rebuild(self, only_if_unusable=False):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._writer():
+            # Another worker may have rebuilt it while this one waited
+            if only_if_unusable and self._usable() is not None:
+                return
+            write_snapshot(
+                self.path,
+                db.session.query(Venue.id, Venue.name, Venue.image_link),
+                db.session.query(Artist.id, Artist.name, Artist.image_link),
+                fingerprint())
+
+    def lookup(self, kind, entity_id, snapshot=None):
+        """(name, image_link) for a tile.
+
+        Reads the database only for an id newer than the snapshot, between
+        a commit and the refresh-catalog job that follows it.
+        """
+        found = (snapshot or self.current()).get(kind, entity_id)
+        if found is None:
+            model = Venue if kind == 'venue' else Artist
+            found = db.session.query(model.name, model.image_link) \
+                .filter(model.id == entity_id) \
+                .first()
+        return found or (None, None)
+
+
+catalog = Catalog()
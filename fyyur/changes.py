@@ -0,0 +1,244 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from database import supports
+from models import db, Artist, Venue, Show, ChangeEvent, ChangeFeedOffset
+
+# ----------------------------------------------------------------------------#
+# Transactional outbox.
+#
+# Every flush that inserts, updates or deletes a venue, artist or show also
+# writes one change_events row per entity on the flush's own connection,
+# so a change is in the feed exactly when its transaction commits. Bulk
+# Query.delete() skips flush events; use delete_where() instead.
+#
+# Payloads carry the entity's key, plus the changed columns for updates:
+#   {"id": 4}                                          venue, artist
+#   {"id": 1, "venue_id": 4, "artist_id": 2,
+#    "start_time": "2026-05-21T21:30:00"}              show
+#
+# On Postgres the same transaction also sends NOTIFY on CHANNEL, which is
+# delivered when it commits, so listeners need not poll.
+# ----------------------------------------------------------------------------#
+
+TRACKED = {Venue: 'venue', Artist: 'artist', Show: 'show'}
+CHANNEL = 'fyyur_changes'
+
+
+def _int(value):
+    # Form-populated foreign keys are still strings at flush time
+    return int(value) if value is not None else None
+
+
+def _key(kind, values):
+    if kind != 'show':
+        return {"id": _int(values['id'])}
+    start_time = values['start_time']
+    return {
+        "id": _int(values['id']),
+        "venue_id": _int(values['venue_id']),
+        "artist_id": _int(values['artist_id']),
+        "start_time": start_time.isoformat()
+        if isinstance(start_time, datetime) else start_time
+    }
+
+
+def _row(kind, op, values, changed=None, now=None):
+    payload = _key(kind, values)
+    if changed is not None:
+        payload['changed'] = changed
+    return {
+        "entity": kind,
+        "entity_id": _int(values['id']),
+        "op": op,
+        "payload": json.dumps(payload),
+        "created_at": now or datetime.utcnow()
+    }
+
+
+def _insert(connection, rows):
+    connection.execute(ChangeEvent.__table__.insert(), rows)
+    if supports('listen_notify', connection):
+        connection.execute(f'NOTIFY {CHANNEL}')
+
+
+def _values(obj):
+    return {column: getattr(obj, column)
+            for column in ('id', 'venue_id', 'artist_id', 'start_time')
+            if hasattr(obj, column)}
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    # The session still shows pre-flush state and attribute history here
+    now = datetime.utcnow()
+    rows = []
+    for obj in session.new:
+        kind = TRACKED.get(type(obj))
+        if kind is not None:
+            rows.append(_row(kind, 'insert', _values(obj), now=now))
+    for obj in session.dirty:
+        kind = TRACKED.get(type(obj))
+        if kind is None or not session.is_modified(
+                obj, include_collections=False):
+            continue
+        changed = sorted(attr.key for attr in inspect(obj).attrs
+                         if attr.key in obj.__table__.columns
+                         and attr.history.has_changes())
+        rows.append(_row(kind, 'update', _values(obj), changed, now))
+    for obj in session.deleted:
+        kind = TRACKED.get(type(obj))
+        if kind is not None:
+            rows.append(_row(kind, 'delete', _values(obj), now=now))
+    if rows:
+        _insert(session.connection(), rows)
+
+
+KEY_COLUMNS = {
+    'venue': (Venue.id,),
+    'artist': (Artist.id,),
+    'show': (Show.id, Show.venue_id, Show.artist_id, Show.start_time)
+}
+
+
+def delete_where(model, *criteria):
+    """Bulk delete rows of a tracked model and record each deletion."""
+    kind = TRACKED[model]
+    columns = KEY_COLUMNS[kind]
+    now = datetime.utcnow()
+    rows = [_row(kind, 'delete', dict(zip((c.key for c in columns), key)),
+                 now=now)
+            for key in db.session.query(*columns).filter(*criteria)]
+    if rows:
+        _insert(db.session.connection(), rows)
+    model.query.filter(*criteria).delete(synchronize_session=False)
+    return len(rows)
+
+
+# ----------------------------------------------------------------------------#
+# Change feed.
+#
+# ids come from a sequence and are handed out before commit, so a slow
+# transaction can commit an id below one already read. A reader therefore
+# stops at the first missing id and holds there until the id can no longer
+# appear:
+#
+# - on Postgres, once every transaction running when the gap was first
+#   seen has ended (the snapshot's xmin passes the xmax noted then)
+# - once every consumer's committed offset is past it: they only move past
+#   closed gaps, so anything below them is pruned or rolled back
+# - after CHANGE_FEED_GAP_TIMEOUT seconds, with a warning
+#
+# A gap is never closed on the look that finds it, so the transaction
+# that owns it has always had a poll interval to take its txid.
+# ----------------------------------------------------------------------------#
+
+_gaps = {}  # First missing id -> (monotonic time first seen, txid xmax)
+_gaps_lock = threading.Lock()
+
+
+def _snapshot_bounds():
+    """(xmin, xmax) of a fresh txid snapshot, or None without them."""
+    if not supports('txid_snapshots'):
+        return None
+    return tuple(db.session.execute(
+        'SELECT txid_snapshot_xmin(s), txid_snapshot_xmax(s) '
+        'FROM txid_current_snapshot() AS s').first())
+
+
+def _gap_closed(missing):
+    now = time.monotonic()
+    with _gaps_lock:
+        seen = _gaps.get(missing)
+    if seen is None:
+        bounds = _snapshot_bounds()
+        with _gaps_lock:
+            _gaps.setdefault(missing, (now, bounds and bounds[1]))
+        return False
+    first_seen, xmax = seen
+    if xmax is not None and _snapshot_bounds()[0] >= xmax:
+        return True
+    if now - first_seen >= current_app.config['CHANGE_FEED_GAP_TIMEOUT']:
+        current_app.logger.warning('Change feed passing id %d after %.0fs',
+                                   missing, now - first_seen)
+        return True
+    return False
+
+
+def as_dict(change):
+    return {
+        "id": change.id,
+        "entity": change.entity,
+        "entity_id": change.entity_id,
+        "op": change.op,
+        "payload": json.loads(change.payload),
+        "created_at": change.created_at.isoformat()
+    }
+
+
+def read(after=0, limit=100):
+    """Changes with an id above `after`, oldest first, up to the first id
+    that may still commit."""
+    batch = ChangeEvent.query \
+        .filter(ChangeEvent.id > after) \
+        .order_by(ChangeEvent.id) \
+        .limit(limit) \
+        .all()
+    floor = None
+    expected = after + 1
+    for i, change in enumerate(batch):
+        if change.id != expected:
+            if floor is None:
+                floor = db.session.query(
+                    db.func.min(ChangeFeedOffset.position)).scalar() or 0
+            expected = max(expected, floor + 1)
+        if change.id != expected and not _gap_closed(expected):
+            batch = batch[:i]
+            break
+        expected = change.id + 1
+    with _gaps_lock:
+        for missing in [m for m in _gaps if m <= after]:
+            del _gaps[missing]
+    return batch
+
+
+def consume(consumer, handler, limit=100):
+    """Pass the next batch to handler(changes) and advance the offset.
+
+    The offset row is locked and committed with whatever the handler
+    wrote, so each change is handled once per consumer. Returns the batch
+    size.
+    """
+    offset = ChangeFeedOffset.query \
+        .filter(ChangeFeedOffset.consumer == consumer) \
+        .with_for_update() \
+        .first()
+    if offset is None:
+        offset = ChangeFeedOffset(consumer=consumer, position=0)
+        db.session.add(offset)
+    batch = read(offset.position, limit)
+    if batch:
+        handler(batch)
+        offset.position = batch[-1].id
+        offset.updated_at = datetime.utcnow()
+    db.session.commit()
+    return len(batch)
+
+
+def prune(days):
+    """Drop changes older than `days` that every consumer has read."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    slowest = db.session.query(db.func.min(ChangeFeedOffset.position)) \
+        .scalar()
+    query = ChangeEvent.query.filter(ChangeEvent.created_at < cutoff)
+    if slowest is not None:
+        query = query.filter(ChangeEvent.id <= slowest)
+    deleted = query.delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
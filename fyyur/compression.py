@@ -0,0 +1,134 @@
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pip install Brotli to offer br
+    brotli = None
+
+# ----------------------------------------------------------------------------#
+# Response compression.
+#
+# Text responses are sent gzip or brotli encoded when the client accepts
+# it. Whole bodies under COMPRESS_MIN_SIZE go out as they are. A streamed
+# response goes through one compressor that is flushed after the first
+# chunk, so the page head renders early, and then once per
+# COMPRESS_STREAM_FLUSH_BYTES of body; every flush costs compression.
+#
+# Every compressible response carries Vary: Accept-Encoding, compressed or
+# not, so a shared cache never serves one client's encoding to another.
+# ----------------------------------------------------------------------------#
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def chunk(self, data, flush=True):
+        out = self._compressor.compress(data)
+        if flush:
+            out += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return out
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _Brotli:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def chunk(self, data, flush=True):
+        out = self._compressor.process(data)
+        if flush:
+            out += self._compressor.flush()
+        return out
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class Compressor:
+    def __init__(self):
+        self.min_size = 1024
+        self.types = frozenset()
+        self.gzip_level = 6
+        self.brotli_quality = 5
+        self.stream_flush_bytes = 16 * 1024
+        self.encodings = ['br', 'gzip'] if brotli else ['gzip']
+
+    def init_app(self, app):
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.types = frozenset(app.config['COMPRESS_TYPES'])
+        self.gzip_level = app.config['COMPRESS_GZIP_LEVEL']
+        self.brotli_quality = app.config['COMPRESS_BROTLI_QUALITY']
+        self.stream_flush_bytes = app.config['COMPRESS_STREAM_FLUSH_BYTES']
+
+        @app.after_request
+        def compress_response(response):
+            return self.compress(response)
+
+    def _encoder(self, encoding):
+        if encoding == 'br':
+            return _Brotli(self.brotli_quality)
+        return _Gzip(self.gzip_level)
+
+    def encode(self, data, encoding):
+        """Compress a whole body."""
+        encoder = self._encoder(encoding)
+        return encoder.chunk(data, flush=False) + encoder.finish()
+
+    def _stream(self, chunks, encoding):
+        encoder = self._encoder(encoding)
+        pending = None  # Plain bytes since the last flush; None before one
+        for data in chunks:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if not data:
+                continue
+            flush = pending is None or \
+                pending + len(data) >= self.stream_flush_bytes
+            pending = 0 if flush else pending + len(data)
+            out = encoder.chunk(data, flush)
+            if out:
+                yield out
+        yield encoder.finish()
+
+    def compress(self, response):
+        if response.mimetype not in self.types:
+            return response
+        response.vary.add('Accept-Encoding')
+        if (response.status_code < 200
+                or response.status_code in (204, 206, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or 'no-transform' in response.headers.get('Cache-Control',
+                                                          '')):
+            return response
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            chunks = response.response
+            response.response = self._stream(chunks, encoding)
+            response.headers.pop('Content-Length', None)
+            # The inner iterable must still be closed, even if the stream
+            # never starts: stream_with_context pops its request context then
+            if hasattr(chunks, 'close'):
+                response.call_on_close(chunks.close)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(self.encode(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        # A validator for the plain bytes must not match the encoded ones
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak)
+        return response
+
+
+compressor = Compressor()
@@ -0,0 +1,131 @@
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from flask_migrate import stamp
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models import db
+
+# ----------------------------------------------------------------------------#
+# Database backends.
+#
+# Production runs on Postgres; the test and bench profiles run the same app
+# on SQLite, in memory or in a WAL-mode file. Code that needs a
+# Postgres-only feature asks supports() instead of assuming it, and falls
+# back to something portable. SQLite schemas come from the models
+# (create_schema) rather than the migrations, several of which alter
+# columns in ways SQLite cannot.
+# ----------------------------------------------------------------------------#
+
+POSTGRES_FEATURES = {
+    'skip_locked',          # SELECT ... FOR UPDATE SKIP LOCKED
+    'partitions',           # Declarative range partitioning of shows
+    'listen_notify',        # LISTEN / NOTIFY
+    'prepared_statements',  # PREPARE / EXECUTE through psycopg2
+    'txid_snapshots',       # txid_current_snapshot() and its xmin/xmax
+}
+
+
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL lets web workers read while a job worker writes; in-memory
+    # databases keep their own journal and ignore it
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    # Postgres enforces these, so the tests should too
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def backend(bind=None):
+    """The dialect name: 'postgresql' or 'sqlite'."""
+    return (bind or db.engine).dialect.name
+
+
+def supports(feature, bind=None):
+    if feature not in POSTGRES_FEATURES:
+        raise ValueError(f'Unknown database feature {feature!r}')
+    return backend(bind) == 'postgresql'
+
+
+def fingerprint(bind=None):
+    """A digest naming the database. The shared files built from it store
+    it, so a file left by another database is rebuilt, not served."""
+    return hashlib.sha1(str((bind or db.engine).url).encode('utf-8')) \
+        .digest()
+
+
+def create_schema(app):
+    """Create every table from the models and mark the migrations applied."""
+    with app.app_context():
+        db.create_all()
+        if app.config['SQLALCHEMY_DATABASE_URI'] not in ('sqlite://',
+                                                         'sqlite:///:memory:'):
+            stamp()
+
+
+# ----------------------------------------------------------------------------#
+# Request transactions.
+#
+# GET and HEAD requests only read. Their session never autoflushes, and on
+# Postgres every transaction it begins is READ ONLY, so a stray write fails
+# at once instead of taking row locks. (DEFERRABLE only changes anything at
+# SERIALIZABLE, which this app does not use.)
+#
+# Writes go through unit_of_work(): one transaction that commits once,
+# rolls back on any error and leaves what it committed loaded, so the
+# index hooks and flash messages after it need no reload. A read request
+# that must write, such as a page document rebuilt on read, opens one too.
+# Flask-SQLAlchemy removes the session at teardown either way.
+# ----------------------------------------------------------------------------#
+
+READ_METHODS = ('GET', 'HEAD')
+
+
+def _read_only():
+    return has_request_context() and g.get('read_only', False)
+
+
+@event.listens_for(Session, 'after_begin')
+def _begin_read_only(session, transaction, connection):
+    if _read_only() and backend(connection) == 'postgresql':
+        connection.execute('SET TRANSACTION READ ONLY')
+
+
+def setup_sessions(app):
+    @app.before_request
+    def begin_request_session():
+        g.read_only = request.method in READ_METHODS
+        db.session.autoflush = not g.read_only
+
+
+@contextmanager
+def unit_of_work():
+    """Run the block as one write transaction and commit it."""
+    session = db.session()
+    read_only = _read_only()
+    if read_only:
+        # End the read-only transaction; the next one begins writable
+        session.rollback()
+        g.read_only = False
+    autoflush, expire_on_commit = session.autoflush, session.expire_on_commit
+    session.autoflush, session.expire_on_commit = True, False
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.autoflush = autoflush
+        session.expire_on_commit = expire_on_commit
+        if read_only:
+            g.read_only = True
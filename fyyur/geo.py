@@ -0,0 +1,123 @@
+import csv
+import math
+import os
+
+# ----------------------------------------------------------------------------#
+# Gazetteer.
+# ----------------------------------------------------------------------------#
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'data', 'gazetteer.csv')
+
+_gazetteer = None
+
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    global _gazetteer
+    if _gazetteer is None:
+        places = {}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                key = (row['city'].strip().lower(), row['state'].strip().upper())
+                places[key] = (float(row['latitude']), float(row['longitude']))
+        _gazetteer = places
+    return _gazetteer
+
+
+# City-level lookup against the bundled file, no network involved.
+# Returns (latitude, longitude) or None when the place is unknown.
+def geocode(city, state):
+    if not city or not state:
+        return None
+    return load_gazetteer().get((city.strip().lower(), state.strip().upper()))
+
+
+# ----------------------------------------------------------------------------#
+# Geohash grid.
+# ----------------------------------------------------------------------------#
+
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_MILES = 3958.8
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            rng, value = lng_range, longitude
+        else:
+            rng, value = lat_range, latitude
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def _cell_size(precision):
+    # Returns (lat degrees, lng degrees) covered by one cell
+    lat_bits = (5 * precision) // 2
+    lng_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+# Degrees of (latitude, longitude) the circle reaches from its centre, or
+# None when it reaches a pole. A degree of longitude is shortest on the
+# poleward edge, so the longitude reach is taken there.
+def degree_reach(latitude, radius):
+    lat_reach = radius / (math.pi * EARTH_RADIUS_MILES / 180)
+    edge = abs(latitude) + lat_reach
+    if edge >= 90.0:
+        return None
+    return lat_reach, lat_reach / math.cos(math.radians(edge))
+
+
+# The finest precision whose cells span at least the circle's reach in
+# degrees, so the 3x3 block around the centre cell covers the whole circle.
+def precision_for_radius(latitude, radius):
+    reach = degree_reach(latitude, radius)
+    if reach is None:
+        return 0
+    lat_reach, lng_reach = reach
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        dlat, dlng = _cell_size(precision)
+        if dlat >= lat_reach and dlng >= lng_reach:
+            return precision
+    return 0
+
+
+def covering_cells(latitude, longitude, radius):
+    precision = precision_for_radius(latitude, radius)
+    if precision == 0:
+        # Radius spans the globe or a pole: no prefix to filter by
+        return ['']
+    dlat, dlng = _cell_size(precision)
+    cells = set()
+    for i in (-1, 0, 1):
+        for j in (-1, 0, 1):
+            lat = max(min(latitude + i * dlat, 90.0), -90.0)
+            lng = (longitude + j * dlng + 180.0) % 360.0 - 180.0
+            cells.add(geohash_encode(lat, lng, precision))
+    return sorted(cells)
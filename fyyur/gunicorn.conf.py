@@ -0,0 +1,14 @@
+# gunicorn app:app reads this file from the working directory.
+#
+# The app runs on threaded workers: the stack sampler (profiling.py) reads
+# sys._current_frames(), which only sees OS threads, and memory sampling
+# (memory_profiling.py) assumes one request per thread. /live streams are
+# long-lived, so the front proxy sends /live to the gevent group in
+# gunicorn.live.conf.py instead, where an idle stream costs a greenlet.
+import multiprocessing
+
+bind = '0.0.0.0:8000'
+workers = multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = 4
+keepalive = 5
@@ -0,0 +1,26 @@
+# gunicorn -c gunicorn.live.conf.py app:app serves /live for the front
+# proxy; everything else goes to gunicorn.conf.py.
+#
+# gevent workers serve every request on a greenlet, so the long-lived
+# streams cost a socket and a small stack each rather than a thread.
+# psycogreen makes psycopg2 yield to other greenlets while it waits on
+# Postgres, including the live broker's LISTEN. Don't route other pages
+# here: the stack sampler cannot see greenlets and tracemalloc samples
+# would count every other request's allocations.
+import multiprocessing
+
+bind = '0.0.0.0:8001'
+workers = max(multiprocessing.cpu_count() // 2, 1)
+worker_class = 'gevent'
+worker_connections = 2000
+# Open event streams never finish on their own
+graceful_timeout = 10
+keepalive = 5
+
+
+def post_fork(server, worker):
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        return
+    patch_psycopg()
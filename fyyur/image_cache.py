@@ -0,0 +1,266 @@
+import hashlib
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import tempfile
+import time
+from urllib.parse import urlparse
+from urllib.request import (
+    HTTPHandler,
+    HTTPSHandler,
+    ProxyHandler,
+    Request,
+    build_opener
+)
+
+from markupsafe import Markup
+from PIL import Image, ImageOps, features
+
+# ----------------------------------------------------------------------------#
+# On-disk layout under IMAGE_CACHE_DIR:
+#
+# urls/<sha256 of image_link>     content hash of what that URL returned
+# urls/<sha256>.failed            marker for a recent failed fetch
+# <content hash>-<width>.<ext>    resized variants, named by content
+#
+# A source is fetched once per image_link; variants are shared by every
+# artist or venue that points at the same bytes. Serving a variant touches
+# its mtime, and once the files pass IMAGE_CACHE_MAX_BYTES the least
+# recently used are deleted; an evicted source is fetched again.
+#
+# image_link is user input, so fetches only connect to public addresses:
+# the host is resolved once, every address is checked, and the socket
+# connects to a checked address. Redirects go through the same check.
+# ----------------------------------------------------------------------------#
+
+FAILURE_TTL = 3600  # Seconds before retrying a URL that failed to fetch
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def is_public(address):
+    return ipaddress.ip_address(address).is_global
+
+
+def public_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+                      source_address=None):
+    """socket.create_connection that refuses non-public addresses."""
+    host, port = address
+    infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    for _, _, _, _, sockaddr in infos:
+        if not is_public(sockaddr[0]):
+            raise ValueError(f'Refusing to fetch from {host} '
+                             f'({sockaddr[0]} is not a public address)')
+    error = None
+    for family, socktype, proto, _, sockaddr in infos:
+        sock = socket.socket(family, socktype, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError(f'{host} did not resolve')
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPHandler(HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req,
+                            context=self._context)
+
+
+# No proxies: the check has to see the address actually connected to
+opener = build_opener(ProxyHandler({}), PublicHTTPHandler,
+                      PublicHTTPSHandler)
+
+
+class ImageCache:
+    def __init__(self):
+        self.directory = None
+        self.widths = ()
+        self.timeout = 5
+        self.max_bytes = 10 * 1024 * 1024
+        self.max_pixels = 25 * 1000 * 1000
+        self.cache_max_bytes = 0
+        self.webp = features.check('webp')
+        self._written = None  # Bytes written since the last sweep
+
+    def init_app(self, app):
+        self.directory = app.config['IMAGE_CACHE_DIR']
+        self.widths = tuple(app.config['IMAGE_WIDTHS'])
+        self.timeout = app.config['IMAGE_FETCH_TIMEOUT']
+        self.max_bytes = app.config['IMAGE_MAX_BYTES']
+        self.max_pixels = app.config['IMAGE_MAX_PIXELS']
+        self.cache_max_bytes = app.config['IMAGE_CACHE_MAX_BYTES']
+        self._written = None
+        os.makedirs(os.path.join(self.directory, 'urls'), exist_ok=True)
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if self.cache_max_bytes:
+            # Sweep on the first write and then every tenth of the cap
+            if self._written is None or \
+                    self._written >= self.cache_max_bytes // 10:
+                self._written = 0
+                self.evict()
+            self._written += len(data)
+
+    def evict(self):
+        """Delete the least recently used files until the cache is back
+        under 90% of its cap."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.cache_max_bytes:
+            return
+        target = self.cache_max_bytes * 9 // 10
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Another worker got there first
+            total -= size
+
+    def _fetch(self, url):
+        if urlparse(url).scheme not in ('http', 'https'):
+            raise ValueError(f'Refusing to fetch {url!r}')
+        request = Request(url, headers={'User-Agent': 'fyyur-thumbnailer'})
+        with opener.open(request, timeout=self.timeout) as response:
+            data = response.read(self.max_bytes + 1)
+        if len(data) > self.max_bytes:
+            raise ValueError(f'{url} is larger than {self.max_bytes} bytes')
+        return data
+
+    def _open(self, data):
+        """The image's header, refusing one that would decode too large."""
+        image = Image.open(io.BytesIO(data))
+        width, height = image.size
+        if width * height > self.max_pixels:
+            raise ValueError(f'{width}x{height} image is over '
+                             f'{self.max_pixels} pixels')
+        return image
+
+    def source(self, url, refetch=False):
+        """Returns (content hash, original bytes or None if cached)."""
+        url_key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        url_path = os.path.join(self.directory, 'urls', url_key)
+        if not refetch and os.path.exists(url_path):
+            with open(url_path) as f:
+                return f.read().strip(), None
+        failed_path = url_path + '.failed'
+        try:
+            if time.time() - os.path.getmtime(failed_path) < FAILURE_TTL:
+                raise ValueError(f'{url} failed recently')
+        except FileNotFoundError:
+            pass
+        try:
+            data = self._fetch(url)
+            self._open(data)
+        except Exception:
+            self._write(failed_path, b'')
+            raise
+        content_hash = hashlib.sha256(data).hexdigest()
+        self._write(os.path.join(self.directory, content_hash), data)
+        self._write(url_path, content_hash.encode('ascii'))
+        return content_hash, data
+
+    def variant(self, url, width, image_format):
+        """Path and mimetype of `url` resized to `width`, building it once."""
+        pil_format, mimetype = FORMATS[image_format]
+        content_hash, data = self.source(url)
+        path = os.path.join(self.directory,
+                            f'{content_hash}-{width}.{image_format}')
+        if os.path.exists(path):
+            os.utime(path)  # Recently used, so evicted last
+            return path, mimetype
+
+        if data is None:
+            try:
+                with open(os.path.join(self.directory, content_hash),
+                          'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                # The source was evicted; the URL may serve new bytes now
+                content_hash, data = self.source(url, refetch=True)
+                path = os.path.join(self.directory,
+                                    f'{content_hash}-{width}.{image_format}')
+        image = self._open(data)
+        if image.format == 'JPEG':
+            # Decode at the smallest DCT scale still covering the thumbnail
+            image.draft('RGB', (width, width))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, width * 4))
+        if image.mode not in ('RGB', 'RGBA') or pil_format == 'JPEG':
+            image = image.convert('RGB')
+        out = io.BytesIO()
+        image.save(out, pil_format, quality=80)
+        self._write(path, out.getvalue())
+        return path, mimetype
+
+    def negotiate(self, accept):
+        # Only an explicit image/webp counts: */* is sent by browsers
+        # that cannot decode it
+        if self.webp and 'image/webp' in accept:
+            return 'webp'
+        return 'jpeg'
+
+
+image_cache = ImageCache()
+
+
+# ----------------------------------------------------------------------------#
+# Template helper.
+# ----------------------------------------------------------------------------#
+
+def link_version(image_link):
+    return hashlib.sha1(image_link.encode('utf-8')).hexdigest()[:10]
+
+
+def image_attrs(kind, model_id, image_link, sizes='360px'):
+    """src, srcset, sizes and lazy-loading attributes for an <img> tag."""
+    if not image_link:
+        return Markup('src=""')
+    if not image_cache.widths:
+        return Markup('src="{}" loading="lazy"').format(image_link)
+    version = link_version(image_link)
+    urls = [(width, f'/img/{kind}/{model_id}/{width}?v={version}')
+            for width in image_cache.widths]
+    srcset = ', '.join(f'{url} {width}w' for width, url in urls)
+    return Markup('src="{}" srcset="{}" sizes="{}" loading="lazy" '
+                  'decoding="async"').format(urls[len(urls) // 2][1],
+                                             srcset, sizes)
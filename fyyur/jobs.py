@@ -0,0 +1,360 @@
+import json
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import time
+import traceback
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+
+from models import db, Artist, Venue, Show, Job
+import changes
+from database import supports
+import read_model
+import rollups
+from catalog import catalog
+from image_cache import image_cache
+from recommendations import mark_stale, refresh_similarities
+from search_index import (
+    index_artist,
+    index_venue,
+    index_show,
+    unindex_artist,
+    unindex_show,
+    unindex_venue
+)
+
+# ----------------------------------------------------------------------------#
+# Durable job queue.
+#
+# enqueue() adds a row to `jobs` in the caller's session, so a job commits
+# or rolls back with the write that needs it. `flask worker` forks
+# JOB_QUEUES[queue] processes per queue; each claims the highest-priority
+# due job with FOR UPDATE SKIP LOCKED on Postgres (a compare-and-set update
+# on SQLite), runs it and deletes it. Failures are retried with jittered
+# exponential backoff until max_attempts, then kept as 'failed'. A job left
+# 'running' past JOB_LEASE belonged to a dead worker and is claimed again.
+#
+# The 'changes' queue is not a table queue: its one worker follows the
+# change feed and enqueues the jobs each catalog change calls for.
+# ----------------------------------------------------------------------------#
+
+CHANGES = 'changes'
+
+HANDLERS = {}
+
+
+def job(name, queue='default', priority=0, max_attempts=5):
+    """Register a handler. Its keyword arguments are the JSON payload."""
+    def decorator(fn):
+        fn.job = {"name": name, "queue": queue, "priority": priority,
+                  "max_attempts": max_attempts}
+        HANDLERS[name] = fn
+        return fn
+    return decorator
+
+
+def enqueue(name, dedupe_key=None, delay=0, **payload):
+    """Queue a job in the current transaction. Callers commit."""
+    spec = HANDLERS[name].job
+    if dedupe_key is not None and Job.query \
+            .filter(Job.dedupe_key == dedupe_key, Job.status == 'queued') \
+            .first() is not None:
+        return
+    db.session.add(Job(
+        queue=spec['queue'],
+        name=name,
+        payload=json.dumps(payload),
+        dedupe_key=dedupe_key,
+        priority=spec['priority'],
+        max_attempts=spec['max_attempts'],
+        run_at=datetime.utcnow() + timedelta(seconds=delay)))
+
+
+def backoff(attempt):
+    config = current_app.config
+    ceiling = min(config['JOB_BACKOFF_BASE'] * 2 ** (attempt - 1),
+                  config['JOB_BACKOFF_MAX'])
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def claim(queue, worker_id):
+    """Claim one due job. Returns (id, name, payload, attempt) or None."""
+    now = datetime.utcnow()
+    lease = timedelta(seconds=current_app.config['JOB_LEASE'])
+    query = Job.query \
+        .filter(Job.queue == queue) \
+        .filter(db.or_(
+            db.and_(Job.status == 'queued', Job.run_at <= now),
+            db.and_(Job.status == 'running', Job.locked_at < now - lease))) \
+        .order_by(Job.priority.desc(), Job.run_at, Job.id)
+    if supports('skip_locked'):
+        query = query.with_for_update(skip_locked=True)
+    candidate = query.first()
+    if candidate is None:
+        db.session.rollback()
+        return None
+    claimed = (candidate.id, candidate.name, json.loads(candidate.payload),
+               candidate.attempts + 1)
+    # The attempts check makes this a compare-and-set where there are no
+    # row locks: only one worker moves the job past the value it read
+    won = Job.query \
+        .filter(Job.id == candidate.id,
+                Job.attempts == candidate.attempts) \
+        .update({"status": 'running', "attempts": candidate.attempts + 1,
+                 "locked_by": worker_id, "locked_at": now},
+                synchronize_session=False)
+    db.session.commit()
+    return claimed if won else None
+
+
+def run_one(queue, worker_id):
+    """Run one job from `queue`. Returns False when nothing was due."""
+    claimed = claim(queue, worker_id)
+    if claimed is None:
+        return False
+    job_id, name, payload, attempt = claimed
+    try:
+        HANDLERS[name](**payload)
+        Job.query.filter(Job.id == job_id).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Job %s %s failed (attempt %d)',
+                                     job_id, name, attempt)
+        failed = Job.query.get(job_id)
+        failed.last_error = traceback.format_exc()
+        failed.locked_by = failed.locked_at = None
+        if attempt >= failed.max_attempts:
+            failed.status = 'failed'
+        else:
+            failed.status = 'queued'
+            failed.run_at = datetime.utcnow() + \
+                timedelta(seconds=backoff(attempt))
+        db.session.commit()
+    finally:
+        db.session.remove()
+    return True
+
+
+def follow_changes():
+    """Dispatch one batch of catalog changes. Returns False if none."""
+    try:
+        return changes.consume('jobs', dispatch) > 0
+    finally:
+        db.session.remove()
+
+
+def drain(queues=None):
+    """Run due jobs inline until every queue is empty."""
+    queues = queues or list(current_app.config['JOB_QUEUES'])
+    worker_id = f'{socket.gethostname()}:{os.getpid()}:inline'
+    ran = 0
+    while True:
+        progress = [follow_changes() if queue == CHANGES
+                    else run_one(queue, worker_id) for queue in queues]
+        ran += sum(progress)
+        if not any(progress):
+            return ran
+
+
+# ----------------------------------------------------------------------------#
+# Worker pool.
+# ----------------------------------------------------------------------------#
+
+def _work(app, queue):
+    # Signal handlers only set a flag: anything that takes a lock could
+    # deadlock against the code they interrupt
+    stopping = []
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    with app.app_context():
+        # Never share the parent's pooled connections across the fork
+        db.engine.dispose()
+        app.logger.info('Worker %s consuming %s', worker_id, queue)
+        while not stopping:
+            if queue == CHANGES:
+                progress = follow_changes()
+            else:
+                progress = run_one(queue, worker_id)
+            if not progress:
+                time.sleep(app.config['JOB_POLL_INTERVAL'])
+    listener = app.extensions.get('log_listener')
+    if listener is not None:
+        listener.stop()
+
+
+def run_pool(app, queues=None):
+    """Fork the workers and keep them running until SIGINT or SIGTERM."""
+    concurrency = app.config['JOB_QUEUES']
+    queues = queues or list(concurrency)
+    context = multiprocessing.get_context('fork')
+    slots = [queue for queue in queues
+             for _ in range(concurrency.get(queue, 1))]
+
+    def spawn(queue):
+        process = context.Process(target=_work, args=(app, queue),
+                                  name=f'fyyur-worker-{queue}')
+        process.start()
+        return process
+
+    stopping = []
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(1))
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+    processes = [spawn(queue) for queue in slots]
+    while not stopping:
+        time.sleep(1.0)
+        for i, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                app.logger.warning('Worker %s exited with %s, restarting',
+                                   process.pid, process.exitcode)
+                processes[i] = spawn(slots[i])
+    # Workers finish the job in hand before exiting
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join()
+
+
+# ----------------------------------------------------------------------------#
+# Change dispatch.
+# ----------------------------------------------------------------------------#
+
+def bucket_payload(buckets):
+    return [[kind, entity_id, month.isoformat()]
+            for kind, entity_id, month in buckets]
+
+
+def dispatch(batch):
+    """Enqueue the jobs that keep derived data in step with `batch`."""
+    buckets, stale = set(), set()
+    for change in batch:
+        payload = json.loads(change.payload)
+        if change.entity == 'show':
+            buckets |= rollups.buckets_for_show(
+                payload['venue_id'], payload['artist_id'],
+                datetime.fromisoformat(payload['start_time']))
+            stale.add(payload['artist_id'])
+            if change.op != 'delete':
+                enqueue('index-show', venue_id=payload['venue_id'],
+                        artist_id=payload['artist_id'],
+                        start_time=payload['start_time'])
+            else:
+                enqueue('unindex-show', show_id=payload['id'],
+                        venue_id=payload['venue_id'],
+                        artist_id=payload['artist_id'],
+                        start_time=payload['start_time'])
+            continue
+        key = f'{change.entity}:{change.entity_id}'
+        enqueue('index-entity', dedupe_key=f'index-entity:{key}',
+                kind=change.entity, entity_id=change.entity_id)
+        changed = payload.get('changed')
+        # Rollups list the genres of the other side of each show
+        if changed is not None and 'genres' in changed:
+            buckets |= rollups.buckets_for_genres(change.entity,
+                                                  change.entity_id)
+        # Names and images also appear in the other side's show lists
+        shown = changed is None or bool({'name', 'image_link'} & set(changed))
+        if shown:
+            # The write rebuilt this entity's own document; only the pages
+            # on the other side of its shows are left. The key has its own
+            # suffix so it never matches a queued rebuild of one document
+            enqueue('rebuild-documents',
+                    dedupe_key=f'rebuild-documents:{key}:cascade',
+                    entities=[], cascade=[[change.entity, change.entity_id]])
+            enqueue('refresh-catalog', dedupe_key='refresh-catalog')
+        if change.op != 'delete' and (changed is None
+                                      or 'image_link' in changed):
+            enqueue('warm-thumbnails', dedupe_key=f'warm-thumbnails:{key}',
+                    kind=change.entity, entity_id=change.entity_id)
+        if change.entity == 'artist' and change.op != 'delete':
+            stale.add(change.entity_id)
+    if buckets:
+        enqueue('refresh-rollups', buckets=bucket_payload(buckets))
+    if stale:
+        mark_stale(*stale)
+        enqueue('refresh-similarities', dedupe_key='refresh-similarities')
+
+
+# ----------------------------------------------------------------------------#
+# Handlers.
+# ----------------------------------------------------------------------------#
+
+
+@job('refresh-rollups', priority=5)
+def refresh_rollups(buckets):
+    rollups.refresh_buckets([(kind, entity_id, date.fromisoformat(month))
+                             for kind, entity_id, month in buckets])
+    # Show changes reach the page documents here, after the rollups the
+    # documents embed are current
+    read_model.rebuild_many({(kind, entity_id)
+                             for kind, entity_id, _ in buckets})
+
+
+@job('rebuild-documents', priority=5)
+def rebuild_documents(entities, cascade):
+    read_model.rebuild_many([tuple(key) for key in entities],
+                            [tuple(key) for key in cascade])
+
+
+@job('index-entity', priority=10)
+def index_entity(kind, entity_id):
+    # Indexes the row as it is now, so a job that runs late or twice
+    # still converges
+    if kind == 'artist':
+        artist = Artist.query.get(entity_id)
+        if artist is None:
+            unindex_artist(entity_id)
+        else:
+            index_artist(artist)
+    else:
+        venue = Venue.query.get(entity_id)
+        if venue is None:
+            unindex_venue(entity_id)
+        else:
+            index_venue(venue)
+
+
+@job('refresh-catalog', priority=10)
+def refresh_catalog():
+    # A full rewrite is two narrow scans; the dedupe key folds a burst of
+    # edits into one
+    catalog.rebuild()
+
+
+@job('index-show', priority=10)
+def index_show_job(venue_id, artist_id, start_time):
+    show = Show.query.filter(
+        Show.venue_id == venue_id, Show.artist_id == artist_id,
+        Show.start_time == datetime.fromisoformat(start_time)).first()
+    if show is not None:
+        index_show(show)
+
+
+@job('unindex-show', priority=10)
+def unindex_show_job(show_id, venue_id, artist_id, start_time):
+    # Keys hold str() of the stored datetime
+    unindex_show(show_id, venue_id, artist_id,
+                 datetime.fromisoformat(start_time))
+
+
+@job('warm-thumbnails', queue='images')
+def warm_thumbnails(kind, entity_id):
+    model = Artist if kind == 'artist' else Venue
+    entity = model.query.get(entity_id)
+    if entity is None or not entity.image_link:
+        return
+    formats = ['jpeg', 'webp'] if image_cache.webp else ['jpeg']
+    for width in image_cache.widths:
+        for image_format in formats:
+            image_cache.variant(entity.image_link, width, image_format)
+
+
+@job('refresh-similarities', queue='recommend', priority=-5,
+     max_attempts=3)
+def refresh_similarities_job():
+    refresh_similarities()
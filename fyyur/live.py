@@ -0,0 +1,230 @@
+import json
+import queue
+import select
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+
+import changes
+from database import supports
+from models import db, Artist, Venue, ChangeEvent
+
+# ----------------------------------------------------------------------------#
+# Live updates over Server-Sent Events.
+#
+# Each worker process runs one broker thread that follows the change feed
+# and fans every new event out to the /live streams it serves. On Postgres
+# the thread sleeps in LISTEN until a write transaction commits its NOTIFY;
+# on SQLite it polls every LIVE_POLL_INTERVAL seconds. Either way it reads
+# through changes.read(), so events arrive in id order and a missing id
+# holds the stream until its transaction ends.
+#
+# Events are formatted once, in the broker. A stream only waits on its own
+# queue, so an idle connection holds no database connection and, on the
+# gevent workers that serve /live (gunicorn.live.conf.py), no thread. A
+# client that falls LIVE_QUEUE_SIZE events behind gets a reset and reloads.
+#
+#   show-added, show-removed, show-changed
+#       {"venue_id": 4, "artist_id": 2, "start_time": "...", "upcoming": true}
+#   venue-added, venue-changed, artist-added, artist-changed
+#       {"id": 4, "name": "The Musical Hop"}
+#   venue-removed, artist-removed
+#       {"id": 4}
+# ----------------------------------------------------------------------------#
+
+OPS = {'insert': 'added', 'update': 'changed', 'delete': 'removed'}
+RESET = 'event: reset\ndata: {}\n\n'
+RETRY_MS = 5000  # How long a dropped EventSource waits to reconnect
+
+
+def _frame(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+def _names(batch):
+    """{(kind, id): name} for the venues and artists a batch names."""
+    wanted = {'venue': set(), 'artist': set()}
+    for change in batch:
+        if change.entity in wanted and change.op != 'delete':
+            wanted[change.entity].add(change.entity_id)
+    names = {}
+    for kind, model in (('venue', Venue), ('artist', Artist)):
+        if wanted[kind]:
+            names.update(((kind, entity_id), name) for entity_id, name in
+                         db.session.query(model.id, model.name)
+                         .filter(model.id.in_(wanted[kind])))
+    return names
+
+
+def frames(batch):
+    """(id, frame) for each change in the batch that a page can show."""
+    names = _names(batch)
+    now = datetime.now()
+    result = []
+    for change in batch:
+        payload = json.loads(change.payload)
+        name = f'{change.entity}-{OPS[change.op]}'
+        if change.entity == 'show':
+            start_time = payload['start_time']
+            data = {
+                "venue_id": payload['venue_id'],
+                "artist_id": payload['artist_id'],
+                "start_time": start_time,
+                "upcoming": datetime.fromisoformat(start_time) > now
+            }
+        elif change.op == 'delete':
+            data = {"id": change.entity_id}
+        else:
+            if change.op == 'update' and 'name' not in payload['changed']:
+                continue
+            name_key = (change.entity, change.entity_id)
+            if name_key not in names:
+                continue  # Deleted again before the feed got to it
+            data = {"id": change.entity_id, "name": names[name_key]}
+        result.append((change.id, _frame(change.id, name, data)))
+    return result
+
+
+class Broker:
+    def __init__(self):
+        self.poll_interval = 2
+        self.heartbeat = 15
+        self.queue_size = 100
+        self.backlog = 500
+        self.position = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        self.poll_interval = app.config['LIVE_POLL_INTERVAL']
+        self.heartbeat = app.config['LIVE_HEARTBEAT']
+        self.queue_size = app.config['LIVE_QUEUE_SIZE']
+        self.backlog = app.config['LIVE_BACKLOG']
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self.position is None:
+                self.position = db.session.query(
+                    db.func.max(ChangeEvent.id)).scalar() or 0
+            self._thread = threading.Thread(
+                target=self._run, name='live-events', daemon=True,
+                args=(current_app._get_current_object(),))
+            self._thread.start()
+
+    def subscribe(self):
+        self._start()
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _publish(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                for event in events:
+                    subscriber.put_nowait(event)
+            except queue.Full:
+                # Too far behind to catch up; make room for the reset
+                self.unsubscribe(subscriber)
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(None)
+
+    def _listener(self):
+        """(wait, close): wait(timeout) returns True when a change was
+        committed."""
+        if not supports('listen_notify'):
+            def wait(timeout):
+                time.sleep(timeout)
+                return False
+            return wait, lambda: None
+
+        raw = db.engine.raw_connection()
+        raw.detach()  # Autocommit and LISTEN stay with this connection
+        connection = raw.connection
+        connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute(f'LISTEN {changes.CHANNEL}')
+
+        def wait(timeout):
+            if not select.select([connection], [], [], timeout)[0]:
+                return False
+            connection.poll()
+            notified = bool(connection.notifies)
+            connection.notifies.clear()
+            return notified
+
+        return wait, raw.close
+
+    def _catch_up(self):
+        while True:
+            batch = changes.read(self.position, self.backlog)
+            if not batch:
+                return
+            self.position = batch[-1].id
+            events = frames(batch)
+            if events:
+                self._publish(events)
+            if len(batch) < self.backlog:
+                return
+
+    def _run(self, app):
+        with app.app_context():
+            while True:
+                close = None
+                try:
+                    wait, close = self._listener()
+                    while True:
+                        wait(self.poll_interval)
+                        try:
+                            self._catch_up()
+                        finally:
+                            db.session.remove()
+                except Exception:
+                    app.logger.exception('Live event broker failed; '
+                                         'restarting')
+                    time.sleep(self.poll_interval)
+                finally:
+                    if close is not None:
+                        close()
+
+    def stream(self, subscriber, backlog=(), reset=False):
+        """The text/event-stream body for one subscriber."""
+        try:
+            yield f'retry: {RETRY_MS}\n\n'
+            if reset:
+                yield RESET
+            last = 0
+            for event_id, frame in backlog:
+                last = event_id
+                yield frame
+            while True:
+                try:
+                    event = subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # Keeps proxies from timing the connection out
+                    yield ': ping\n\n'
+                    continue
+                if event is None:
+                    yield RESET
+                    return
+                event_id, frame = event
+                if event_id > last:  # Already sent from the backlog
+                    last = event_id
+                    yield frame
+        finally:
+            self.unsubscribe(subscriber)
+
+
+broker = Broker()
@@ -0,0 +1,252 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    TimedRotatingFileHandler
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process per log file only
+    fcntl = None
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# ----------------------------------------------------------------------------#
+# Request threads only put records on a queue; a listener thread formats
+# them as JSON lines and does the disk writes, so a slow disk never adds
+# to request latency.
+# ----------------------------------------------------------------------------#
+
+REQUEST_FIELDS = ('request_id', 'method', 'route', 'path', 'status',
+                  'latency_ms', 'ttfb_ms', 'sql_count', 'sql_ms')
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc)
+            .isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "where": f'{record.pathname}:{record.lineno}'
+        }
+        for field in REQUEST_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestQueueHandler(QueueHandler):
+    """Captures request context on the request thread, then enqueues."""
+
+    def prepare(self, record):
+        if has_request_context():
+            record.request_id = getattr(g, 'request_id', None)
+            record.method = request.method
+            record.route = request.endpoint
+            record.path = request.path
+            record.sql_count = getattr(g, 'sql_count', None)
+            sql_ms = getattr(g, 'sql_ms', None)
+            record.sql_ms = round(sql_ms, 2) if sql_ms is not None else None
+        # Tracebacks and args become plain strings so the record pickles
+        # and formats the same on the listener thread
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class DebugSampler(logging.Filter):
+    """Passes records at `level` and above, lower ones for sampled requests."""
+
+    def __init__(self, level, rate):
+        super().__init__()
+        self.level = level
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        if has_request_context():
+            return getattr(g, 'log_debug', False)
+        return random.random() < self.rate
+
+
+class SizedTimedRotatingFileHandler(TimedRotatingFileHandler):
+    """Rotates on a schedule and also whenever the file reaches max_bytes.
+
+    Every worker appends to the same file, so one rotation must serve them
+    all: rotating takes an flock on filename + '.lock' and only renames the
+    file if it is still the one this process has open. The others see the
+    path's inode change and reopen it.
+    """
+
+    def __init__(self, filename, when='midnight', backup_count=14,
+                 max_bytes=0):
+        super().__init__(filename, when=when, backupCount=backup_count,
+                         encoding='utf-8', delay=True)
+        self.max_bytes = max_bytes
+        self.inode = None
+
+    def _open(self):
+        stream = super()._open()
+        self.inode = os.fstat(stream.fileno()).st_ino
+        return stream
+
+    def _moved(self):
+        try:
+            return os.stat(self.baseFilename).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    def _follow(self):
+        """Drop the stream for the next emit to reopen at the path."""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.rolloverAt = self.computeRollover(int(time.time()))
+
+    def emit(self, record):
+        if self.stream is not None and self._moved():
+            self._follow()  # Another worker rotated it
+        super().emit(record)
+
+    def shouldRollover(self, record):
+        if super().shouldRollover(record):
+            return 1
+        if self.max_bytes and self.stream is not None:
+            self.stream.seek(0, 2)
+            if self.stream.tell() >= self.max_bytes:
+                return 1
+        return 0
+
+    def doRollover(self):
+        with open(self.baseFilename + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self.stream is None or self._moved():
+                    # Rotated by another worker while this one waited
+                    self._follow()
+                else:
+                    super().doRollover()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def rotation_filename(self, default_name):
+        # Size rollovers can happen several times in one interval
+        name, n = default_name, 1
+        while os.path.exists(name):
+            name = f'{default_name}.{n}'
+            n += 1
+        return name
+
+
+# ----------------------------------------------------------------------------#
+# SQL stats, counted per request.
+# ----------------------------------------------------------------------------#
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    started = conn.info['query_started'].pop()
+    if has_request_context():
+        g.sql_count = getattr(g, 'sql_count', 0) + 1
+        g.sql_ms = getattr(g, 'sql_ms', 0.0) + \
+            (time.perf_counter() - started) * 1000
+
+
+# ----------------------------------------------------------------------------#
+# Setup.
+# ----------------------------------------------------------------------------#
+
+def _start_listener(app):
+    """A listener thread with its own queue and file handler."""
+    file_handler = SizedTimedRotatingFileHandler(
+        app.config['LOG_PATH'],
+        when=app.config['LOG_ROTATE_WHEN'],
+        backup_count=app.config['LOG_BACKUP_COUNT'],
+        max_bytes=app.config['LOG_MAX_BYTES'])
+    file_handler.setFormatter(JsonFormatter())
+
+    handlers = [file_handler]
+    if app.debug:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(JsonFormatter())
+        handlers.append(console_handler)
+
+    listener = QueueListener(queue.SimpleQueue(), *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    app.extensions['log_listener'] = listener
+    return listener
+
+
+def setup_logging(app):
+    os.makedirs(os.path.dirname(app.config['LOG_PATH']), exist_ok=True)
+    listener = _start_listener(app)
+    queue_handler = RequestQueueHandler(listener.queue)
+
+    # The listener thread does not survive a fork. A forked worker starts
+    # its own on a new queue: the parent's still holds records the parent
+    # will write, and its handlers' state was copied mid-use
+    def restart_in_child():
+        queue_handler.queue = _start_listener(app).queue
+
+    os.register_at_fork(after_in_child=restart_in_child)
+
+    level = logging.getLevelName(app.config['LOG_LEVEL'])
+    rate = app.config['LOG_DEBUG_SAMPLE_RATE']
+    queue_handler.addFilter(DebugSampler(level, rate))
+    app.logger.handlers[:] = [queue_handler]
+    app.logger.propagate = False
+    # Sampled requests need the lower-level records to exist at all
+    app.logger.setLevel(logging.DEBUG if rate > 0 else level)
+
+    @app.before_request
+    def start_request_log():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        g.request_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_ms = 0.0
+        g.log_debug = random.random() < rate
+
+    @app.after_request
+    def finish_request_log(response):
+        started = getattr(g, 'request_started', None)
+        if started is not None:
+            app.logger.info(
+                '%s %s %s', request.method, request.path,
+                response.status_code,
+                extra={"status": response.status_code,
+                       "latency_ms": round(
+                           (time.perf_counter() - started) * 1000, 2)})
+            response.headers['X-Request-ID'] = g.request_id
+        return response
+
+    return listener
@@ -0,0 +1,152 @@
+import time
+from collections import defaultdict
+from threading import Lock
+
+from models import parse_genres, parse_flag, Artist, Venue
+
+CITY_BONUS = 2  # A same-city match is worth two shared genres
+
+
+# ----------------------------------------------------------------------------#
+# Inverted index.
+# ----------------------------------------------------------------------------#
+
+class SeekingIndex:
+    """Seeking artists or venues posted under each (state, genre) key.
+
+    Kept up to date by the write routes through update() and remove();
+    a max age bounds staleness across workers.
+    """
+
+    def __init__(self, model, seeking_column, max_age=300):
+        self.model = model
+        self.seeking_column = seeking_column
+        self.max_age = max_age
+        self._postings = None
+        self._profiles = {}
+        self._built_at = 0
+
+    def _build(self):
+        self._postings = defaultdict(set)
+        self._profiles = {}
+        rows = self.model.query \
+            .with_entities(self.model.id, self.model.name, self.model.city,
+                           self.model.state, self.model.genres,
+                           getattr(self.model, self.seeking_column)) \
+            .all()
+        for row in rows:
+            self._add(*row)
+        self._built_at = time.monotonic()
+
+    def _add(self, model_id, name, city, state, genres, seeking):
+        if not parse_flag(seeking):
+            return
+        genres = frozenset(parse_genres(genres))
+        self._profiles[model_id] = {
+            "id": model_id,
+            "name": name,
+            "city": city,
+            "state": state,
+            "genres": genres
+        }
+        for genre in genres:
+            self._postings[(state, genre)].add(model_id)
+
+    def _discard(self, model_id):
+        profile = self._profiles.pop(model_id, None)
+        if profile is None:
+            return
+        for genre in profile['genres']:
+            key = (profile['state'], genre)
+            self._postings[key].discard(model_id)
+            if not self._postings[key]:
+                del self._postings[key]
+
+    def ensure_built(self):
+        if self._postings is None or \
+                time.monotonic() - self._built_at > self.max_age:
+            self._build()
+
+    def update(self, entity):
+        if self._postings is None:
+            return
+        self._discard(entity.id)
+        self._add(entity.id, entity.name, entity.city, entity.state,
+                  entity.genres, getattr(entity, self.seeking_column))
+
+    def remove(self, model_id):
+        if self._postings is not None:
+            self._discard(model_id)
+
+    def candidates(self, state, genres):
+        hits = defaultdict(int)
+        for genre in genres:
+            for model_id in self._postings.get((state, genre), ()):
+                hits[model_id] += 1
+        return hits
+
+    def profile(self, model_id):
+        return self._profiles[model_id]
+
+
+artist_seekers = SeekingIndex(Artist, 'seeking_venue')
+venue_seekers = SeekingIndex(Venue, 'seeking_talent')
+_lock = Lock()
+
+
+# ----------------------------------------------------------------------------#
+# Matching.
+# ----------------------------------------------------------------------------#
+
+# Ranks seeking entities in `index` against `entity`'s state and genres.
+# Returns (one page of matches, total number of matches).
+def find_matches(entity, index, page=1, per_page=10):
+    with _lock:
+        index.ensure_built()
+        hits = index.candidates(entity.state, parse_genres(entity.genres))
+        matches = []
+        for model_id, shared in hits.items():
+            profile = index.profile(model_id)
+            same_city = profile['city'].strip().lower() == \
+                entity.city.strip().lower()
+            matches.append({
+                "id": model_id,
+                "name": profile['name'],
+                "city": profile['city'],
+                "state": profile['state'],
+                "shared_genres": sorted(
+                    profile['genres'] & set(parse_genres(entity.genres))),
+                "score": shared + (CITY_BONUS if same_city else 0)
+            })
+
+    matches.sort(key=lambda match: (-match['score'], match['name']))
+    start = (page - 1) * per_page
+    return matches[start:start + per_page], len(matches)
+
+
+def artist_matches(artist, page=1, per_page=10):
+    return find_matches(artist, venue_seekers, page, per_page)
+
+
+def venue_matches(venue, page=1, per_page=10):
+    return find_matches(venue, artist_seekers, page, per_page)
+
+
+def update_artist(artist):
+    with _lock:
+        artist_seekers.update(artist)
+
+
+def update_venue(venue):
+    with _lock:
+        venue_seekers.update(venue)
+
+
+def remove_artist(artist_id):
+    with _lock:
+        artist_seekers.remove(artist_id)
+
+
+def remove_venue(venue_id):
+    with _lock:
+        venue_seekers.remove(venue_id)
@@ -0,0 +1,232 @@
+import functools
+import hmac
+import os
+import random
+import resource
+import signal
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+
+from flask import g, request
+
+# ----------------------------------------------------------------------------#
+# Per-route memory accounting.
+#
+# Every request records how much the worker's RSS grew while serving it,
+# which is two reads of /proc/self/statm. A sampled request (the
+# MEMORY_SAMPLE_RATE draw, or X-Profile-Memory: <PROFILE_TOKEN>) also runs
+# under tracemalloc for its peak Python allocation and the sites still
+# holding memory afterwards.
+#
+# The second reading is taken when the server closes the response, after
+# the last byte is sent, so a streamed listing is measured with its body.
+# That is also where an over-limit worker decides to recycle.
+#
+# tracemalloc is process-wide, so one request is traced at a time and
+# allocations by other threads during it are counted too. A whole body is
+# traced until after_request; a streamed one until its body is exhausted,
+# closed or dropped, so a response the server never closes cannot keep
+# tracing on. Numbers are per worker.
+# ----------------------------------------------------------------------------#
+
+SITES_KEPT = 50  # Allocation sites remembered per route
+
+
+def current_rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+class RouteMemory:
+    def __init__(self):
+        self.requests = 0
+        self.rss_growth = 0
+        self.rss_growth_max = 0
+        self.samples = 0
+        self.traced_peak_max = 0
+        self.traced_peak_total = 0
+        self.sites = Counter()
+
+    def record_rss(self, growth):
+        self.requests += 1
+        self.rss_growth += growth
+        self.rss_growth_max = max(self.rss_growth_max, growth)
+
+    def record_trace(self, peak, statistics):
+        self.samples += 1
+        self.traced_peak_max = max(self.traced_peak_max, peak)
+        self.traced_peak_total += peak
+        for stat in statistics:
+            frame = stat.traceback[0]
+            self.sites[f'{frame.filename}:{frame.lineno}'] += stat.size
+        if len(self.sites) > SITES_KEPT:
+            self.sites = Counter(dict(self.sites.most_common(SITES_KEPT)))
+
+    def top_sites(self, n=10):
+        # Average bytes held per sampled request
+        return [(site, size // self.samples)
+                for site, size in self.sites.most_common(n)]
+
+
+class _TracedBody:
+    """A streamed body that calls stop() once, when it is exhausted,
+    closed or garbage collected, whichever comes first."""
+
+    def __init__(self, chunks, stop):
+        self._chunks = chunks
+        self._stop = stop
+
+    def __iter__(self):
+        try:
+            yield from self._chunks
+        finally:
+            self.close()
+
+    def close(self):
+        stop, self._stop = self._stop, None
+        if stop is None:
+            return
+        try:
+            if hasattr(self._chunks, 'close'):
+                self._chunks.close()
+        finally:
+            stop()
+
+    __del__ = close
+
+
+class MemoryMonitor:
+    def __init__(self):
+        self.routes = {}
+        self.rss_limit = 0
+        self.recycling = False
+        self._lock = threading.Lock()
+        self._tracing = threading.Lock()
+
+    def route(self, endpoint):
+        with self._lock:
+            if endpoint not in self.routes:
+                self.routes[endpoint] = RouteMemory()
+            return self.routes[endpoint]
+
+    def init_app(self, app):
+        rate = app.config['MEMORY_SAMPLE_RATE']
+        token = app.config['PROFILE_TOKEN']
+        frames = app.config['MEMORY_TRACE_FRAMES']
+        top = app.config['MEMORY_TOP_SITES']
+        self.rss_limit = app.config['MEMORY_RSS_LIMIT_MB'] * 1024 * 1024
+
+        def wanted():
+            header = request.headers.get('X-Profile-Memory')
+            if header and token:
+                return hmac.compare_digest(header, token)
+            return rate > 0 and random.random() < rate
+
+        @app.before_request
+        def start_memory():
+            g.rss_before = current_rss()
+            # Something else (PYTHONTRACEMALLOC, a debugger) owns tracemalloc
+            if not wanted() or tracemalloc.is_tracing():
+                return
+            if self._tracing.acquire(blocking=False):
+                g.memory_traced = True
+                tracemalloc.start(frames)
+
+        @app.after_request
+        def record_memory(response):
+            route = self.route(request.endpoint or 'unknown')
+            rss_before = g.get('rss_before')
+            if g.pop('memory_traced', False):
+                stop = functools.partial(self._stop_trace, route, top)
+                if response.is_streamed:
+                    response.response = _TracedBody(response.response, stop)
+                else:
+                    response.headers['X-Memory-Peak'] = str(stop())
+            response.call_on_close(
+                lambda: self._finish(app, route, rss_before))
+            return response
+
+        @app.teardown_request
+        def stop_memory(exc):
+            # Still set only when after_request never ran, so no response
+            # will be closed
+            if g.pop('memory_traced', False):
+                tracemalloc.stop()
+                self._tracing.release()
+
+    def _stop_trace(self, route, top):
+        """Record the request's trace, stop tracing and return the peak."""
+        try:
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>')
+            ))
+            route.record_trace(peak, snapshot.statistics('lineno')[:top])
+            return peak
+        finally:
+            tracemalloc.stop()
+            self._tracing.release()
+
+    def _finish(self, app, route, rss_before):
+        rss = current_rss()
+        if rss_before is not None:
+            route.record_rss(max(rss - rss_before, 0))
+        if self.rss_limit and rss > self.rss_limit and not self.recycling:
+            self.recycling = True
+            app.logger.warning(
+                'Worker %s RSS %d MB is over the %d MB limit, recycling',
+                os.getpid(), rss // (1024 * 1024),
+                self.rss_limit // (1024 * 1024))
+            # The response is already sent. gunicorn treats SIGTERM as a
+            # graceful worker exit and forks a replacement.
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    def report(self):
+        return {
+            "pid": os.getpid(),
+            "rss": current_rss(),
+            "rss_peak": peak_rss(),
+            "rss_limit": self.rss_limit,
+            "routes": sorted(self.routes.items(),
+                             key=lambda item: -item[1].rss_growth)
+        }
+
+    def metrics(self):
+        """Prometheus text exposition for this worker."""
+        pid = os.getpid()
+        lines = [
+            '# TYPE fyyur_memory_rss_bytes gauge',
+            f'fyyur_memory_rss_bytes{{pid="{pid}"}} {current_rss()}',
+            '# TYPE fyyur_memory_rss_peak_bytes gauge',
+            f'fyyur_memory_rss_peak_bytes{{pid="{pid}"}} {peak_rss()}'
+        ]
+        series = (
+            ('fyyur_route_requests_total', 'counter', 'requests'),
+            ('fyyur_route_rss_growth_bytes_total', 'counter', 'rss_growth'),
+            ('fyyur_route_rss_growth_bytes_max', 'gauge', 'rss_growth_max'),
+            ('fyyur_route_traced_samples_total', 'counter', 'samples'),
+            ('fyyur_route_traced_peak_bytes_max', 'gauge', 'traced_peak_max')
+        )
+        routes = list(self.routes.items())
+        for name, kind, attribute in series:
+            lines.append(f'# TYPE {name} {kind}')
+            for endpoint, route in routes:
+                lines.append(f'{name}{{pid="{pid}",route="{endpoint}"}} '
+                             f'{getattr(route, attribute)}')
+        return '\n'.join(lines) + '\n'
+
+
+memory_monitor = MemoryMonitor()
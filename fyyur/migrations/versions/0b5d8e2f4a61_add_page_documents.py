@@ -0,0 +1,30 @@
+"""Add page documents read model
+
+Revision ID: 0b5d8e2f4a61
+Revises: f3c9a1d7e5b2
+Create Date: 2026-10-19 16:48:27.330958
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b5d8e2f4a61'
+down_revision = 'f3c9a1d7e5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('page_documents',
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('document', sa.Text(), nullable=False),
+    sa.Column('built_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'entity_id')
+    )
+
+
+def downgrade():
+    op.drop_table('page_documents')
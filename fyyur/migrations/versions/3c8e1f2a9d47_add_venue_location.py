@@ -0,0 +1,31 @@
+"""Add venue location
+
+Revision ID: 3c8e1f2a9d47
+Revises: b9b2d9406356
+Create Date: 2026-10-19 09:12:40.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c8e1f2a9d47'
+down_revision = 'b9b2d9406356'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('venue', sa.Column('geohash', sa.String(length=12), nullable=True))
+    op.create_index('ix_venue_geohash', 'venue', ['geohash'], unique=False,
+                    postgresql_ops={'geohash': 'varchar_pattern_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_venue_geohash', table_name='venue')
+    op.drop_column('venue', 'geohash')
+    op.drop_column('venue', 'longitude')
+    op.drop_column('venue', 'latitude')
@@ -0,0 +1,26 @@
+"""Index artist_similarity.similar_artist_id
+
+Revision ID: 5a1c9e3d7b20
+Revises: 0b5d8e2f4a61
+Create Date: 2026-10-19 17:32:05.118402
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5a1c9e3d7b20'
+down_revision = '0b5d8e2f4a61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # forget_artist and the incremental refresh look rows up by neighbour
+    op.create_index(op.f('ix_artist_similarity_similar_artist_id'),
+                    'artist_similarity', ['similar_artist_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_artist_similarity_similar_artist_id'),
+                  table_name='artist_similarity')
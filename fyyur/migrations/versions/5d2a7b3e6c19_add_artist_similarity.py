@@ -0,0 +1,40 @@
+"""Add artist similarity
+
+Revision ID: 5d2a7b3e6c19
+Revises: 3c8e1f2a9d47
+Create Date: 2026-10-19 10:03:22.640915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2a7b3e6c19'
+down_revision = '3c8e1f2a9d47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('artist_similarity',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('rank', sa.Integer(), nullable=False),
+    sa.Column('similar_artist_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['similar_artist_id'], ['artist.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('artist_id', 'rank')
+    )
+    op.create_table('artist_similarity_stale',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('artist_id')
+    )
+    # Every existing artist needs a first computation
+    op.execute('INSERT INTO artist_similarity_stale (artist_id) '
+               'SELECT id FROM artist')
+
+
+def downgrade():
+    op.drop_table('artist_similarity_stale')
+    op.drop_table('artist_similarity')
@@ -0,0 +1,81 @@
+"""Partition shows by start_time
+
+Revision ID: 8f4b6c1d2e05
+Revises: 5d2a7b3e6c19
+Create Date: 2026-10-19 11:20:51.904377
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+
+from partitions import create_partition, ensure_monthly_partitions
+
+
+# revision identifiers, used by Alembic.
+revision = '8f4b6c1d2e05'
+down_revision = '5d2a7b3e6c19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.rename_table('shows', 'shows_unpartitioned')
+    # Frees the shows_pkey name for the new table
+    op.execute('ALTER TABLE shows_unpartitioned '
+               'DROP CONSTRAINT IF EXISTS shows_pkey')
+    # The partition key has to be part of the primary key
+    op.execute("""
+        CREATE TABLE shows (
+            id INTEGER NOT NULL DEFAULT 1,
+            venue_id INTEGER NOT NULL REFERENCES venue (id),
+            artist_id INTEGER NOT NULL REFERENCES artist (id),
+            start_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, venue_id, artist_id, start_time)
+        ) PARTITION BY RANGE (start_time)
+    """)
+    op.execute('CREATE INDEX ix_shows_venue_id_start_time '
+               'ON shows (venue_id, start_time)')
+    op.execute('CREATE INDEX ix_shows_artist_id_start_time '
+               'ON shows (artist_id, start_time)')
+
+    this_year = date.today().year
+    first_year = bind.execute(sa.text(
+        'SELECT EXTRACT(YEAR FROM MIN(start_time)) FROM shows_unpartitioned'
+    )).scalar()
+    for year in range(int(first_year or this_year), this_year):
+        create_partition(bind, date(year, 1, 1), date(year + 1, 1, 1),
+                         f'shows_y{year:04d}')
+    ensure_monthly_partitions(bind, today=date(this_year, 1, 1),
+                              months_ahead=date.today().month - 1 + 12)
+    op.execute('CREATE TABLE shows_default PARTITION OF shows DEFAULT')
+
+    op.execute('INSERT INTO shows (id, venue_id, artist_id, start_time) '
+               'SELECT id, venue_id, artist_id, start_time '
+               'FROM shows_unpartitioned')
+    op.drop_table('shows_unpartitioned')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.rename_table('shows', 'shows_partitioned')
+    op.create_table('shows',
+    sa.Column('id', sa.Integer(), server_default='1', nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['venue.id'], ),
+    sa.PrimaryKeyConstraint('id', 'venue_id', 'artist_id')
+    )
+    op.execute('INSERT INTO shows (id, venue_id, artist_id, start_time) '
+               'SELECT id, venue_id, artist_id, start_time '
+               'FROM shows_partitioned')
+    op.execute('DROP TABLE shows_partitioned CASCADE')
@@ -0,0 +1,42 @@
+"""Add monthly show rollups
+
+Revision ID: a41e9c7b3f68
+Revises: 8f4b6c1d2e05
+Create Date: 2026-10-19 11:48:07.312566
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41e9c7b3f68'
+down_revision = '8f4b6c1d2e05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('venue_show_rollup',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('show_count', sa.Integer(), nullable=False),
+    sa.Column('artist_count', sa.Integer(), nullable=False),
+    sa.Column('genres', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['venue_id'], ['venue.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id', 'month')
+    )
+    op.create_table('artist_show_rollup',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('show_count', sa.Integer(), nullable=False),
+    sa.Column('venue_count', sa.Integer(), nullable=False),
+    sa.Column('genres', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['artist_id'], ['artist.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('artist_id', 'month')
+    )
+
+
+def downgrade():
+    op.drop_table('artist_show_rollup')
+    op.drop_table('venue_show_rollup')
@@ -0,0 +1,32 @@
+"""Add show stats cube
+
+Revision ID: c7d3e5f1a2b4
+Revises: a41e9c7b3f68
+Create Date: 2026-10-19 12:30:14.551083
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d3e5f1a2b4'
+down_revision = 'a41e9c7b3f68'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_stats_cube',
+    sa.Column('state', sa.String(length=120), nullable=False),
+    sa.Column('city', sa.String(length=120), nullable=False),
+    sa.Column('genre', sa.String(length=120), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('show_count', sa.Integer(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('state', 'city', 'genre', 'month')
+    )
+
+
+def downgrade():
+    op.drop_table('show_stats_cube')
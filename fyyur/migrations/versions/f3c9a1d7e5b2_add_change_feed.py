@@ -0,0 +1,43 @@
+"""Add change feed outbox
+
+Revision ID: f3c9a1d7e5b2
+Revises: e2a6f4c8b1d3
+Create Date: 2026-10-19 15:22:09.604115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c9a1d7e5b2'
+down_revision = 'e2a6f4c8b1d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_events',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('entity', sa.String(length=10), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('op', sa.String(length=10), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_change_events_created_at'), 'change_events',
+                    ['created_at'], unique=False)
+    op.create_table('change_feed_offsets',
+    sa.Column('consumer', sa.String(length=80), nullable=False),
+    sa.Column('position', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('consumer')
+    )
+
+
+def downgrade():
+    op.drop_table('change_feed_offsets')
+    op.drop_index(op.f('ix_change_events_created_at'),
+                  table_name='change_events')
+    op.drop_table('change_events')
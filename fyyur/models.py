@@ -1,8 +1,51 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 
+from geo import geocode, geohash_encode
+
 db = SQLAlchemy()
 
+# ----------------------------------------------------------------------------#
+# Helpers.
+# ----------------------------------------------------------------------------#
+
+# Genres are stored as a Postgres array literal, e.g. '{Jazz,Rock n Roll}'
+def parse_genres(genres):
+    if not genres:
+        return []
+    # Still the form's list on an instance that was not reloaded
+    if isinstance(genres, (list, tuple)):
+        return [genre for genre in genres if genre]
+    return [genre.strip('" ') for genre in
+            genres.replace('{', '').replace('}', '').split(',')
+            if genre.strip('" ')]
+
+
+def format_genres(genres):
+    """The array literal for a list of genres, quoted as Postgres does."""
+    return '{' + ','.join(
+        f'"{genre}"' if set(genre) & set(' ,{}"\\') else genre
+        for genre in genres) + '}'
+
+
+# Forms post genres as a list. psycopg2 turns that into an array literal by
+# itself; other drivers need it done here
+class Genres(db.TypeDecorator):
+    impl = db.String
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, (list, tuple)):
+            return format_genres(value)
+        return value
+
+
+# seeking_* columns hold whatever the form posted: True, 'true', 'y', ...
+def parse_flag(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 't', 'y', 'yes', '1', 'on')
+    return bool(value)
+
+
 # ----------------------------------------------------------------------------#
 # Models.
 # ----------------------------------------------------------------------------#
@@ -13,10 +56,16 @@ class Show(db.Model):
     id = db.Column(db.Integer, primary_key=True, server_default='1')
     venue_id = db.Column('venue_id', db.Integer, db.ForeignKey('venue.id'), primary_key=True)
     artist_id = db.Column('artist_id', db.Integer, db.ForeignKey('artist.id'), primary_key=True)
-    start_time = db.Column('start_time', db.DateTime, default=datetime.utcnow, nullable=False)
+    # Part of the key because Postgres range-partitions shows on it
+    start_time = db.Column('start_time', db.DateTime, default=datetime.utcnow, nullable=False, primary_key=True)
     venue = db.relationship('Venue', backref='venue_shows', cascade='all, delete', lazy='joined')
     artist = db.relationship('Artist', backref='artist_shows', cascade='all, delete', lazy='joined')
 
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    )
+
 
 class Venue(db.Model):
     __tablename__ = 'venue'
@@ -28,12 +77,30 @@ class Venue(db.Model):
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
-    genres = db.Column(db.String)
+    genres = db.Column(Genres)
     website = db.Column(db.String)
     seeking_talent = db.Column(db.String)
     seeking_description = db.Column(db.String)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
     shows = db.relationship('Show', backref='venues', lazy='joined')
 
+    # Prefix searches on geohash need a pattern index on Postgres
+    __table_args__ = (
+        db.Index('ix_venue_geohash', 'geohash',
+                 postgresql_ops={'geohash': 'varchar_pattern_ops'}),
+    )
+
+    def update_location(self):
+        location = geocode(self.city, self.state)
+        if location is None:
+            self.latitude = self.longitude = self.geohash = None
+        else:
+            self.latitude, self.longitude = location
+            self.geohash = geohash_encode(*location)
+        return location is not None
+
 class Artist(db.Model):
     __tablename__ = 'artist'
     id = db.Column(db.Integer, primary_key=True)
@@ -41,10 +108,106 @@ class Artist(db.Model):
     city = db.Column(db.String(120), nullable=False)
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120), nullable=False)
+    genres = db.Column(Genres(120), nullable=False)
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     website = db.Column(db.String)
     seeking_venue = db.Column(db.String)
     seeking_description = db.Column(db.String)
     shows = db.relationship('Show', backref='artists', lazy='joined')
+
+
+class ArtistSimilarity(db.Model):
+    __tablename__ = 'artist_similarity'
+    artist_id = db.Column(db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    similar_artist_id = db.Column(db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+
+
+# Artists whose similarity rows must be recomputed by the next job run
+class StaleArtistSimilarity(db.Model):
+    __tablename__ = 'artist_similarity_stale'
+    artist_id = db.Column(db.Integer, primary_key=True)
+
+
+class VenueShowRollup(db.Model):
+    __tablename__ = 'venue_show_rollup'
+    venue_id = db.Column(db.Integer, db.ForeignKey('venue.id', ondelete='CASCADE'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    show_count = db.Column(db.Integer, nullable=False, default=0)
+    artist_count = db.Column(db.Integer, nullable=False, default=0)
+    genres = db.Column(db.String)
+
+
+class ArtistShowRollup(db.Model):
+    __tablename__ = 'artist_show_rollup'
+    artist_id = db.Column(db.Integer, db.ForeignKey('artist.id', ondelete='CASCADE'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    show_count = db.Column(db.Integer, nullable=False, default=0)
+    venue_count = db.Column(db.Integer, nullable=False, default=0)
+    genres = db.Column(db.String)
+
+
+# Shows per venue state x city x artist genre x month, refreshed offline
+class ShowStatsCube(db.Model):
+    __tablename__ = 'show_stats_cube'
+    state = db.Column(db.String(120), primary_key=True)
+    city = db.Column(db.String(120), primary_key=True)
+    genre = db.Column(db.String(120), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    show_count = db.Column(db.Integer, nullable=False)
+    refreshed_at = db.Column(db.DateTime, nullable=False)
+
+
+# Background work, claimed and run by `flask worker`; see jobs.py
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    queue = db.Column(db.String(40), nullable=False)
+    name = db.Column(db.String(80), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    dedupe_key = db.Column(db.String(200))
+    priority = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(120))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_jobs_claim', 'queue', 'status', 'priority', 'run_at'),
+        db.Index('ix_jobs_dedupe_key', 'dedupe_key'),
+    )
+
+
+# Transactional outbox of catalog changes; see changes.py. id is the
+# change feed offset.
+class ChangeEvent(db.Model):
+    __tablename__ = 'change_events'
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    entity = db.Column(db.String(10), nullable=False)
+    entity_id = db.Column(db.Integer)
+    op = db.Column(db.String(10), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+# How far each change feed consumer has read
+class ChangeFeedOffset(db.Model):
+    __tablename__ = 'change_feed_offsets'
+    consumer = db.Column(db.String(80), primary_key=True)
+    position = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Pre-assembled detail page per venue and artist; see read_model.py
+class PageDocument(db.Model):
+    __tablename__ = 'page_documents'
+    kind = db.Column(db.String(10), primary_key=True)
+    entity_id = db.Column(db.Integer, primary_key=True)
+    document = db.Column(db.Text, nullable=False)
+    built_at = db.Column(db.DateTime, nullable=False)
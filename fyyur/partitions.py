@@ -0,0 +1,123 @@
+import re
+from datetime import date
+
+from database import supports
+from models import db
+
+# ----------------------------------------------------------------------------#
+# Range partitions of the shows table (Postgres only).
+#
+# History lives in yearly partitions named shows_yYYYY, the current year
+# onwards in monthly partitions named shows_mYYYYMM, and shows_default
+# catches anything outside them. Queries that filter on start_time only
+# touch the partitions whose range can match.
+#
+# Postgres refuses to create a partition whose range matches rows already
+# in the default partition, which is where a show booked past the last
+# monthly partition lands. Extending detaches shows_default, creates the
+# new months, moves their rows out of it and attaches it again.
+# ----------------------------------------------------------------------------#
+
+DEFAULT_PARTITION = 'shows_default'
+
+_name_re = re.compile(r'^shows_(?:y(\d{4})|m(\d{4})(\d{2}))$')
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_bounds(name):
+    """Returns the [start, end) dates a partition name covers, or None."""
+    match = _name_re.match(name)
+    if match is None:
+        return None
+    year, month_year, month = match.groups()
+    if year:
+        return date(int(year), 1, 1), date(int(year) + 1, 1, 1)
+    start = date(int(month_year), int(month), 1)
+    return start, _add_months(start, 1)
+
+
+def is_partitioned(bind=None):
+    bind = bind or db.session
+    engine = bind.get_bind() if hasattr(bind, 'get_bind') else bind
+    if not supports('partitions', engine):
+        return False
+    return bind.execute(db.text(
+        "SELECT 1 FROM pg_partitioned_table p "
+        "JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'shows'")).scalar() is not None
+
+
+def list_partitions(bind=None):
+    bind = bind or db.session
+    rows = bind.execute(db.text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'shows'::regclass "
+        "ORDER BY c.relname")).fetchall()
+    return [name for name, in rows]
+
+
+def create_partition(bind, start, end, name):
+    bind.execute(db.text(
+        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF shows "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"))
+
+
+def _move_from_default(bind, start, end):
+    # Runs while shows_default is detached, so the rows are routed to the
+    # partition just created for them
+    bind.execute(db.text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE start_time >= :start AND start_time < :end "
+        f"RETURNING id, venue_id, artist_id, start_time) "
+        f"INSERT INTO shows (id, venue_id, artist_id, start_time) "
+        f"SELECT id, venue_id, artist_id, start_time FROM moved"),
+        {"start": start, "end": end})
+
+
+def ensure_monthly_partitions(bind=None, months_ahead=12, today=None):
+    """Creates any missing monthly partitions up to months_ahead from now."""
+    bind = bind or db.session
+    existing = set(list_partitions(bind))
+    month = (today or date.today()).replace(day=1)
+    missing = []
+    for offset in range(months_ahead + 1):
+        start = _add_months(month, offset)
+        name = f'shows_m{start.year:04d}{start.month:02d}'
+        if name not in existing and f'shows_y{start.year:04d}' not in existing:
+            missing.append((start, _add_months(start, 1), name))
+    if not missing:
+        return []
+
+    has_default = DEFAULT_PARTITION in existing
+    if has_default:
+        bind.execute(db.text(
+            f'ALTER TABLE shows DETACH PARTITION {DEFAULT_PARTITION}'))
+    for start, end, name in missing:
+        create_partition(bind, start, end, name)
+    if has_default:
+        for start, end, _ in missing:
+            _move_from_default(bind, start, end)
+        bind.execute(db.text(
+            f'ALTER TABLE shows ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT'))
+    return [name for _, _, name in missing]
+
+
+def detach_partitions(before, bind=None):
+    """Detaches partitions that end on or before `before` for archiving.
+
+    The detached tables are left in place, so they can be dumped and
+    dropped, or attached again.
+    """
+    bind = bind or db.session
+    detached = []
+    for name in list_partitions(bind):
+        bounds = partition_bounds(name)
+        if bounds is not None and bounds[1] <= before:
+            bind.execute(db.text(f'ALTER TABLE shows DETACH PARTITION {name}'))
+            detached.append(name)
+    return detached
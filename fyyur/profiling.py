@@ -0,0 +1,203 @@
+import functools
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# ----------------------------------------------------------------------------#
+# Opt-in request profiling.
+#
+# A request is profiled when it wins the PROFILE_SAMPLE_RATE draw or sends
+# X-Profile with PROFILE_TOKEN. It then gets:
+#
+# <id>.folded      sampled stacks in collapsed format, for flamegraph.pl
+#                  or speedscope
+# <id>.trace.json  Chrome trace events for the request, get_shows, SQL,
+#                  template renders and filters (chrome://tracing, Perfetto)
+#
+# Unprofiled requests pay one attribute lookup per hook.
+# ----------------------------------------------------------------------------#
+
+
+_safe_id_re = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class Trace:
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.tid = threading.get_ident()
+        self.events = []
+
+    def add(self, name, category, started, ended, **args):
+        self.events.append({
+            "name": name,
+            "cat": category,
+            "ph": 'X',
+            "ts": round((started - self.origin) * 1e6, 1),
+            "dur": round((ended - started) * 1e6, 1),
+            "pid": self.pid,
+            "tid": self.tid,
+            "args": args
+        })
+
+    @contextmanager
+    def span(self, name, category, **args):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, category, started, time.perf_counter(), **args)
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": self.events,
+                       "displayTimeUnit": 'ms'}, f)
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack every `interval` seconds."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} '
+                             f'({os.path.basename(code.co_filename)}'
+                             f':{frame.f_lineno})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+def current_trace():
+    if has_request_context():
+        return g.get('trace')
+    return None
+
+
+def traced(name, category='app'):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = current_trace()
+            if trace is None:
+                return fn(*args, **kwargs)
+            with trace.span(name, category):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracedTemplate(Template):
+    def render(self, *args, **kwargs):
+        trace = current_trace()
+        if trace is None:
+            return super().render(*args, **kwargs)
+        with trace.span(self.name or 'template', 'render'):
+            return super().render(*args, **kwargs)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _trace_query_start(conn, cursor, statement, parameters, context,
+                       executemany):
+    if current_trace() is not None:
+        conn.info['trace_query_started'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _trace_query_end(conn, cursor, statement, parameters, context,
+                     executemany):
+    started = conn.info.pop('trace_query_started', None)
+    trace = current_trace()
+    if started is not None and trace is not None:
+        trace.add('SQL', 'sql', started, time.perf_counter(),
+                  statement=statement[:500])
+
+
+# ----------------------------------------------------------------------------#
+# Setup.
+# ----------------------------------------------------------------------------#
+
+def setup_profiling(app):
+    directory = app.config['PROFILE_DIR']
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    token = app.config['PROFILE_TOKEN']
+    interval = app.config['PROFILE_INTERVAL']
+
+    app.jinja_env.template_class = TracedTemplate
+    for name in app.config['PROFILE_FILTERS']:
+        app.jinja_env.filters[name] = traced(f'filter:{name}', 'filter')(
+            app.jinja_env.filters[name])
+
+    def wanted():
+        header = request.headers.get('X-Profile')
+        if header and token:
+            return hmac.compare_digest(header, token)
+        return rate > 0 and random.random() < rate
+
+    @app.before_request
+    def start_profile():
+        if not wanted():
+            return
+        # Request ids can come from a client header and end up in a path
+        trace_id = g.get('request_id') or ''
+        if not _safe_id_re.match(trace_id):
+            trace_id = uuid.uuid4().hex
+        g.trace = Trace(trace_id)
+        g.trace_started = time.perf_counter()
+        g.sampler = StackSampler(threading.get_ident(), interval)
+        g.sampler.start()
+
+    @app.after_request
+    def tag_profile(response):
+        if g.get('trace') is not None:
+            response.headers['X-Profile-Id'] = g.trace.trace_id
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        trace = g.pop('trace', None)
+        if trace is None:
+            return
+        sampler = g.pop('sampler')
+        sampler.stop()
+        trace.add(f'{request.method} {request.path}', 'request',
+                  g.trace_started, time.perf_counter(),
+                  endpoint=request.endpoint)
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, trace.trace_id)
+        trace.dump(base + '.trace.json')
+        sampler.dump(base + '.folded')
+        app.logger.info('Wrote profile %s', base)
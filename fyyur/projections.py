@@ -0,0 +1,145 @@
+import time
+import tracemalloc
+from collections import namedtuple
+from itertools import groupby
+
+from models import db, Artist, Venue, Show
+from catalog import catalog
+import queries
+
+# ----------------------------------------------------------------------------#
+# Row projections for the list pages.
+#
+# The listings select only the columns their templates print and hand each
+# row over as a namedtuple: immutable, no __dict__, and no ORM state,
+# identity map entry or collection loaders behind it. Templates read them
+# by attribute exactly as they read entities.
+# ----------------------------------------------------------------------------#
+
+ArtistItem = namedtuple('ArtistItem', 'id name')
+VenueItem = namedtuple('VenueItem', 'id name num_upcoming_shows')
+Area = namedtuple('Area', 'city state venues')
+ShowTile = namedtuple('ShowTile', 'venue_id venue_name artist_id '
+                                  'artist_name artist_image_link start_time')
+
+
+def artist_items():
+    return map(ArtistItem._make, queries.artist_names())
+
+
+def venue_areas(upcoming):
+    """Areas in state, city order, each with its venues."""
+    # Rows arrive grouped by area, so each area goes out as soon as its
+    # rows are read
+    rows = queries.venue_names_by_area()
+    for (city, state), area in groupby(rows, key=lambda row: row[2:]):
+        yield Area(city, state, [
+            VenueItem(venue_id, name, upcoming.get(venue_id, 0))
+            for venue_id, name, _, _ in area])
+
+
+def show_tile(venue_id, artist_id, start_time, snapshot=None):
+    venue_name, _ = catalog.lookup('venue', venue_id, snapshot)
+    artist_name, artist_image_link = \
+        catalog.lookup('artist', artist_id, snapshot)
+    return ShowTile(venue_id, venue_name, artist_id, artist_name,
+                    artist_image_link, str(start_time))
+
+
+def show_tiles():
+    # Names and images come from the shared catalog snapshot, so the only
+    # query is the shows scan
+    snapshot = catalog.current()
+    for venue_id, artist_id, start_time in queries.all_shows():
+        yield show_tile(venue_id, artist_id, start_time, snapshot)
+
+
+# ----------------------------------------------------------------------------#
+# Benchmark against entity hydration.
+# ----------------------------------------------------------------------------#
+
+def _entity_venue_areas():
+    venues = Venue.query.options(db.noload(Venue.shows)) \
+        .order_by(Venue.state, Venue.city, Venue.id) \
+        .yield_per(500)
+    for (city, state), area in groupby(
+            venues, key=lambda venue: (venue.city, venue.state)):
+        yield {"city": city, "state": state, "venues": [{
+            "id": venue.id,
+            "name": venue.name,
+            "num_upcoming_shows": 0
+        } for venue in area]}
+
+
+def _entity_show_tiles():
+    snapshot = catalog.current()
+    shows = Show.query \
+        .options(db.noload(Show.venue), db.noload(Show.artist)) \
+        .yield_per(500)
+    for show in shows:
+        venue_name, _ = catalog.lookup('venue', show.venue_id, snapshot)
+        artist_name, artist_image_link = \
+            catalog.lookup('artist', show.artist_id, snapshot)
+        yield {
+            "venue_id": show.venue_id,
+            "venue_name": venue_name,
+            "artist_id": show.artist_id,
+            "artist_name": artist_name,
+            "artist_image_link": artist_image_link,
+            "start_time": str(show.start_time)
+        }
+
+
+def _entity_listings():
+    # The list pages as they read before projections
+    return {
+        'artists': lambda: Artist.query.options(db.noload(Artist.shows))
+        .yield_per(500).all(),
+        'venues': lambda: list(_entity_venue_areas()),
+        'shows': lambda: list(_entity_show_tiles()),
+    }
+
+
+def _projected_listings():
+    return {
+        'artists': lambda: list(artist_items()),
+        'venues': lambda: list(venue_areas({})),
+        'shows': lambda: list(show_tiles()),
+    }
+
+
+def _measure(fn):
+    db.session.expunge_all()
+    started = time.perf_counter()
+    items = len(fn())
+    elapsed = time.perf_counter() - started
+    db.session.expunge_all()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return items, elapsed * 1000, peak
+
+
+def benchmark():
+    """Time and peak traced memory of each listing, reading entities and
+    reading projections. Entities are expunged between runs so each one
+    hydrates from scratch."""
+    results = []
+    entity, projected = _entity_listings(), _projected_listings()
+    for name in entity:
+        projected[name]()  # Bake and map the catalog outside the timing
+        items, entity_ms, entity_peak = _measure(entity[name])
+        _, projected_ms, projected_peak = _measure(projected[name])
+        results.append({
+            'listing': name,
+            'items': items,
+            'entity_ms': entity_ms,
+            'projected_ms': projected_ms,
+            'entity_peak_kb': entity_peak / 1024,
+            'projected_peak_kb': projected_peak / 1024,
+        })
+    db.session.rollback()
+    return results
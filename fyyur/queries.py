@@ -0,0 +1,221 @@
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam
+from sqlalchemy.ext import baked
+
+from database import supports
+from models import db, Artist, Venue, Show, PageDocument
+
+# ----------------------------------------------------------------------------#
+# Baked queries for the hot routes.
+#
+# A baked query builds its Query and compiles the SQL once per process,
+# keyed on the code of the lambdas that make it; later calls only bind
+# parameters. So every value that changes between calls is a bindparam(),
+# never a closed-over variable, and each variant (venue or artist, past or
+# upcoming) is built from its own lambdas.
+#
+# On Postgres the reads made for every detail page and thumbnail are also
+# PREPAREd, which saves the server its parse and plan. Each statement is
+# prepared the first time it runs on a connection, not when the connection
+# opens, so other users of the engine (migrations, CLI commands) never
+# prepare against tables they may not have yet.
+# ----------------------------------------------------------------------------#
+
+bakery = baked.bakery(size=200)
+
+
+def _session():
+    # Baked queries need the Session itself, not the scoped_session proxy
+    return db.session()
+
+
+# ----------------------------------------------------------------------------#
+# Prepared statements (Postgres).
+# ----------------------------------------------------------------------------#
+
+PREPARED = {
+    'page_document': 'SELECT document, built_at FROM page_documents '
+                     'WHERE kind = $1 AND entity_id = $2',
+    'venue_image_link': 'SELECT image_link FROM venue WHERE id = $1',
+    'artist_image_link': 'SELECT image_link FROM artist WHERE id = $1',
+}
+
+
+def _execute_prepared(name, *args):
+    connection = db.session.connection()
+    # Connection.info lives as long as the DBAPI connection, and so do its
+    # prepared statements; a reconnect starts with an empty set
+    prepared = connection.info.setdefault('prepared_statements', set())
+    if name not in prepared:
+        connection.execute(f'PREPARE {name} AS {PREPARED[name]}')
+        prepared.add(name)
+    placeholders = ', '.join(f':p{i}' for i in range(len(args)))
+    return connection.execute(
+        db.text(f'EXECUTE {name}({placeholders})'),
+        {f'p{i}': arg for i, arg in enumerate(args)}).first()
+
+
+# ----------------------------------------------------------------------------#
+# Primary-key reads.
+# ----------------------------------------------------------------------------#
+
+def page_document(kind, entity_id):
+    """(document, built_at) or None."""
+    if supports('prepared_statements'):
+        return _execute_prepared('page_document', kind, entity_id)
+    bq = bakery(lambda s: s.query(PageDocument.document,
+                                  PageDocument.built_at))
+    bq += lambda q: q.filter(PageDocument.kind == bindparam('kind'),
+                             PageDocument.entity_id == bindparam('entity_id'))
+    return bq(_session()).params(kind=kind, entity_id=entity_id).first()
+
+
+def image_link(kind, entity_id):
+    if supports('prepared_statements'):
+        row = _execute_prepared(f'{kind}_image_link', entity_id)
+        return row[0] if row else None
+    if kind == 'venue':
+        bq = bakery(lambda s: s.query(Venue.image_link))
+        bq += lambda q: q.filter(Venue.id == bindparam('entity_id'))
+    else:
+        bq = bakery(lambda s: s.query(Artist.image_link))
+        bq += lambda q: q.filter(Artist.id == bindparam('entity_id'))
+    return bq(_session()).params(entity_id=entity_id).scalar()
+
+
+# ----------------------------------------------------------------------------#
+# Listings and shows.
+# ----------------------------------------------------------------------------#
+
+def venue_names_by_area():
+    """(id, name, city, state) rows in state, city order."""
+    bq = bakery(lambda s: s.query(Venue.id, Venue.name, Venue.city,
+                                  Venue.state))
+    # yield_per must be baked in: a baked query runs the cached Query, so
+    # criteria added after the cache lookup never reach the loader
+    bq += lambda q: q.order_by(Venue.state, Venue.city, Venue.id) \
+        .yield_per(500)
+    return bq(_session())
+
+
+def artist_names():
+    bq = bakery(lambda s: s.query(Artist.id, Artist.name).yield_per(500))
+    return bq(_session())
+
+
+def all_shows():
+    bq = bakery(lambda s: s.query(Show.venue_id, Show.artist_id,
+                                  Show.start_time).yield_per(500))
+    return bq(_session())
+
+
+def upcoming_counts(kind, ids=None):
+    """{id: upcoming show count} for every venue or artist, or for ids."""
+    if kind == 'venue':
+        bq = bakery(lambda s: s.query(Show.venue_id, db.func.count(Show.id)))
+        bq += lambda q: q.filter(Show.start_time > bindparam('now')) \
+            .group_by(Show.venue_id)
+        if ids is not None:
+            bq += lambda q: q.filter(
+                Show.venue_id.in_(bindparam('ids', expanding=True)))
+    else:
+        bq = bakery(lambda s: s.query(Show.artist_id,
+                                      db.func.count(Show.id)))
+        bq += lambda q: q.filter(Show.start_time > bindparam('now')) \
+            .group_by(Show.artist_id)
+        if ids is not None:
+            bq += lambda q: q.filter(
+                Show.artist_id.in_(bindparam('ids', expanding=True)))
+    params = {'now': datetime.now()}
+    if ids is not None:
+        if not ids:
+            return {}
+        params['ids'] = list(ids)
+    return dict(bq(_session()).params(**params).all())
+
+
+def shows_for(model_type, show_type, model_id, limit=None, offset=0):
+    """(venue_id, artist_id, start_time) rows of one venue's or artist's
+    past or upcoming shows."""
+    bq = bakery(lambda s: s.query(Show.venue_id, Show.artist_id,
+                                  Show.start_time))
+    # Bounding start_time lets Postgres prune to the matching partitions
+    if show_type == 'past':
+        bq += lambda q: q.filter(Show.start_time < bindparam('now')) \
+            .order_by(Show.start_time.desc())
+    else:
+        bq += lambda q: q.filter(Show.start_time > bindparam('now')) \
+            .order_by(Show.start_time)
+    if model_type == 'venue':
+        bq += lambda q: q.filter(Show.venue_id == bindparam('model_id'))
+    else:
+        bq += lambda q: q.filter(Show.artist_id == bindparam('model_id'))
+    params = {'now': datetime.now(), 'model_id': model_id}
+    if limit is not None:
+        bq += lambda q: q.limit(bindparam('limit')) \
+            .offset(bindparam('offset'))
+        params.update(limit=limit, offset=offset)
+    return bq(_session()).params(**params).all()
+
+
+# ----------------------------------------------------------------------------#
+# Microbenchmark.
+# ----------------------------------------------------------------------------#
+
+def _time(fn, n):
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def benchmark(n=2000):
+    """Microseconds per call of each hot query, built per call as the
+    routes used to and baked. Also times building and compiling the plain
+    Query alone, which is the ORM overhead baking removes."""
+    venue_id = db.session.query(db.func.min(Venue.id)).scalar()
+    artist_id = db.session.query(db.func.min(Artist.id)).scalar()
+    if venue_id is None or artist_id is None:
+        raise ValueError('Benchmarking needs at least one venue and artist')
+    now = datetime.now()
+    plain = {
+        'page document': (
+            lambda: db.session.query(PageDocument.document,
+                                     PageDocument.built_at)
+            .filter(PageDocument.kind == 'venue',
+                    PageDocument.entity_id == venue_id),
+            lambda: page_document('venue', venue_id)),
+        'image link': (
+            lambda: db.session.query(Artist.image_link)
+            .filter(Artist.id == artist_id),
+            lambda: image_link('artist', artist_id)),
+        'past shows page': (
+            lambda: db.session
+            .query(Show.venue_id, Show.artist_id, Show.start_time)
+            .filter(Show.start_time < now)
+            .order_by(Show.start_time.desc())
+            .filter(Show.venue_id == venue_id)
+            .limit(12).offset(0),
+            lambda: shows_for('venue', 'past', venue_id, 12, 0)),
+        'upcoming counts': (
+            lambda: db.session
+            .query(Show.venue_id, db.func.count(Show.id))
+            .filter(Show.start_time > now)
+            .group_by(Show.venue_id),
+            lambda: upcoming_counts('venue')),
+    }
+    dialect = db.engine.dialect
+    results = []
+    for name, (build, baked_call) in plain.items():
+        baked_call()  # Bake outside the timing
+        results.append({
+            'query': name,
+            'compile_us': _time(
+                lambda: build().statement.compile(dialect=dialect), n),
+            'plain_us': _time(lambda: build().all(), n),
+            'baked_us': _time(baked_call, n),
+        })
+    db.session.rollback()
+    return results
@@ -0,0 +1,201 @@
+import json
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+
+from database import unit_of_work
+from models import db, parse_genres, Artist, Venue, Show, PageDocument
+import queries
+import rollups
+
+# ----------------------------------------------------------------------------#
+# Detail page documents.
+#
+# One page_documents row per venue and artist holds everything its detail
+# page shows on the first past page: profile, parsed genres, the monthly
+# rollup table, the newest past shows and every upcoming show, so a page
+# view is one primary-key read. A write rebuilds the documents of what it
+# touched in its own transaction, so the page it redirects to is current;
+# the change feed jobs then rebuild the pages on the other side of its
+# shows, where a name or image also appears, and any whose rollups moved.
+#
+# Shows are classified past or upcoming when the page is read, so a show
+# that starts after its document was built moves across on its own.
+# Documents older than PAGE_DOCUMENT_MAX_AGE are rebuilt on read, which
+# keeps the rollup table's month boundary current.
+# ----------------------------------------------------------------------------#
+
+PAST_SHOWS_PER_PAGE = 12
+
+PROFILE_FIELDS = {
+    'venue': ('id', 'name', 'city', 'state', 'address', 'phone',
+              'image_link', 'facebook_link', 'website', 'seeking_talent',
+              'seeking_description'),
+    'artist': ('id', 'name', 'city', 'state', 'phone', 'image_link',
+               'facebook_link', 'website', 'seeking_venue',
+               'seeking_description')
+}
+
+
+def _shows(kind, entity_id, upcoming, limit=None):
+    if kind == 'venue':
+        other, prefix, own = Artist, 'artist', Show.venue_id
+    else:
+        other, prefix, own = Venue, 'venue', Show.artist_id
+    now = datetime.now()
+    query = db.session.query(other.id, other.name, other.image_link,
+                             Show.start_time) \
+        .join(other, (Show.artist_id if kind == 'venue'
+                      else Show.venue_id) == other.id) \
+        .filter(own == entity_id)
+    if upcoming:
+        query = query.filter(Show.start_time > now) \
+            .order_by(Show.start_time)
+    else:
+        query = query.filter(Show.start_time < now) \
+            .order_by(Show.start_time.desc())
+    return [{
+        f'{prefix}_id': other_id,
+        f'{prefix}_name': name,
+        f'{prefix}_image_link': image_link,
+        "start_time": str(start_time)
+    } for other_id, name, image_link, start_time in query.limit(limit)]
+
+
+def build(kind, entity_id):
+    """Assemble the document from the catalog, or None if it is gone."""
+    model = Venue if kind == 'venue' else Artist
+    entity = model.query.options(db.noload(model.shows)).get(entity_id)
+    if entity is None:
+        return None
+    document = {field: getattr(entity, field)
+                for field in PROFILE_FIELDS[kind]}
+    document['genres'] = parse_genres(entity.genres)
+    summary = rollups.past_summary(kind, entity_id)
+    document['past_months'] = [dict(month, month=month['month'].isoformat())
+                               for month in summary['months']]
+    document['past_shows_count'] = summary['past_shows_count']
+    document['past_shows'] = _shows(kind, entity_id, False,
+                                    PAST_SHOWS_PER_PAGE)
+    document['upcoming_shows'] = _shows(kind, entity_id, True)
+    return document
+
+
+def rebuild(kind, entity_id):
+    """Rebuild one document in the current transaction. Callers commit."""
+    document = build(kind, entity_id)
+    if document is None:
+        PageDocument.query \
+            .filter(PageDocument.kind == kind,
+                    PageDocument.entity_id == entity_id) \
+            .delete(synchronize_session=False)
+        return None
+    db.session.merge(PageDocument(kind=kind, entity_id=entity_id,
+                                  document=json.dumps(document),
+                                  built_at=datetime.utcnow()))
+    return document
+
+
+def rebuild_many(keys, cascade=()):
+    """Rebuild (kind, id) documents, and for each (kind, id) in cascade,
+    the documents on the other side of its shows."""
+    keys = set(keys)
+    for kind, entity_id in cascade:
+        keys.add((kind, entity_id))
+        if kind == 'venue':
+            others = db.session.query(Show.artist_id.distinct()) \
+                .filter(Show.venue_id == entity_id)
+            keys.update(('artist', other) for other, in others)
+        else:
+            others = db.session.query(Show.venue_id.distinct()) \
+                .filter(Show.artist_id == entity_id)
+            keys.update(('venue', other) for other, in others)
+    for kind, entity_id in sorted(keys):
+        rebuild(kind, entity_id)
+    return len(keys)
+
+
+def rebuild_all(batch_size=500):
+    built = 0
+    for kind, model in (('venue', Venue), ('artist', Artist)):
+        ids = [entity_id for entity_id, in db.session.query(model.id)]
+        for entity_id in ids:
+            rebuild(kind, entity_id)
+            built += 1
+            if built % batch_size == 0:
+                db.session.commit()
+    db.session.commit()
+    return built
+
+
+# ----------------------------------------------------------------------------#
+# Page reads.
+# ----------------------------------------------------------------------------#
+
+def settle(document, now=None):
+    """Move shows that have started since the build into the past."""
+    now = now or datetime.now()
+    upcoming, started = [], []
+    for show in document['upcoming_shows']:
+        if datetime.fromisoformat(show['start_time']) < now:
+            started.append(show)
+        else:
+            upcoming.append(show)
+    document['upcoming_shows'] = upcoming
+    document['upcoming_shows_count'] = len(upcoming)
+    document['past_shows'] = (started[::-1] + document['past_shows'])[
+        :PAST_SHOWS_PER_PAGE]
+    document['past_shows_count'] += len(started)
+    document['past_months'] = [dict(month,
+                                    month=date.fromisoformat(month['month']))
+                               for month in document['past_months']]
+    return document
+
+
+def load(kind, entity_id):
+    """The detail page document, or None if there is no such entity."""
+    row = queries.page_document(kind, entity_id)
+    max_age = timedelta(seconds=current_app.config['PAGE_DOCUMENT_MAX_AGE'])
+    if row is not None and row.built_at > datetime.utcnow() - max_age:
+        document = json.loads(row.document)
+    else:
+        with unit_of_work():
+            document = rebuild(kind, entity_id)
+        if document is None:
+            return None
+        # Round trip so both paths hand settle() the same JSON types
+        document = json.loads(json.dumps(document))
+    return settle(document)
+
+
+# ----------------------------------------------------------------------------#
+# Consistency check.
+# ----------------------------------------------------------------------------#
+
+def check(fix=False):
+    """Compare every stored document with a fresh build.
+
+    Returns (kind, id, problem) tuples; with fix, the documents are
+    rebuilt as well.
+    """
+    problems = []
+    expected = {(kind, entity_id)
+                for kind, model in (('venue', Venue), ('artist', Artist))
+                for entity_id, in db.session.query(model.id)}
+    stored = {(row.kind, row.entity_id): row
+              for row in PageDocument.query}
+    for key in sorted(expected - set(stored)):
+        problems.append(key + ('missing',))
+    for key in sorted(set(stored) - expected):
+        problems.append(key + ('orphaned',))
+    now = datetime.now()
+    for key in sorted(expected & set(stored)):
+        fresh = build(*key)
+        fresh = settle(json.loads(json.dumps(fresh)), now)
+        if settle(json.loads(stored[key].document), now) != fresh:
+            problems.append(key + ('stale',))
+    if fix:
+        for kind, entity_id, _ in problems:
+            rebuild(kind, entity_id)
+        db.session.commit()
+    return problems
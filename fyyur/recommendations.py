@@ -0,0 +1,212 @@
+import numpy as np
+
+from models import (
+    db,
+    parse_genres,
+    Artist,
+    Show,
+    ArtistSimilarity,
+    StaleArtistSimilarity
+)
+
+TOP_K = 6
+BLOCK_SIZE = 1024  # Similarity scores are computed BLOCK_SIZE² at a time
+
+
+# ----------------------------------------------------------------------------#
+# Write hooks. Callers commit.
+# ----------------------------------------------------------------------------#
+
+def mark_stale(*artist_ids):
+    for artist_id in set(artist_ids):
+        if artist_id is not None:
+            db.session.merge(StaleArtistSimilarity(artist_id=int(artist_id)))
+
+
+def forget_artist(artist_id):
+    # Artists that listed this one need a new neighbour in its place
+    referrers = db.session.query(ArtistSimilarity.artist_id) \
+        .filter(ArtistSimilarity.similar_artist_id == artist_id) \
+        .all()
+    mark_stale(*[referrer for referrer, in referrers])
+    ArtistSimilarity.query \
+        .filter(db.or_(ArtistSimilarity.artist_id == artist_id,
+                       ArtistSimilarity.similar_artist_id == artist_id)) \
+        .delete(synchronize_session=False)
+    StaleArtistSimilarity.query \
+        .filter(StaleArtistSimilarity.artist_id == artist_id) \
+        .delete(synchronize_session=False)
+
+
+# ----------------------------------------------------------------------------#
+# Page lookup.
+# ----------------------------------------------------------------------------#
+
+def similar_artists(artist_id):
+    rows = db.session.query(Artist.id, Artist.name, Artist.image_link) \
+        .join(ArtistSimilarity,
+              ArtistSimilarity.similar_artist_id == Artist.id) \
+        .filter(ArtistSimilarity.artist_id == artist_id) \
+        .order_by(ArtistSimilarity.rank) \
+        .all()
+    return [{
+        "artist_id": row.id,
+        "artist_name": row.name,
+        "artist_image_link": row.image_link
+    } for row in rows]
+
+
+# ----------------------------------------------------------------------------#
+# Offline computation.
+# ----------------------------------------------------------------------------#
+
+# One row per artist: one-hot genres followed by one-hot venues played,
+# L2-normalised so a dot product is the cosine similarity.
+def build_matrix():
+    artists = db.session.query(Artist.id, Artist.genres) \
+        .order_by(Artist.id) \
+        .all()
+    ids = np.array([artist.id for artist in artists], dtype=np.int64)
+    position = {artist_id: i for i, artist_id in enumerate(ids.tolist())}
+
+    genre_columns = {}
+    genre_cells = []
+    for i, artist in enumerate(artists):
+        for genre in parse_genres(artist.genres):
+            genre_cells.append(
+                (i, genre_columns.setdefault(genre, len(genre_columns))))
+
+    venue_columns = {}
+    venue_cells = []
+    pairs = db.session.query(Show.artist_id, Show.venue_id).distinct().all()
+    for artist_id, venue_id in pairs:
+        if artist_id in position:
+            venue_cells.append(
+                (position[artist_id],
+                 venue_columns.setdefault(venue_id, len(venue_columns))))
+
+    matrix = np.zeros((len(ids), len(genre_columns) + len(venue_columns)),
+                      dtype=np.float32)
+    if genre_cells:
+        rows, cols = zip(*genre_cells)
+        matrix[list(rows), list(cols)] = 1
+    if venue_cells:
+        rows, cols = zip(*venue_cells)
+        matrix[list(rows), np.array(cols) + len(genre_columns)] = 1
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return ids, matrix / norms
+
+
+def _top_k(matrix, targets, k):
+    """(row, neighbours, scores) for each target row, best first.
+
+    Scores one block of rows against one block of columns at a time and
+    keeps a running top k per row, so memory stays O(BLOCK_SIZE²) rather
+    than growing with the number of artists.
+    """
+    n = len(matrix)
+    for start in range(0, len(targets), BLOCK_SIZE):
+        rows = targets[start:start + BLOCK_SIZE]
+        vectors = matrix[rows]
+        best_ids = np.empty((len(rows), 0), dtype=np.int64)
+        best_scores = np.empty((len(rows), 0), dtype=np.float32)
+        for column in range(0, n, BLOCK_SIZE):
+            scores = vectors @ matrix[column:column + BLOCK_SIZE].T
+            own = (rows >= column) & (rows < column + scores.shape[1])
+            scores[own, rows[own] - column] = -1  # Never recommend yourself
+            ids = np.broadcast_to(
+                np.arange(column, column + scores.shape[1]), scores.shape)
+            scores = np.hstack([best_scores, scores])
+            ids = np.hstack([best_ids, ids])
+            count = min(k, scores.shape[1])
+            if count <= 0:
+                break
+            keep = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_ids = np.take_along_axis(ids, keep, axis=1)
+        for i, row in enumerate(rows):
+            # Best first, equal scores in artist id order
+            order = np.lexsort((best_ids[i], -best_scores[i]))
+            order = order[best_scores[i, order] > 0]
+            yield row, best_ids[i, order], best_scores[i, order]
+
+
+def _affected_rows(ids, matrix, stale, k):
+    affected = set(stale.tolist())
+
+    # Lists that currently include a stale artist may have to drop it
+    referrers = db.session.query(ArtistSimilarity.artist_id) \
+        .filter(ArtistSimilarity.similar_artist_id.in_(ids[stale].tolist())) \
+        .distinct() \
+        .all()
+    position = {artist_id: i for i, artist_id in enumerate(ids.tolist())}
+    affected.update(position[artist_id] for artist_id, in referrers
+                    if artist_id in position)
+
+    # Lists whose weakest entry a stale artist now beats have to add it
+    threshold = np.zeros(len(ids), dtype=np.float32)
+    full_lists = db.session.query(ArtistSimilarity.artist_id,
+                                  db.func.min(ArtistSimilarity.score)) \
+        .group_by(ArtistSimilarity.artist_id) \
+        .having(db.func.count(ArtistSimilarity.rank) >= k) \
+        .all()
+    for artist_id, score in full_lists:
+        if artist_id in position:
+            threshold[position[artist_id]] = score
+    beaten = np.zeros(len(ids), dtype=bool)
+    for start in range(0, len(ids), BLOCK_SIZE):
+        block = matrix[start:start + BLOCK_SIZE]
+        for column in range(0, len(stale), BLOCK_SIZE):
+            columns = stale[column:column + BLOCK_SIZE]
+            scores = block @ matrix[columns].T
+            own = (columns >= start) & (columns < start + len(block))
+            scores[columns[own] - start, np.nonzero(own)[0]] = 0
+            beaten[start:start + len(block)] |= \
+                (scores > threshold[start:start + len(block), None]) \
+                .any(axis=1)
+    affected.update(np.nonzero(beaten)[0].tolist())
+
+    return np.array(sorted(affected), dtype=np.int64)
+
+
+def refresh_similarities(full=False, k=TOP_K):
+    """Recompute top-k neighbours; only stale artists unless full is set.
+
+    Returns the number of artists whose neighbour lists were rewritten.
+    """
+    ids, matrix = build_matrix()
+    stale_ids = [artist_id for artist_id, in
+                 db.session.query(StaleArtistSimilarity.artist_id).all()]
+
+    if full:
+        targets = np.arange(len(ids))
+    else:
+        position = {artist_id: i for i, artist_id in enumerate(ids.tolist())}
+        stale = np.array([position[artist_id] for artist_id in stale_ids
+                          if artist_id in position], dtype=np.int64)
+        targets = _affected_rows(ids, matrix, stale, k) if len(stale) \
+            else stale
+
+    rows = []
+    for row, neighbours, scores in _top_k(matrix, targets, k):
+        for rank, (neighbour, score) in enumerate(zip(neighbours, scores)):
+            rows.append({
+                "artist_id": int(ids[row]),
+                "rank": rank,
+                "similar_artist_id": int(ids[neighbour]),
+                "score": float(score)
+            })
+
+    existing = ArtistSimilarity.query
+    if not full:
+        existing = existing.filter(
+            ArtistSimilarity.artist_id.in_(ids[targets].tolist()))
+    existing.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(ArtistSimilarity, rows)
+    StaleArtistSimilarity.query \
+        .filter(StaleArtistSimilarity.artist_id.in_(stale_ids)) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return len(targets)
@@ -0,0 +1,172 @@
+from collections import defaultdict
+from datetime import date, datetime
+
+from models import (
+    db,
+    format_genres,
+    parse_genres,
+    Artist,
+    Venue,
+    Show,
+    VenueShowRollup,
+    ArtistShowRollup
+)
+
+
+def month_of(moment):
+    return date(moment.year, moment.month, 1)
+
+
+def next_month(month):
+    if month.month == 12:
+        return date(month.year + 1, 1, 1)
+    return date(month.year, month.month + 1, 1)
+
+
+# ----------------------------------------------------------------------------#
+# Incremental maintenance.
+#
+# A bucket is ('venue' or 'artist', id, month). Refreshing one re-counts
+# just that month for that entity, which the (id, start_time) indexes and
+# partition pruning keep cheap. The change feed dispatcher in jobs.py
+# queues the buckets each show change touches as a refresh-rollups job.
+# ----------------------------------------------------------------------------#
+
+def buckets_for_show(venue_id, artist_id, start_time):
+    month = month_of(start_time)
+    return {('venue', int(venue_id), month), ('artist', int(artist_id), month)}
+
+
+def buckets_for_genres(kind, entity_id):
+    """The other side's buckets, which list this entity's genres."""
+    if kind == 'venue':
+        own, other, other_kind = Show.venue_id, Show.artist_id, 'artist'
+    else:
+        own, other, other_kind = Show.artist_id, Show.venue_id, 'venue'
+    rows = db.session.query(other, Show.start_time).filter(own == entity_id)
+    return {(other_kind, other_id, month_of(start_time))
+            for other_id, start_time in rows}
+
+
+def refresh_bucket(kind, entity_id, month):
+    if kind == 'venue':
+        model, own, other, other_model, count_column = \
+            VenueShowRollup, Show.venue_id, Show.artist_id, Artist, \
+            'artist_count'
+        key = {"venue_id": entity_id, "month": month}
+    else:
+        model, own, other, other_model, count_column = \
+            ArtistShowRollup, Show.artist_id, Show.venue_id, Venue, \
+            'venue_count'
+        key = {"artist_id": entity_id, "month": month}
+
+    start = datetime(month.year, month.month, 1)
+    end = datetime.combine(next_month(month), datetime.min.time())
+    rows = db.session.query(other, other_model.genres) \
+        .join(other_model, other == other_model.id) \
+        .filter(own == entity_id) \
+        .filter(Show.start_time >= start, Show.start_time < end) \
+        .all()
+
+    rollup = model.query.get(key)
+    if not rows:
+        if rollup is not None:
+            db.session.delete(rollup)
+        return
+    if rollup is None:
+        rollup = model(**key)
+        db.session.add(rollup)
+    genres = set()
+    for _, other_genres in rows:
+        genres.update(parse_genres(other_genres))
+    rollup.show_count = len(rows)
+    setattr(rollup, count_column, len({other_id for other_id, _ in rows}))
+    rollup.genres = format_genres(sorted(genres))
+
+
+def refresh_buckets(buckets):
+    for bucket in buckets:
+        refresh_bucket(*bucket)
+
+
+def rebuild_all():
+    """Recompute every rollup from scratch. Returns the bucket count."""
+    venue_genres = dict(db.session.query(Venue.id, Venue.genres).all())
+    artist_genres = dict(db.session.query(Artist.id, Artist.genres).all())
+    venues = defaultdict(lambda: [0, set(), set()])
+    artists = defaultdict(lambda: [0, set(), set()])
+    shows = db.session.query(Show.venue_id, Show.artist_id, Show.start_time)
+    for venue_id, artist_id, start_time in shows.yield_per(1000):
+        month = month_of(start_time)
+        bucket = venues[(venue_id, month)]
+        bucket[0] += 1
+        bucket[1].add(artist_id)
+        bucket[2].update(parse_genres(artist_genres.get(artist_id)))
+        bucket = artists[(artist_id, month)]
+        bucket[0] += 1
+        bucket[1].add(venue_id)
+        bucket[2].update(parse_genres(venue_genres.get(venue_id)))
+
+    VenueShowRollup.query.delete(synchronize_session=False)
+    ArtistShowRollup.query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(VenueShowRollup, [{
+        "venue_id": venue_id,
+        "month": month,
+        "show_count": count,
+        "artist_count": len(others),
+        "genres": format_genres(sorted(genres))
+    } for (venue_id, month), (count, others, genres) in venues.items()])
+    db.session.bulk_insert_mappings(ArtistShowRollup, [{
+        "artist_id": artist_id,
+        "month": month,
+        "show_count": count,
+        "venue_count": len(others),
+        "genres": format_genres(sorted(genres))
+    } for (artist_id, month), (count, others, genres) in artists.items()])
+    db.session.commit()
+    return len(venues) + len(artists)
+
+
+# ----------------------------------------------------------------------------#
+# Page summary.
+# ----------------------------------------------------------------------------#
+
+def past_summary(kind, entity_id, months=12):
+    """Recent monthly rollups plus the exact number of past shows.
+
+    Whole past months come from the rollup; only the current month is
+    counted from shows, so the cost does not grow with history.
+    """
+    if kind == 'venue':
+        model, own_rollup, own = VenueShowRollup, \
+            VenueShowRollup.venue_id, Show.venue_id
+    else:
+        model, own_rollup, own = ArtistShowRollup, \
+            ArtistShowRollup.artist_id, Show.artist_id
+    now = datetime.now()
+    this_month = month_of(now)
+
+    recent = model.query \
+        .filter(own_rollup == entity_id, model.month < this_month) \
+        .order_by(model.month.desc()) \
+        .limit(months) \
+        .all()
+    older = db.session.query(db.func.coalesce(db.func.sum(model.show_count),
+                                              0)) \
+        .filter(own_rollup == entity_id, model.month < this_month) \
+        .scalar()
+    current = db.session.query(db.func.count(Show.id)) \
+        .filter(own == entity_id) \
+        .filter(Show.start_time >= datetime(now.year, now.month, 1),
+                Show.start_time < now) \
+        .scalar()
+    return {
+        "months": [{
+            "month": rollup.month,
+            "show_count": rollup.show_count,
+            "other_count": rollup.artist_count if kind == 'venue'
+            else rollup.venue_count,
+            "genres": parse_genres(rollup.genres)
+        } for rollup in recent],
+        "past_shows_count": int(older) + current
+    }
@@ -0,0 +1,523 @@
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+from threading import RLock
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+from database import fingerprint
+from models import db, parse_genres, Artist, Venue, Show
+
+# ----------------------------------------------------------------------------#
+# File format.
+#
+# header   magic, version, doc count, term count, section offsets and the
+#          fingerprint of the database the index was built from
+# docs     (kind, json offset, json length) per document
+# terms    (term offset, term length, postings start, postings count),
+#          sorted by term bytes so prefixes are a contiguous range
+# postings (doc number, field weight)
+# strings  UTF-8 term text and document JSON
+#
+# Workers mmap the file read-only and search it in place. Writers build a
+# new file and os.replace() it; readers notice the new inode and remap. A
+# file that is unreadable or was built from another database is rebuilt
+# before it is mapped.
+#
+# Edits go to a second, small file in the same format, the delta at
+# SEARCH_INDEX_PATH + '.delta'. It holds the new documents and a 'drop'
+# marker for every key (or every show of an artist or venue) they replace
+# or remove; searches read both files and skip main documents a marker
+# covers. An edit rewrites only the delta. Once the delta reaches
+# SEARCH_DELTA_MAX_DOCS documents it is merged: the main file is rewritten
+# without the dropped documents and with the delta's, and the delta goes.
+# ----------------------------------------------------------------------------#
+
+MAGIC = b'FYSI'
+VERSION = 2
+HEADER = struct.Struct('<4sIIIIIII20s')
+DOC = struct.Struct('<BII')
+TERM = struct.Struct('<IHII')
+POSTING = struct.Struct('<IB')
+
+KINDS = ('artist', 'venue', 'show')
+DROP = 'drop'
+KIND_CODES = KINDS + (DROP,)
+EXACT, PREFIX, FUZZY = 1.0, 0.7, 0.5
+
+_token_re = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return _token_re.findall(text.lower()) if text else []
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance, or limit + 1 as soon as it must exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.buffer) < HEADER.size:
+            self.close()
+            raise ValueError(f'{path} is truncated')
+        magic, version, self.n_docs, self.n_terms, self.docs_at, \
+            self.terms_at, self.postings_at, self.strings_at, \
+            self.source = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{path} is not a version {VERSION} index')
+
+    def close(self):
+        self.buffer.close()
+
+    def doc(self, n):
+        kind, offset, length = DOC.unpack_from(
+            self.buffer, self.docs_at + n * DOC.size)
+        start = self.strings_at + offset
+        return json.loads(self.buffer[start:start + length])
+
+    def docs(self):
+        return [self.doc(n) for n in range(self.n_docs)]
+
+    def term(self, n):
+        offset, length, _, _ = TERM.unpack_from(
+            self.buffer, self.terms_at + n * TERM.size)
+        start = self.strings_at + offset
+        return self.buffer[start:start + length]
+
+    def postings(self, n):
+        _, _, start, count = TERM.unpack_from(
+            self.buffer, self.terms_at + n * TERM.size)
+        base = self.postings_at + start * POSTING.size
+        for i in range(count):
+            yield POSTING.unpack_from(self.buffer, base + i * POSTING.size)
+
+    def lower_bound(self, key):
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix_range(self, prefix):
+        start = self.lower_bound(prefix)
+        end = start
+        while end < self.n_terms and self.term(end).startswith(prefix):
+            end += 1
+        return start, end
+
+
+def write_index(path, docs, source):
+    terms = defaultdict(dict)
+    for n, doc in enumerate(docs):
+        for text, weight in doc['fields']:
+            for token in tokenize(text):
+                postings = terms[token.encode('utf-8')]
+                postings[n] = max(postings.get(n, 0), weight)
+
+    strings = bytearray()
+    doc_table = bytearray()
+    for doc in docs:
+        payload = json.dumps(doc, separators=(',', ':')).encode('utf-8')
+        doc_table += DOC.pack(KIND_CODES.index(doc['kind']), len(strings),
+                              len(payload))
+        strings += payload
+
+    term_table = bytearray()
+    posting_table = bytearray()
+    posting_count = 0
+    for term in sorted(terms):
+        postings = terms[term]
+        term_table += TERM.pack(len(strings), len(term), posting_count,
+                                len(postings))
+        strings += term
+        for n, weight in sorted(postings.items()):
+            posting_table += POSTING.pack(n, weight)
+        posting_count += len(postings)
+
+    docs_at = HEADER.size
+    terms_at = docs_at + len(doc_table)
+    postings_at = terms_at + len(term_table)
+    strings_at = postings_at + len(posting_table)
+    header = HEADER.pack(MAGIC, VERSION, len(docs), len(terms), docs_at,
+                         terms_at, postings_at, strings_at, source)
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        for section in (header, doc_table, term_table, posting_table,
+                        strings):
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+# ----------------------------------------------------------------------------#
+# Documents.
+# ----------------------------------------------------------------------------#
+
+def artist_doc(artist):
+    return {
+        "key": f'artist:{artist.id}',
+        "kind": 'artist',
+        "id": artist.id,
+        "title": artist.name,
+        "subtitle": f'{artist.city}, {artist.state}',
+        "url": f'/artists/{artist.id}',
+        "fields": [[artist.name, 3], [artist.city, 2], [artist.state, 1],
+                   [' '.join(parse_genres(artist.genres)), 1]]
+    }
+
+
+def venue_doc(venue):
+    return {
+        "key": f'venue:{venue.id}',
+        "kind": 'venue',
+        "id": venue.id,
+        "title": venue.name,
+        "subtitle": f'{venue.city}, {venue.state}',
+        "url": f'/venues/{venue.id}',
+        "fields": [[venue.name, 3], [venue.city, 2], [venue.state, 1],
+                   [' '.join(parse_genres(venue.genres)), 1]]
+    }
+
+
+def show_key(show_id, venue_id, artist_id, start_time):
+    return f'show:{show_id}:{venue_id}:{artist_id}:{start_time}'
+
+
+def show_doc(show_id, artist_id, artist_name, venue_id, venue_name,
+             venue_city, start_time):
+    return {
+        "key": show_key(show_id, venue_id, artist_id, start_time),
+        "kind": 'show',
+        "id": show_id,
+        "artist_id": artist_id,
+        "venue_id": venue_id,
+        "title": f'{artist_name} at {venue_name}',
+        "subtitle": str(start_time),
+        "url": f'/venues/{venue_id}',
+        "fields": [[artist_name, 2], [venue_name, 2], [venue_city, 1]]
+    }
+
+
+def _show_docs(*criteria):
+    rows = db.session.query(Show.id, Show.artist_id, Artist.name,
+                            Show.venue_id, Venue.name, Venue.city,
+                            Show.start_time) \
+        .join(Artist, Show.artist_id == Artist.id) \
+        .join(Venue, Show.venue_id == Venue.id) \
+        .filter(*criteria) \
+        .all()
+    return [show_doc(*row) for row in rows]
+
+
+def load_docs():
+    docs = [artist_doc(artist) for artist in Artist.query
+            .with_entities(Artist.id, Artist.name, Artist.city,
+                           Artist.state, Artist.genres)]
+    docs += [venue_doc(venue) for venue in Venue.query
+             .with_entities(Venue.id, Venue.name, Venue.city,
+                            Venue.state, Venue.genres)]
+    return docs + _show_docs()
+
+
+def drop_doc(key=None, shows_of=None):
+    """A delta marker for one key, or for every show of a (kind, id)."""
+    if key is not None:
+        return {"key": f'drop:{key}', "kind": DROP, "drops": key,
+                "fields": []}
+    kind, entity_id = shows_of
+    return {"key": f'drop:shows:{kind}:{entity_id}', "kind": DROP,
+            "shows_of": [kind, entity_id], "fields": []}
+
+
+def tombstones(docs):
+    """(keys, shows_of) named by the markers among docs."""
+    keys, shows_of = set(), set()
+    for doc in docs:
+        if doc['kind'] != DROP:
+            continue
+        if 'drops' in doc:
+            keys.add(doc['drops'])
+        else:
+            shows_of.add(tuple(doc['shows_of']))
+    return keys, shows_of
+
+
+def is_dropped(doc, keys, shows_of):
+    return doc['key'] in keys or (
+        doc['kind'] == 'show'
+        and (('artist', doc['artist_id']) in shows_of
+             or ('venue', doc['venue_id']) in shows_of))
+
+
+def _identity(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# ----------------------------------------------------------------------------#
+# Index.
+# ----------------------------------------------------------------------------#
+
+class SearchIndex:
+    def __init__(self):
+        self.path = None
+        self.delta_path = None
+        self.delta_max = 1000
+        self._snapshot = None
+        self._delta = None
+        self._delta_identity = None
+        self._tombstones = (set(), set())
+        self._lock = RLock()
+
+    def init_app(self, app):
+        self.path = app.config['SEARCH_INDEX_PATH']
+        self.delta_path = self.path + '.delta'
+        self.delta_max = app.config['SEARCH_DELTA_MAX_DOCS']
+
+    @contextmanager
+    def _writer(self):
+        with self._lock, open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _usable(self, path=None):
+        """The file's snapshot if it was built from this database."""
+        try:
+            snapshot = Snapshot(path or self.path)
+        except (FileNotFoundError, ValueError):
+            return None
+        if snapshot.source != fingerprint():
+            snapshot.close()
+            return None
+        return snapshot
+
+    def current(self):
+        identity = _identity(self.path)
+        if self._snapshot is None or self._snapshot.identity != identity:
+            snapshot = self._usable()
+            if snapshot is None:
+                self.rebuild(only_if_unusable=True)
+                snapshot = Snapshot(self.path)
+            old, self._snapshot = self._snapshot, snapshot
+            if old is not None:
+                old.close()
+        self._refresh_delta()
+        return self._snapshot
+
+    def _refresh_delta(self):
+        identity = _identity(self.delta_path)
+        if identity == self._delta_identity:
+            return
+        delta = self._usable(self.delta_path)
+        old, self._delta = self._delta, delta
+        if delta is not None:
+            self._delta_identity = delta.identity
+            self._tombstones = tombstones(delta.docs())
+        else:
+            self._delta_identity = identity
+            self._tombstones = (set(), set())
+        if old is not None:
+            old.close()
+
+    def rebuild(self, only_if_unusable=False):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._writer():
+            if only_if_unusable:
+                # Another worker may have rebuilt it while this one waited
+                snapshot = self._usable()
+                if snapshot is not None:
+                    snapshot.close()
+                    return
+            # The new file has every edit; a delta left over would drop
+            # documents from it
+            _remove(self.delta_path)
+            write_index(self.path, load_docs(), fingerprint())
+
+    def apply(self, upserts=(), keys=(), shows_of=()):
+        """Add upserts, replacing docs by key, and drop the docs with the
+        given keys and the shows of each (kind, id) in shows_of."""
+        upserts = list(upserts)
+        keys = set(keys) | {doc['key'] for doc in upserts}
+        shows_of = {tuple(owner) for owner in shows_of}
+        with self._writer():
+            main = self._usable()
+            if main is None:
+                _remove(self.delta_path)
+                write_index(self.path, load_docs(), fingerprint())
+                return
+            try:
+                delta = self._usable(self.delta_path)
+                old = []
+                if delta is not None:
+                    old = delta.docs()
+                    delta.close()
+                markers = {doc['key']: doc for doc in old
+                           if doc['kind'] == DROP}
+                for marker in [drop_doc(key=key) for key in keys] + \
+                        [drop_doc(shows_of=owner) for owner in shows_of]:
+                    markers[marker['key']] = marker
+                live = [doc for doc in old if doc['kind'] != DROP
+                        and not is_dropped(doc, keys, shows_of)] + upserts
+                if len(markers) + len(live) < self.delta_max:
+                    write_index(self.delta_path,
+                                list(markers.values()) + live, fingerprint())
+                    return
+                dropped = tombstones(markers.values())
+                docs = [doc for doc in main.docs()
+                        if not is_dropped(doc, *dropped)]
+            finally:
+                main.close()
+            write_index(self.path, docs + live, fingerprint())
+            # A reader that maps the new file before the delta goes still
+            # sees each document once: the markers hide the main copies
+            _remove(self.delta_path)
+
+    def _matches(self, snapshot, token):
+        hits = {}
+        key = token.encode('utf-8')
+        start, end = snapshot.prefix_range(key)
+        for n in range(start, end):
+            quality = EXACT if snapshot.term(n) == key else PREFIX
+            for doc, weight in snapshot.postings(n):
+                hits[doc] = max(hits.get(doc, 0), weight * quality)
+
+        if len(token) >= 4:
+            limit = 1 if len(token) < 8 else 2
+            first_start, first_end = snapshot.prefix_range(key[:1])
+            for n in range(first_start, first_end):
+                if start <= n < end:
+                    continue
+                term = snapshot.term(n).decode('utf-8')
+                # Compare against the term's head too, so typos in a prefix
+                # still find longer words
+                head = term[:len(token)]
+                if edit_distance(token, head, limit) <= limit:
+                    for doc, weight in snapshot.postings(n):
+                        hits[doc] = max(hits.get(doc, 0), weight * FUZZY)
+        return hits
+
+    def _scores(self, snapshot, tokens):
+        scores = None
+        for token in tokens:
+            hits = self._matches(snapshot, token)
+            if scores is None:
+                scores = hits
+            else:
+                scores = {doc: score + hits[doc]
+                          for doc, score in scores.items() if doc in hits}
+            if not scores:
+                return {}
+        return scores
+
+    def search(self, query, kinds=KINDS, limit=20):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        with self._lock:
+            main = self.current()
+            dropped = self._tombstones
+            results = []
+            for segment, snapshot in enumerate((main, self._delta)):
+                if snapshot is None:
+                    continue
+                found = 0
+                for n, score in sorted(self._scores(snapshot, tokens).items(),
+                                       key=lambda item: (-item[1], item[0])):
+                    doc = snapshot.doc(n)
+                    if doc['kind'] not in kinds or (
+                            snapshot is main and is_dropped(doc, *dropped)):
+                        continue
+                    doc['score'] = score
+                    results.append((-score, segment, n, doc))
+                    found += 1
+                    if found >= limit:
+                        break
+            results.sort(key=lambda result: result[:3])
+            return [doc for _, _, _, doc in results[:limit]]
+
+
+search_index = SearchIndex()
+
+
+# ----------------------------------------------------------------------------#
+# Write hooks, run by the index jobs after the route commits.
+# ----------------------------------------------------------------------------#
+
+def index_artist(artist):
+    search_index.apply(
+        [artist_doc(artist)] + _show_docs(Show.artist_id == artist.id),
+        shows_of=[('artist', artist.id)])
+
+
+def index_venue(venue):
+    search_index.apply(
+        [venue_doc(venue)] + _show_docs(Show.venue_id == venue.id),
+        shows_of=[('venue', venue.id)])
+
+
+def index_show(show):
+    search_index.apply(_show_docs(Show.artist_id == show.artist_id,
+                                  Show.venue_id == show.venue_id,
+                                  Show.start_time == show.start_time))
+
+
+def unindex_artist(artist_id):
+    search_index.apply(keys=[f'artist:{artist_id}'],
+                       shows_of=[('artist', artist_id)])
+
+
+def unindex_venue(venue_id):
+    search_index.apply(keys=[f'venue:{venue_id}'],
+                       shows_of=[('venue', venue_id)])
+
+
+def unindex_show(show_id, venue_id, artist_id, start_time):
+    search_index.apply(
+        keys=[show_key(show_id, venue_id, artist_id, start_time)])
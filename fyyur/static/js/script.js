@@ -2,3 +2,166 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Typeahead for inputs with a data-autocomplete endpoint. Suggestions are
+// "<id> - <name>" so the submitted value starts with the ID the form expects.
+(function () {
+  var inputs = document.querySelectorAll('input[data-autocomplete]');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var options = document.getElementById(input.getAttribute('list'));
+    var timer = null;
+    var form = input.form;
+
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      var q = input.value;
+      if (!q || /^\d+\s-\s/.test(q)) return;
+      timer = setTimeout(function () {
+        fetch(input.dataset.autocomplete + '?q=' + encodeURIComponent(q))
+          .then(function (response) { return response.json(); })
+          .then(function (matches) {
+            options.innerHTML = '';
+            matches.forEach(function (match) {
+              var option = document.createElement('option');
+              option.value = match.id + ' - ' + match.name;
+              options.appendChild(option);
+            });
+          });
+      }, 150);
+    });
+
+    if (form) {
+      form.addEventListener('submit', function () {
+        var id = /^(\d+)\s-\s/.exec(input.value);
+        if (id) input.value = id[1];
+      });
+    }
+  });
+})();
+
+// /venues/near without coordinates: ask the browser where we are.
+(function () {
+  var locate = document.getElementById('locate-me');
+  if (!locate || !navigator.geolocation) return;
+  navigator.geolocation.getCurrentPosition(function (position) {
+    window.location.search = '?lat=' + position.coords.latitude +
+      '&lng=' + position.coords.longitude +
+      '&radius=' + locate.dataset.radius;
+  }, function () {
+    locate.textContent = 'Location is unavailable.';
+  });
+})();
+
+// Pages marked data-live follow /live: upcoming counts and names are patched
+// in place, and anything that would add or drop a row asks for a reload.
+(function () {
+  var notice = document.querySelector('[data-live]');
+  if (!notice || !window.EventSource) return;
+  var source = new EventSource('/live');
+
+  function each(selector, fn) {
+    Array.prototype.forEach.call(document.querySelectorAll(selector), fn);
+  }
+
+  function data(event) {
+    return JSON.parse(event.data);
+  }
+
+  function stale() {
+    notice.classList.remove('hidden');
+  }
+
+  function count(show, step) {
+    if (!show.upcoming) return;
+    each('[data-upcoming-venue="' + show.venue_id + '"]', function (el) {
+      el.textContent = Math.max(0, parseInt(el.textContent, 10) + step);
+    });
+    if (!document.querySelector('[data-upcoming-venue]')) stale();
+  }
+
+  source.addEventListener('show-added', function (e) { count(data(e), 1); });
+  source.addEventListener('show-removed', function (e) { count(data(e), -1); });
+  source.addEventListener('show-changed', stale);
+  source.addEventListener('venue-added', stale);
+  source.addEventListener('artist-added', stale);
+  source.addEventListener('reset', function () {
+    source.close();
+    stale();
+  });
+
+  ['venue', 'artist'].forEach(function (kind) {
+    source.addEventListener(kind + '-changed', function (e) {
+      var entity = data(e);
+      each('[data-' + kind + '-name="' + entity.id + '"]', function (el) {
+        el.textContent = entity.name;
+      });
+    });
+    source.addEventListener(kind + '-removed', function (e) {
+      var entity = data(e);
+      each('[data-' + kind + '="' + entity.id + '"]', function (el) {
+        el.parentNode.removeChild(el);
+      });
+      if (document.querySelector('[data-' + kind + '-name="' + entity.id + '"]')) {
+        stale();
+      }
+    });
+  });
+})();
+
+// Forms marked data-fragment submit in the background and swap the fragment
+// the server renders into their target: search results as you type, flash
+// messages after a create or delete. Where the target is not on the page,
+// or the server answers with an error, the form submits as usual.
+(function () {
+  var forms = document.querySelectorAll('form[data-fragment]');
+  Array.prototype.forEach.call(forms, function (form) {
+    var timer = null;
+
+    function target() {
+      return document.querySelector(form.dataset.fragment);
+    }
+
+    function swap(fallback) {
+      var method = form.method.toUpperCase();
+      var data = new FormData(form);
+      var url = form.action;
+      var options = {method: method, headers: {'X-Fragment': '1'},
+                     credentials: 'same-origin'};
+      if (method === 'GET') {
+        url += (url.indexOf('?') < 0 ? '?' : '&') + new URLSearchParams(data);
+      } else {
+        options.body = data;
+      }
+      return fetch(url, options).then(function (response) {
+        if (!response.ok) {
+          if (fallback) form.submit();
+          return;
+        }
+        return response.text().then(function (html) {
+          var into = target();
+          into.innerHTML = html;
+          if (method === 'GET') window.history.replaceState(null, '', url);
+          if (form.hasAttribute('data-fragment-reset') &&
+              !into.querySelector('.error')) {
+            form.reset();
+          }
+        });
+      });
+    }
+
+    form.addEventListener('submit', function (event) {
+      if (!target() || !window.fetch) return;
+      event.preventDefault();
+      clearTimeout(timer);
+      swap(true);
+    });
+
+    if (form.classList.contains('search')) {
+      form.addEventListener('input', function () {
+        if (!target() || !window.fetch) return;
+        clearTimeout(timer);
+        timer = setTimeout(function () { swap(false); }, 300);
+      });
+    }
+  });
+})();
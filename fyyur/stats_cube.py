@@ -0,0 +1,114 @@
+from datetime import date, datetime
+
+import numpy as np
+
+from models import db, parse_genres, Artist, Venue, Show, ShowStatsCube
+
+# ----------------------------------------------------------------------------#
+# Refresh (background job).
+#
+# A show counts once under each of its artist's genres, so summing genre
+# cells counts it several times. Every place and month also gets a cell
+# under ALL_GENRES that counts each show once; totals that are not split
+# by genre read only those.
+# ----------------------------------------------------------------------------#
+
+ALL_GENRES = ''  # Part of the key, so it cannot be NULL
+
+
+def _encode(values, codes):
+    return [codes.setdefault(value, len(codes)) for value in values]
+
+
+def refresh_cube():
+    """Rebuild the cube from shows. Returns the number of cells written."""
+    rows = db.session.query(Venue.state, Venue.city, Artist.genres,
+                            Show.start_time) \
+        .join(Venue, Show.venue_id == Venue.id) \
+        .join(Artist, Show.artist_id == Artist.id) \
+        .yield_per(5000)
+
+    places, genres, months = {}, {}, {}
+    place_codes, genre_codes, month_codes = [], [], []
+    for state, city, artist_genres, start_time in rows:
+        month = date(start_time.year, start_time.month, 1)
+        show_genres = (parse_genres(artist_genres) or ['Other']) + \
+            [ALL_GENRES]
+        place_codes += _encode([(state, city)] * len(show_genres), places)
+        genre_codes += _encode(show_genres, genres)
+        month_codes += _encode([month] * len(show_genres), months)
+
+    now = datetime.now()
+    cells = []
+    if place_codes:
+        shape = (len(places), len(genres), len(months))
+        keys = np.ravel_multi_index(
+            (np.array(place_codes), np.array(genre_codes),
+             np.array(month_codes)), shape)
+        unique_keys, counts = np.unique(keys, return_counts=True)
+        place_of, genre_of, month_of = np.unravel_index(unique_keys, shape)
+        place_list, genre_list, month_list = \
+            list(places), list(genres), list(months)
+        for p, g, m, count in zip(place_of.tolist(), genre_of.tolist(),
+                                  month_of.tolist(), counts.tolist()):
+            state, city = place_list[p]
+            cells.append({
+                "state": state,
+                "city": city,
+                "genre": genre_list[g],
+                "month": month_list[m],
+                "show_count": count,
+                "refreshed_at": now
+            })
+
+    ShowStatsCube.query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(ShowStatsCube, cells)
+    db.session.commit()
+    return len(cells)
+
+
+# ----------------------------------------------------------------------------#
+# Drill-down. Reads only the cube.
+# ----------------------------------------------------------------------------#
+
+def drill_down(state=None, city=None, genre=None):
+    filters = []
+    if state:
+        filters.append(ShowStatsCube.state == state)
+    if city:
+        filters.append(ShowStatsCube.city == city)
+    # Places and months count each show once; the genre breakdown skips
+    # the all-genres cells
+    totals = filters + [ShowStatsCube.genre == (genre or ALL_GENRES)]
+    by_genre = filters + [ShowStatsCube.genre == genre if genre
+                          else ShowStatsCube.genre != ALL_GENRES]
+
+    total = db.func.sum(ShowStatsCube.show_count)
+
+    def breakdown(column, criteria):
+        return db.session.query(column, total) \
+            .filter(*criteria) \
+            .group_by(column) \
+            .order_by(total.desc(), column) \
+            .all()
+
+    if not state:
+        level = ShowStatsCube.state
+    elif not city:
+        level = ShowStatsCube.city
+    else:
+        level = None
+
+    refreshed_at = db.session.query(
+        db.func.max(ShowStatsCube.refreshed_at)).scalar()
+    return {
+        "level": level.key if level is not None else None,
+        "places": breakdown(level, totals) if level is not None else [],
+        "genres": breakdown(ShowStatsCube.genre, by_genre),
+        "months": db.session.query(ShowStatsCube.month, total)
+        .filter(*totals)
+        .group_by(ShowStatsCube.month)
+        .order_by(ShowStatsCube.month)
+        .all(),
+        "refreshed_at": refreshed_at
+    }
@@ -0,0 +1,108 @@
+import os
+import time
+
+from flask import (
+    Response,
+    current_app,
+    g,
+    has_request_context,
+    make_response,
+    render_template,
+    request,
+    stream_with_context
+)
+from flask_wtf.csrf import generate_csrf
+from jinja2 import FileSystemBytecodeCache
+
+# ----------------------------------------------------------------------------#
+# Production template mode.
+#
+# Reload checks stat every template on each render; in production they are
+# off, compiled templates are kept on disk so new workers skip the Jinja
+# compiler, and every template is compiled at startup rather than on the
+# first request that needs it.
+# ----------------------------------------------------------------------------#
+
+def setup_templates(app):
+    """Call after filters, globals and template_class are in place."""
+    if not app.config['TEMPLATE_PRODUCTION']:
+        return
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    env = app.jinja_env
+    env.auto_reload = False
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    os.makedirs(directory, exist_ok=True)
+    env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    started = time.perf_counter()
+    names = env.list_templates(extensions=['html'])
+    for name in names:
+        env.get_template(name)
+    app.logger.info('Compiled %d templates in %.1f ms', len(names),
+                    (time.perf_counter() - started) * 1000)
+
+
+# ----------------------------------------------------------------------------#
+# Streaming.
+#
+# Flask 1.1 has no stream_template, so this is the same idea: the template
+# is rendered as a generator over its context, which can itself hold row
+# generators, and the first chunk goes out before the rows are all read.
+# ----------------------------------------------------------------------------#
+
+def _timed(chunks, path):
+    started = g.get('request_started') or time.perf_counter()
+    first_byte = None
+    for chunk in chunks:
+        if first_byte is None:
+            first_byte = time.perf_counter()
+        yield chunk
+    ended = time.perf_counter()
+    current_app.logger.info(
+        'Streamed %s', path,
+        extra={"ttfb_ms": round(((first_byte or ended) - started) * 1000, 2),
+               "latency_ms": round((ended - started) * 1000, 2)})
+
+
+def stream_template(template_name, **context):
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    if 'csrf' in app.extensions:
+        # The session cookie goes out with the headers, before the layout
+        # asks for the search forms' token
+        generate_csrf()
+    template = app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(app.config['TEMPLATE_STREAM_BUFFER'])
+    path = request.path if has_request_context() else template_name
+    # Keeps the request context, and so the DB session, alive while the
+    # row generators are read
+    return Response(stream_with_context(_timed(stream, path)),
+                    mimetype='text/html')
+
+
+# ----------------------------------------------------------------------------#
+# Fragments.
+#
+# Search boxes and forms marked data-fragment in the templates submit from
+# script.js with an X-Fragment header, and get back only the part of the
+# page that changes: a result list, the flash messages or a single tile,
+# without the layout around it. Each fragment is also what its page
+# includes, so the two render the same markup.
+# ----------------------------------------------------------------------------#
+
+FRAGMENT_HEADER = 'X-Fragment'
+
+
+def wants_fragment():
+    return request.headers.get(FRAGMENT_HEADER) == '1'
+
+
+def render_page(page, fragment, **context):
+    """The page, or only its fragment when the request asks for one."""
+    response = make_response(render_template(
+        fragment if wants_fragment() else page, **context))
+    # Caches must not answer a page request with a fragment or back
+    response.vary.add(FRAGMENT_HEADER)
+    return response
+
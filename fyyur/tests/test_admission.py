@@ -0,0 +1,58 @@
+import pytest
+
+import admission
+from admission import RateLimiter
+from app import app
+from models import db
+
+
+@pytest.fixture
+def limiter(tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_PATH',
+                        str(tmp_path / 'ratelimit.sqlite'))
+    monkeypatch.setitem(app.config, 'SEARCH_RATE', 0.5)
+    monkeypatch.setitem(app.config, 'SEARCH_BURST', 2)
+    limiter = RateLimiter()
+    limiter.init_app(app)
+    monkeypatch.setattr(admission, 'rate_limiter', limiter)
+    return limiter
+
+
+def test_bucket_refills_at_the_rate(limiter, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(admission.time, 'time', lambda: clock[0])
+
+    assert [limiter.take('a'), limiter.take('a')] == [0, 0]
+    assert limiter.take('a') == 2  # One token at 0.5 a second
+    assert limiter.take('b') == 0  # Buckets are per client
+    clock[0] += 2
+    assert limiter.take('a') == 0
+
+
+def test_search_over_the_limit_gets_429(limiter):
+    client = app.test_client()
+    assert client.get('/venues/search').status_code == 200
+    assert client.get('/venues/search').status_code == 200
+
+    response = client.get('/venues/search')
+
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+    assert client.get('/venues/search', environ_base={
+        'REMOTE_ADDR': '192.0.2.7'}).status_code == 200
+
+
+def test_search_is_shed_while_connections_are_busy(monkeypatch):
+    monkeypatch.setitem(app.config, 'SEARCH_SHED_DB_IN_FLIGHT', 1)
+    client = app.test_client()
+
+    with app.app_context(), db.engine.connect():
+        assert admission.in_flight_db() >= 1
+        response = client.post('/artists/search',
+                               data={'search_term': 'petals'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == \
+        str(app.config['SEARCH_RETRY_AFTER'])
+    assert client.post('/artists/search', data={
+        'search_term': 'petals'}).status_code == 200
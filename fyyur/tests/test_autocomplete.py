@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from app import app
+from autocomplete import PrefixIndex
+from models import db, Artist
+
+
+@pytest.fixture
+def index():
+    with app.app_context():
+        index = PrefixIndex(Artist)
+        index.init_app(app)
+        yield index
+        db.session.rollback()
+        Artist.query.delete()
+        db.session.commit()
+
+
+def add_artists(*names):
+    for name in names:
+        db.session.add(Artist(name=name, city='San Francisco', state='CA',
+                              genres='{Rock}'))
+    db.session.commit()
+
+
+def names(results):
+    return [result['name'] for result in results]
+
+
+def test_exact_and_leading_matches_rank_first(index):
+    add_artists('The Park Rangers', 'Parker', 'Park', 'Jazz in the Park',
+                'Parkway Drive')
+
+    assert names(index.search('park')) == [
+        'Park', 'Parker', 'Parkway Drive', 'The Park Rangers',
+        'Jazz in the Park']
+    assert names(index.search('park', limit=2)) == ['Park', 'Parker']
+
+
+def test_stale_index_is_served_while_it_rebuilds(index):
+    add_artists('Guns N Petals')
+    assert names(index.search('guns')) == ['Guns N Petals']
+    add_artists('Gunslinger')  # Written by another worker: no invalidate()
+    index.max_age = 0
+
+    # The stale answer comes back at once; the rebuild runs behind it
+    assert names(index.search('guns')) == ['Guns N Petals']
+    deadline = time.monotonic() + 5
+    while index._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    index.max_age = 60
+    assert names(index.search('guns')) == ['Guns N Petals', 'Gunslinger']
+
+
+def test_invalidate_rebuilds_on_the_next_search(index):
+    add_artists('Guns N Petals')
+    index.search('guns')
+    add_artists('Gunslinger')
+    index.invalidate()
+
+    assert names(index.search('guns')) == ['Guns N Petals', 'Gunslinger']
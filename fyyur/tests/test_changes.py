@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import changes
+from app import app
+from models import db, Artist, ChangeEvent, ChangeFeedOffset
+
+
+@pytest.fixture
+def feed():
+    with app.app_context():
+        ChangeEvent.query.delete()
+        ChangeFeedOffset.query.delete()
+        db.session.commit()
+        changes._gaps.clear()
+        yield
+        db.session.rollback()
+        Artist.query.delete()
+        ChangeEvent.query.delete()
+        ChangeFeedOffset.query.delete()
+        db.session.commit()
+
+
+def commit_event(event_id, age=0):
+    # created_at is stamped at flush, so a late commit carries an old one
+    db.session.add(ChangeEvent(
+        id=event_id, entity='venue', entity_id=event_id, op='update',
+        payload=f'{{"id": {event_id}, "changed": ["name"]}}',
+        created_at=datetime.utcnow() - timedelta(seconds=age)))
+    db.session.commit()
+
+
+def ids(batch):
+    return [change.id for change in batch]
+
+
+def test_late_commit_below_a_read_id_is_still_delivered(feed):
+    commit_event(1)
+    commit_event(3)
+    assert ids(changes.read(0)) == [1]
+    assert ids(changes.read(1)) == []  # Still waiting on id 2
+
+    commit_event(2, age=600)
+    assert ids(changes.read(1)) == [2, 3]
+
+
+def test_consume_holds_its_offset_at_a_gap(feed):
+    handled = []
+    commit_event(1)
+    commit_event(3)
+    assert changes.consume('test', lambda batch: handled.extend(ids(batch))) \
+        == 1
+    assert changes.consume('test', lambda batch: handled.extend(ids(batch))) \
+        == 0
+
+    commit_event(2, age=600)
+    changes.consume('test', lambda batch: handled.extend(ids(batch)))
+    assert handled == [1, 2, 3]
+    assert ChangeFeedOffset.query.get('test').position == 3
+
+
+def test_gap_is_passed_after_the_timeout(feed, monkeypatch):
+    monkeypatch.setitem(app.config, 'CHANGE_FEED_GAP_TIMEOUT', 0)
+    commit_event(1)
+    commit_event(3)
+    assert ids(changes.read(0)) == [1]  # Never closed on first sight
+    assert ids(changes.read(0)) == [1, 3]
+
+
+def test_ids_below_every_consumer_offset_are_not_waited_for(feed):
+    db.session.add(ChangeFeedOffset(consumer='test', position=5))
+    db.session.commit()
+    commit_event(6)
+    commit_event(8)
+    # 1-5 are pruned; 7 may still commit
+    assert ids(changes.read(0)) == [6]
+
+
+def test_outbox_records_committed_writes_only(feed):
+    artist = Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                    genres='{Rock}')
+    db.session.add(artist)
+    db.session.commit()
+    artist_id = artist.id
+    artist.city = 'Oakland'
+    db.session.commit()
+    db.session.add(Artist(name='Never Saved', city='Reno', state='NV',
+                          genres='{Rock}'))
+    db.session.flush()
+    db.session.rollback()
+    changes.delete_where(Artist, Artist.id == artist_id)
+    db.session.commit()
+
+    events = [changes.as_dict(change) for change in changes.read(0)]
+    assert [(event['entity'], event['entity_id'], event['op'])
+            for event in events] == [('artist', artist_id, 'insert'),
+                                     ('artist', artist_id, 'update'),
+                                     ('artist', artist_id, 'delete')]
+    assert events[1]['payload'] == {"id": artist_id, "changed": ['city']}
+
+
+def test_admin_feed_resumes_from_its_cursor(feed):
+    for event_id in (1, 2, 3):
+        commit_event(event_id)
+    client = app.test_client()
+
+    page = client.get('/admin/changes?limit=2').get_json()
+    assert [change['id'] for change in page['changes']] == [1, 2]
+    page = client.get(f'/admin/changes?after={page["next"]}').get_json()
+    assert [change['id'] for change in page['changes']] == [3]
+    page = client.get(f'/admin/changes?after={page["next"]}').get_json()
+    assert page == {"changes": [], "next": 3}
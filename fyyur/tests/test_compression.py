@@ -0,0 +1,58 @@
+import gzip
+import zlib
+
+from flask import Response
+
+from app import app
+from compression import compressor
+
+PAGE = '<p>Guns N Petals at The Musical Hop</p>\n' * 100
+
+
+def compress(response, accept='gzip'):
+    headers = {'Accept-Encoding': accept} if accept else {}
+    with app.test_request_context(headers=headers):
+        return compressor.compress(response)
+
+
+def test_large_text_is_gzipped_with_a_distinct_etag():
+    response = Response(PAGE, mimetype='text/html')
+    response.set_etag('abc')
+
+    response = compress(response)
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.vary
+    assert response.get_etag() == ('abc-gzip', False)
+    assert gzip.decompress(response.get_data()).decode() == PAGE
+
+
+def test_small_and_unaccepted_bodies_still_vary():
+    for response in (compress(Response('<p>hi</p>', mimetype='text/html')),
+                     compress(Response(PAGE, mimetype='text/html'),
+                              accept=None),
+                     compress(Response(PAGE, mimetype='text/html'),
+                              accept='identity')):
+        assert 'Content-Encoding' not in response.headers
+        assert 'Accept-Encoding' in response.vary
+
+
+def test_other_types_and_statuses_are_left_alone():
+    image = compress(Response(b'\x89PNG' * 1000, mimetype='image/png'))
+    assert 'Content-Encoding' not in image.headers
+    assert 'Accept-Encoding' not in image.vary
+
+    not_modified = compress(Response(PAGE, 304, mimetype='text/html'))
+    assert 'Content-Encoding' not in not_modified.headers
+
+
+def test_streams_flush_the_first_chunk():
+    chunks = ['<html><head></head>'] + [PAGE] * 10
+    response = compress(Response(iter(chunks), mimetype='text/html'))
+
+    out = list(response.response)
+
+    assert 'Content-Length' not in response.headers
+    decoder = zlib.decompressobj(31)
+    assert decoder.decompress(out[0]) == b'<html><head></head>'
+    assert gzip.decompress(b''.join(out)).decode() == ''.join(chunks)
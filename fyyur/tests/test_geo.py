@@ -0,0 +1,37 @@
+import math
+
+import pytest
+
+from geo import EARTH_RADIUS_MILES, covering_cells, geohash_encode, haversine
+
+
+def destination(latitude, longitude, bearing, miles):
+    """The point `miles` from the start along `bearing` degrees."""
+    lat, lng = math.radians(latitude), math.radians(longitude)
+    theta, d = math.radians(bearing), miles / EARTH_RADIUS_MILES
+    lat2 = math.asin(math.sin(lat) * math.cos(d) +
+                     math.cos(lat) * math.sin(d) * math.cos(theta))
+    lng2 = lng + math.atan2(math.sin(theta) * math.sin(d) * math.cos(lat),
+                            math.cos(d) - math.sin(lat) * math.sin(lat2))
+    return math.degrees(lat2), (math.degrees(lng2) + 540) % 360 - 180
+
+
+@pytest.mark.parametrize('latitude, longitude, radius', [
+    (37.77, -122.42, 25),
+    (47.61, -122.33, 200),
+    (64.84, -147.72, 150),
+    (81.53, 175.19, 453),   # Wider at the poleward edge than the centre
+    (-54.80, -68.30, 300),
+    (61.22, 179.90, 100)    # Across the antimeridian
+])
+def test_cells_cover_the_whole_circle(latitude, longitude, radius):
+    cells = covering_cells(latitude, longitude, radius)
+
+    for bearing in range(0, 360, 2):
+        point = destination(latitude, longitude, bearing, radius * 0.999)
+        assert haversine(latitude, longitude, *point) <= radius
+        assert geohash_encode(*point).startswith(tuple(cells)), bearing
+
+
+def test_circle_reaching_a_pole_is_not_filtered():
+    assert covering_cells(89.0, 10.0, 100) == ['']
@@ -0,0 +1,115 @@
+import functools
+import http.server
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+import image_cache as image_cache_module
+from image_cache import ImageCache
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+class FixtureHandler(http.server.SimpleHTTPRequestHandler):
+    hits = 0
+
+    def do_GET(self):
+        FixtureHandler.hits += 1
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ImageCache()
+    cache.directory = str(tmp_path)
+    cache.widths = (160, 320)
+    os.makedirs(tmp_path / 'urls')
+    return cache
+
+
+@pytest.fixture
+def poster_url():
+    FixtureHandler.hits = 0
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0),
+        functools.partial(FixtureHandler, directory=FIXTURES))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/poster.jpg'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def loopback_allowed(monkeypatch):
+    # The fixture server is on loopback, which fetches normally refuse
+    monkeypatch.setattr(image_cache_module, 'is_public', lambda address: True)
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1/poster.jpg',
+    'http://localhost:8000/poster.jpg',
+    'http://10.1.2.3/poster.jpg',
+    'http://192.168.0.1/poster.jpg',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://[::1]/poster.jpg',
+    'http://0.0.0.0/poster.jpg'
+])
+def test_refuses_private_and_reserved_addresses(cache, url):
+    with pytest.raises(ValueError, match='not a public address'):
+        cache.source(url)
+
+
+def test_refuses_the_fixture_server_without_the_override(cache, poster_url):
+    with pytest.raises(ValueError):
+        cache.source(poster_url)
+    assert FixtureHandler.hits == 0
+
+
+def test_builds_variants_from_the_fixture(cache, poster_url,
+                                          loopback_allowed):
+    path, mimetype = cache.variant(poster_url, 160, 'jpeg')
+
+    assert mimetype == 'image/jpeg'
+    with Image.open(path) as image:
+        assert image.format == 'JPEG'
+        assert image.size[0] == 160
+    cache.variant(poster_url, 320, 'jpeg')
+    assert FixtureHandler.hits == 1
+
+
+def test_evicts_least_recently_used_and_refetches(cache, poster_url,
+                                                  loopback_allowed):
+    small, _ = cache.variant(poster_url, 160, 'jpeg')
+    large, _ = cache.variant(poster_url, 320, 'jpeg')
+    source = os.path.join(cache.directory, os.path.basename(small)
+                          .split('-')[0])
+    for path, mtime in ((source, 1000), (large, 2000), (small, 3000)):
+        os.utime(path, (mtime, mtime))
+
+    cache.cache_max_bytes = os.path.getsize(small) * 10 // 9 + 10
+    cache.evict()
+
+    assert os.path.exists(small)
+    assert not os.path.exists(large)
+    assert not os.path.exists(source)
+    rebuilt, _ = cache.variant(poster_url, 320, 'jpeg')
+    assert rebuilt == large and os.path.exists(large)
+    assert FixtureHandler.hits == 2
+
+
+def test_source_over_the_pixel_cap_counts_as_a_failed_fetch(
+        cache, poster_url, loopback_allowed):
+    cache.max_pixels = 100 * 100
+
+    with pytest.raises(ValueError, match='pixels'):
+        cache.variant(poster_url, 160, 'jpeg')
+    with pytest.raises(ValueError, match='failed recently'):
+        cache.variant(poster_url, 160, 'jpeg')
+    assert FixtureHandler.hits == 1
+    assert not [name for name in os.listdir(cache.directory)
+                if name != 'urls']
@@ -0,0 +1,100 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+import jobs
+from app import app
+from models import db, Job
+
+calls = []
+
+
+@jobs.job('test-record', queue='test')
+def record(value):
+    calls.append(value)
+
+
+@jobs.job('test-fail', queue='test', max_attempts=2)
+def fail():
+    raise RuntimeError('always fails')
+
+
+@pytest.fixture
+def queue():
+    with app.app_context():
+        Job.query.delete()
+        db.session.commit()
+        calls.clear()
+        yield
+        db.session.rollback()
+        Job.query.delete()
+        db.session.commit()
+
+
+def test_enqueue_dedupes_against_queued_jobs_only(queue):
+    jobs.enqueue('test-record', dedupe_key='record:1', value=1)
+    db.session.commit()
+    jobs.enqueue('test-record', dedupe_key='record:1', value=1)
+    db.session.commit()
+    assert Job.query.count() == 1
+
+    assert jobs.claim('test', 'worker') is not None
+    # A running job may have read its input already; queue another
+    jobs.enqueue('test-record', dedupe_key='record:1', value=1)
+    db.session.commit()
+    assert Job.query.filter(Job.status == 'queued').count() == 1
+
+
+def test_claim_loses_to_a_worker_that_moved_the_job_first(queue):
+    jobs.enqueue('test-record', value=1)
+    db.session.commit()
+    raced = []
+
+    # Another worker's compare-and-set lands between this worker's read of
+    # the job and its own update
+    def other_worker_claims(connection, cursor, statement, parameters,
+                            context, executemany):
+        if statement.startswith('UPDATE jobs') and not raced:
+            raced.append(1)
+            cursor.execute("UPDATE jobs SET status = 'running', "
+                           "attempts = attempts + 1, locked_by = 'other'")
+
+    event.listen(db.engine, 'before_cursor_execute', other_worker_claims)
+    try:
+        assert jobs.claim('test', 'worker') is None
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', other_worker_claims)
+
+    job = Job.query.one()
+    assert raced
+    assert (job.status, job.attempts, job.locked_by) == \
+        ('running', 1, 'other')
+
+
+def test_run_one_deletes_a_job_that_succeeds(queue):
+    jobs.enqueue('test-record', value=7)
+    db.session.commit()
+
+    assert jobs.run_one('test', 'worker')
+    assert calls == [7]
+    assert Job.query.count() == 0
+    assert not jobs.run_one('test', 'worker')
+
+
+def test_failures_back_off_then_stay_failed(queue):
+    jobs.enqueue('test-fail')
+    db.session.commit()
+
+    assert jobs.run_one('test', 'worker')
+    job = Job.query.one()
+    assert (job.status, job.attempts) == ('queued', 1)
+    assert job.run_at > datetime.utcnow()
+    assert 'always fails' in job.last_error
+    assert not jobs.run_one('test', 'worker')  # Not due yet
+
+    job.run_at = datetime.utcnow()
+    db.session.commit()
+    assert jobs.run_one('test', 'worker')
+    job = Job.query.one()
+    assert (job.status, job.attempts, job.locked_by) == ('failed', 2, None)
@@ -0,0 +1,51 @@
+import json
+import os
+
+import pytest
+from flask import Flask
+
+from logging_pipeline import setup_logging
+
+
+@pytest.fixture
+def logged_app(tmp_path):
+    app = Flask(__name__)
+    app.config.update(LOG_PATH=str(tmp_path / 'logs' / 'error.log'),
+                      LOG_ROTATE_WHEN='midnight', LOG_BACKUP_COUNT=1,
+                      LOG_MAX_BYTES=0, LOG_LEVEL='INFO',
+                      LOG_DEBUG_SAMPLE_RATE=0.0)
+    return app, setup_logging(app)
+
+
+def messages(app):
+    with open(app.config['LOG_PATH']) as f:
+        return [json.loads(line)['message'] for line in f]
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_forked_child_logs_through_its_own_queue(logged_app):
+    app, listener = logged_app
+    # Hold a record in the queue across the fork
+    listener.stop()
+    app.logger.warning('queued before the fork')
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            child = app.extensions['log_listener']
+            ok = child is not listener and \
+                app.logger.handlers[0].queue is child.queue
+            app.logger.warning('from the child')
+            child.stop()
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    listener.start()
+    app.logger.warning('from the parent')
+    listener.stop()
+    written = messages(app)
+    listener.start()  # setup_logging registered its stop at exit
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert sorted(written) == ['from the child', 'from the parent',
+                               'queued before the fork']
@@ -0,0 +1,61 @@
+import gc
+import tracemalloc
+
+import pytest
+from flask import Flask, Response
+
+from memory_profiling import MemoryMonitor
+
+
+@pytest.fixture
+def traced_app():
+    app = Flask(__name__)
+    app.config.update(MEMORY_SAMPLE_RATE=1.0, PROFILE_TOKEN='',
+                      MEMORY_TRACE_FRAMES=1, MEMORY_TOP_SITES=5,
+                      MEMORY_RSS_LIMIT_MB=0)
+    monitor = MemoryMonitor()
+    monitor.init_app(app)
+
+    @app.route('/page')
+    def page():
+        return 'x' * 100
+
+    @app.route('/stream')
+    def stream():
+        return Response(iter(['a', 'b', 'c']), mimetype='text/plain')
+
+    assert not tracemalloc.is_tracing()
+    yield app, monitor
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def test_whole_body_is_measured_before_it_is_sent(traced_app):
+    app, monitor = traced_app
+    response = app.test_client().get('/page')
+
+    assert int(response.headers['X-Memory-Peak']) > 0
+    assert not tracemalloc.is_tracing()
+    assert monitor.routes['page'].samples == 1
+
+
+def test_stream_that_is_never_closed_releases_the_trace(traced_app):
+    app, monitor = traced_app
+    response = app.test_client().get('/stream', buffered=False)
+    assert tracemalloc.is_tracing()
+
+    del response
+    gc.collect()
+
+    assert not tracemalloc.is_tracing()
+    assert monitor._tracing.acquire(blocking=False)
+    assert monitor.routes['stream'].samples == 1
+
+
+def test_stream_read_to_the_end_releases_the_trace(traced_app):
+    app, monitor = traced_app
+    response = app.test_client().get('/stream', buffered=False)
+
+    assert b''.join(response.response) == b'abc'
+    assert not tracemalloc.is_tracing()
+    assert monitor.routes['stream'].samples == 1
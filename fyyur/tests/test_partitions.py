@@ -0,0 +1,96 @@
+import os
+from datetime import date, datetime
+
+import pytest
+import sqlalchemy as sa
+
+import partitions
+
+POSTGRES_URL = os.environ.get('FYYUR_TEST_POSTGRES_URL')
+
+
+class Rows(list):
+    def fetchall(self):
+        return list(self)
+
+
+class RecordingBind:
+    """Stands in for a session: answers the partition listing and records
+    every other statement."""
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.statements = []
+
+    def execute(self, clause, params=None):
+        sql = ' '.join(str(clause).split())
+        if 'pg_inherits' in sql:
+            return Rows((name,) for name in self.existing)
+        self.statements.append(sql)
+
+
+def test_extend_moves_default_rows_while_it_is_detached():
+    bind = RecordingBind(['shows_default', 'shows_m202601'])
+    created = partitions.ensure_monthly_partitions(
+        bind, months_ahead=2, today=date(2026, 1, 15))
+
+    assert created == ['shows_m202602', 'shows_m202603']
+    assert bind.statements[0] == \
+        'ALTER TABLE shows DETACH PARTITION shows_default'
+    assert bind.statements[-1] == \
+        'ALTER TABLE shows ATTACH PARTITION shows_default DEFAULT'
+    creates = [i for i, s in enumerate(bind.statements)
+               if s.startswith('CREATE TABLE')]
+    moves = [i for i, s in enumerate(bind.statements)
+             if s.startswith('WITH moved AS (DELETE FROM shows_default')]
+    assert len(creates) == len(moves) == 2
+    assert max(creates) < min(moves)
+
+
+def test_extend_without_default_only_creates():
+    bind = RecordingBind(['shows_m202601'])
+    partitions.ensure_monthly_partitions(
+        bind, months_ahead=1, today=date(2026, 1, 1))
+    assert len(bind.statements) == 1
+    assert bind.statements[0].startswith(
+        'CREATE TABLE IF NOT EXISTS shows_m202602 PARTITION OF shows')
+
+
+def test_extend_with_nothing_missing_leaves_default_attached():
+    bind = RecordingBind(['shows_default', 'shows_m202601'])
+    assert partitions.ensure_monthly_partitions(
+        bind, months_ahead=0, today=date(2026, 1, 1)) == []
+    assert bind.statements == []
+
+
+@pytest.mark.skipif(POSTGRES_URL is None,
+                    reason='set FYYUR_TEST_POSTGRES_URL to run')
+def test_extend_after_a_show_landed_in_default():
+    engine = sa.create_engine(POSTGRES_URL)
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            connection.execute('CREATE SCHEMA fyyur_partition_test')
+            connection.execute('SET LOCAL search_path = fyyur_partition_test')
+            connection.execute(
+                'CREATE TABLE shows (id INTEGER, venue_id INTEGER, '
+                'artist_id INTEGER, start_time TIMESTAMP NOT NULL) '
+                'PARTITION BY RANGE (start_time)')
+            partitions.create_partition(connection, date(2026, 1, 1),
+                                        date(2026, 2, 1), 'shows_m202601')
+            connection.execute(
+                'CREATE TABLE shows_default PARTITION OF shows DEFAULT')
+            connection.execute(
+                "INSERT INTO shows VALUES (1, 1, 1, '2026-03-14 20:00')")
+
+            partitions.ensure_monthly_partitions(
+                connection, months_ahead=3, today=date(2026, 1, 1))
+
+            assert connection.execute(
+                'SELECT count(*) FROM shows_default').scalar() == 0
+            assert connection.execute(
+                'SELECT start_time FROM shows_m202603').scalar() == \
+                datetime(2026, 3, 14, 20, 0)
+            assert 'shows_default' in partitions.list_partitions(connection)
+        finally:
+            transaction.rollback()
@@ -0,0 +1,86 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import read_model
+from app import app
+from models import db, Artist, Venue, Show, PageDocument
+
+
+@pytest.fixture
+def venue():
+    with app.app_context():
+        venue = Venue(name='The Musical Hop', city='San Francisco',
+                      state='CA', address='1015 Folsom Street',
+                      genres='{Jazz,Swing}')
+        db.session.add(venue)
+        db.session.commit()
+        yield venue
+        db.session.rollback()
+        PageDocument.query.delete()
+        Show.query.delete()
+        Artist.query.delete()
+        Venue.query.delete()
+        db.session.commit()
+
+
+def stored(venue):
+    return PageDocument.query.get(('venue', venue.id))
+
+
+def test_load_builds_a_missing_document(venue):
+    assert stored(venue) is None
+
+    document = read_model.load('venue', venue.id)
+
+    assert document['name'] == 'The Musical Hop'
+    assert document['genres'] == ['Jazz', 'Swing']
+    assert json.loads(stored(venue).document)['name'] == 'The Musical Hop'
+    assert read_model.load('venue', venue.id + 1000) is None
+
+
+def test_load_serves_a_fresh_document_and_rebuilds_a_stale_one(venue):
+    read_model.load('venue', venue.id)
+    venue.name = 'The Musical Hop II'
+    db.session.commit()
+
+    # Nothing rebuilt the document, so a fresh one still has the old name
+    assert read_model.load('venue', venue.id)['name'] == 'The Musical Hop'
+
+    max_age = app.config['PAGE_DOCUMENT_MAX_AGE']
+    stored(venue).built_at = datetime.utcnow() - timedelta(
+        seconds=max_age + 1)
+    db.session.commit()
+    assert read_model.load('venue', venue.id)['name'] == \
+        'The Musical Hop II'
+    assert stored(venue).built_at > datetime.utcnow() - timedelta(minutes=1)
+
+
+def test_started_shows_move_to_the_past_on_read(venue):
+    artist = Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                    genres='{Rock}')
+    start = datetime.now() + timedelta(hours=1)
+    db.session.add(Show(id=1, venue=venue, artist=artist, start_time=start))
+    db.session.commit()
+    document = json.loads(json.dumps(read_model.build('venue', venue.id)))
+    assert len(document['upcoming_shows']) == 1
+
+    document = read_model.settle(document, now=start + timedelta(minutes=1))
+
+    assert document['upcoming_shows'] == []
+    assert document['upcoming_shows_count'] == 0
+    assert document['past_shows_count'] == 1
+    assert document['past_shows'][0]['artist_name'] == 'Guns N Petals'
+
+
+def test_check_reports_and_fixes_drifted_documents(venue):
+    read_model.load('venue', venue.id)
+    venue.name = 'The Musical Hop II'
+    db.session.add(PageDocument(kind='artist', entity_id=999,
+                                document='{}', built_at=datetime.utcnow()))
+    db.session.commit()
+
+    assert read_model.check(fix=True) == [('artist', 999, 'orphaned'),
+                                          ('venue', venue.id, 'stale')]
+    assert read_model.check() == []
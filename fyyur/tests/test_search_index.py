@@ -0,0 +1,88 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from app import app
+from models import db, Artist, Venue, Show
+from search_index import SearchIndex, artist_doc
+
+
+@pytest.fixture
+def index(tmp_path):
+    with app.app_context():
+        index = SearchIndex()
+        index.path = str(tmp_path / 'search.idx')
+        index.delta_path = index.path + '.delta'
+        yield index
+        db.session.rollback()
+        Show.query.delete()
+        Artist.query.delete()
+        Venue.query.delete()
+        db.session.commit()
+
+
+def add_artist(name):
+    artist = Artist(name=name, city='San Francisco', state='CA',
+                    genres='{Rock}')
+    db.session.add(artist)
+    db.session.commit()
+    return artist
+
+
+def titles(results):
+    return [doc['title'] for doc in results]
+
+
+def test_edits_go_to_the_delta_and_hide_the_main_copy(index):
+    artist = add_artist('Guns N Petals')
+    index.rebuild()
+    main = os.stat(index.path)
+
+    artist.name = 'Guns N Roses'
+    db.session.commit()
+    index.apply([artist_doc(artist)], shows_of=[('artist', artist.id)])
+
+    assert os.stat(index.path).st_ino == main.st_ino
+    assert os.path.exists(index.delta_path)
+    assert index.search('petals') == []
+    assert titles(index.search('roses')) == ['Guns N Roses']
+
+
+def test_delta_is_merged_at_the_threshold(index):
+    first = add_artist('The Wild Sax Band')
+    second = add_artist('Matt Quevedo')
+    index.rebuild()
+    index.delta_max = 3
+
+    index.apply(keys=[f'artist:{first.id}'])
+    assert os.path.exists(index.delta_path)
+    assert index.search('sax') == []
+
+    second.name = 'Matt Quevedo Trio'
+    db.session.commit()
+    index.apply([artist_doc(second)])  # Two markers and a doc: merged
+
+    assert not os.path.exists(index.delta_path)
+    assert index.search('sax') == []
+    assert titles(index.search('quevedo')) == ['Matt Quevedo Trio']
+    assert [doc['key'] for doc in index.current().docs()] == \
+        [f'artist:{second.id}']
+
+
+def test_shows_of_marker_drops_an_artists_shows(index):
+    artist = add_artist('Guns N Petals')
+    venue = Venue(name='The Musical Hop', city='San Francisco', state='CA',
+                  address='1015 Folsom Street')
+    db.session.add(venue)
+    db.session.add(Show(id=1, venue=venue, artist=artist,
+                        start_time=datetime(2026, 5, 21, 21, 30)))
+    db.session.commit()
+    index.rebuild()
+    assert titles(index.search('petals', kinds=('show',))) == \
+        ['Guns N Petals at The Musical Hop']
+
+    index.apply(shows_of=[('artist', artist.id)])
+
+    assert index.search('petals', kinds=('show',)) == []
+    assert titles(index.search('petals')) == ['Guns N Petals']